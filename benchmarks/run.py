@@ -0,0 +1,223 @@
+"""Measure how the manager scales with the number of VLANs.
+
+Usage:
+    python -m benchmarks.run [--sizes 10,100,1000,4094] [--output results.json]
+    python -m benchmarks.run --compare old.json new.json
+
+Every size runs in a fresh temporary directory with subprocesses stubbed
+out, so nothing on the host is touched. Each phase is run twice: once for
+wall time and file-operation counts, once under tracemalloc for
+allocations (tracing slows the code down too much to time it). Results
+are printed or written as JSON so runs can be compared between releases.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import subprocess
+from unittest.mock import patch
+
+from vlan_manager.config import Config
+from vlan_manager.core import VlanManager
+
+DEFAULT_SIZES = (10, 100, 1000, 4094)
+
+# Audit events counted as file operations, grouped under a short name.
+FILE_EVENTS = {
+    'open': 'open',
+    'os.rename': 'rename',
+    'os.replace': 'rename',
+    'os.remove': 'remove',
+    'os.unlink': 'remove',
+    'os.mkdir': 'mkdir',
+    'os.listdir': 'listdir',
+    'os.scandir': 'listdir',
+    'os.chmod': 'chmod',
+}
+
+CONFIG_KEYS = ('DATA_FILE', 'SQLITE_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'KEA6_CONFIG_FILE',
+               'SYSCTL_FILE', 'APPLY_JOBS_DIR', 'KEA_CONTROL_SOCKET', 'KEA6_CONTROL_SOCKET', 'KEA_CONFIG_MODE')
+
+
+class FileOpCounter:
+    """Count file operations through an audit hook while active.
+
+    Audit hooks cannot be removed, so one hook is installed per process
+    and only counts between ``start()`` and ``stop()``.
+    """
+
+    _installed = None
+
+    def __init__(self):
+        self.counts = None
+
+    @classmethod
+    def get(cls):
+        if cls._installed is None:
+            cls._installed = cls()
+            sys.addaudithook(cls._installed._hook)
+        return cls._installed
+
+    def _hook(self, event, args):
+        if self.counts is not None and event in FILE_EVENTS:
+            name = FILE_EVENTS[event]
+            self.counts[name] = self.counts.get(name, 0) + 1
+
+    def start(self):
+        self.counts = {}
+
+    def stop(self):
+        counts, self.counts = self.counts, None
+        return counts
+
+
+def synthetic_vlans(count):
+    """``count`` non-overlapping /24 VLANs with a mix of DHCP and NAT.
+
+    Every fourth VLAN is dual-stack with a /64 out of one /48.
+    """
+    vlans = []
+    for i in range(1, count + 1):
+        vlans.append({
+            "id": i,
+            "cidr": f"10.{i // 256}.{i % 256}.1/24",
+            "dhcp": i % 3 != 0,
+            "nat": i % 2 == 0,
+            "forwarding": True,
+        })
+        if i % 4 == 0:
+            vlans[-1].update(cidr6=f"2001:db8:0:{i:x}::1/64", dhcp6=i % 8 == 0)
+    return vlans
+
+
+def stub_run(cmd, **kwargs):
+    return subprocess.CompletedProcess(cmd, 0, stdout='', stderr='')
+
+
+def phases(vlans):
+    """The measured phases, in order; each takes the manager built so far."""
+    def add_vlans(state):
+        manager = state['manager']
+        for vlan in vlans:
+            manager.add_vlan(dict(vlan))
+
+    return [
+        ('add_vlan', add_vlans),
+        ('check_for_overlaps', lambda s: s['manager']._check_for_overlaps(s['manager'].vlans)),
+        ('generate_systemd_config', lambda s: s['manager'].generate_systemd_config()),
+        ('generate_systemd_config_unchanged', lambda s: s['manager'].generate_systemd_config()),
+        ('generate_nftables_config', lambda s: s['manager'].generate_nftables_config()),
+        ('generate_kea_config', lambda s: s['manager'].generate_kea_config()),
+        ('load_vlans', lambda s: s['manager'].load_vlans()),
+        ('new_manager', lambda s: VlanManager()),
+        ('apply_config', lambda s: s['manager'].apply_config()),
+    ]
+
+
+def configure(directory):
+    Config.DATA_FILE = os.path.join(directory, 'vlans.json')
+    Config.SQLITE_FILE = os.path.join(directory, 'vlans.db')
+    Config.NETWORK_DIR = os.path.join(directory, 'network')
+    Config.NFTABLES_DIR = os.path.join(directory, 'nftables')
+    Config.KEA_CONFIG_FILE = os.path.join(directory, 'kea', 'kea-dhcp4.conf')
+    Config.KEA6_CONFIG_FILE = os.path.join(directory, 'kea', 'kea-dhcp6.conf')
+    Config.SYSCTL_FILE = os.path.join(directory, '99-vlan-manager.conf')
+    Config.APPLY_JOBS_DIR = os.path.join(directory, 'jobs')
+    Config.KEA_CONTROL_SOCKET = None
+    Config.KEA6_CONTROL_SOCKET = None
+    Config.KEA_CONFIG_MODE = 'replace'
+
+
+def run_pass(count, trace_memory):
+    """Run every phase once in a fresh directory; returns {phase: metrics}."""
+    saved = {k: getattr(Config, k) for k in CONFIG_KEYS}
+    directory = tempfile.mkdtemp(prefix='vlan-bench-')
+    counter = FileOpCounter.get()
+    results = {}
+    try:
+        configure(directory)
+        state = {'manager': VlanManager()}
+        with patch('vlan_manager.commands.subprocess.run', stub_run):
+            for name, func in phases(synthetic_vlans(count)):
+                if trace_memory:
+                    tracemalloc.start()
+                    before = tracemalloc.get_traced_memory()[0]
+                    func(state)
+                    current, peak = tracemalloc.get_traced_memory()
+                    tracemalloc.stop()
+                    results[name] = {"alloc_peak_bytes": peak - before, "alloc_net_bytes": current - before}
+                else:
+                    counter.start()
+                    start = time.perf_counter()
+                    func(state)
+                    elapsed = time.perf_counter() - start
+                    results[name] = {"seconds": elapsed, "file_ops": counter.stop()}
+    finally:
+        counter.stop()
+        shutil.rmtree(directory, ignore_errors=True)
+        for key, value in saved.items():
+            setattr(Config, key, value)
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, memory=True):
+    results = {}
+    for count in sizes:
+        phases_ = run_pass(count, trace_memory=False)
+        if memory:
+            for name, metrics in run_pass(count, trace_memory=True).items():
+                phases_[name].update(metrics)
+        results[str(count)] = phases_
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "timestamp": time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        "store_backend": Config.STORE_BACKEND,
+        "results": results,
+    }
+
+
+def compare(old, new):
+    """Yield one line per size/phase with the time ratio new/old."""
+    for size, phases_ in new['results'].items():
+        for name, metrics in phases_.items():
+            before = old['results'].get(size, {}).get(name)
+            if not before or not before.get('seconds'):
+                continue
+            ratio = metrics['seconds'] / before['seconds']
+            yield f"{size:>6} {name:<36} {before['seconds']:10.4f}s -> {metrics['seconds']:10.4f}s  x{ratio:.2f}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='comma separated VLAN counts')
+    parser.add_argument('--output', help='write JSON here instead of stdout')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc pass')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f_old, open(args.compare[1]) as f_new:
+            for line in compare(json.load(f_old), json.load(f_new)):
+                print(line)
+        return 0
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    report = run_benchmarks(sizes, memory=not args.no_memory)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
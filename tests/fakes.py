@@ -0,0 +1,64 @@
+import os
+import json
+import stat
+from unittest.mock import patch
+
+FAKE_SCRIPT = """#!/usr/bin/env python3
+import json, os, sys
+name = os.path.basename(sys.argv[0])
+stdin = '' if sys.stdin.isatty() else sys.stdin.read()
+with open(os.environ['FAKE_BIN_LOG'], 'a') as f:
+    f.write(json.dumps({"argv": [name] + sys.argv[1:], "stdin": stdin}) + "\\n")
+stdout = os.path.join(os.environ['FAKE_BIN_DIR'], name + '.stdout')
+if os.path.exists(stdout):
+    with open(stdout) as f:
+        sys.stdout.write(f.read())
+sys.exit(int(os.environ.get('FAKE_EXIT_' + name.upper(), '0')))
+"""
+
+
+class FakeBinaries:
+    """Put recording stand-ins for system binaries first on PATH.
+
+    Every invocation is appended to a log; ``calls()`` returns the argv
+    lists in order. ``set_output(name, text)`` makes a fake print ``text``.
+    """
+
+    def __init__(self, directory, names):
+        self.directory = os.path.abspath(directory)
+        self.log = os.path.join(self.directory, 'calls.log')
+        os.makedirs(self.directory, exist_ok=True)
+        for name in names:
+            path = os.path.join(self.directory, name)
+            with open(path, 'w') as f:
+                f.write(FAKE_SCRIPT)
+            os.chmod(path, os.stat(path).st_mode | stat.S_IEXEC)
+        self._patch = patch.dict(os.environ, {
+            'PATH': self.directory + os.pathsep + os.environ.get('PATH', ''),
+            'FAKE_BIN_LOG': self.log,
+            'FAKE_BIN_DIR': self.directory,
+        })
+
+    def __enter__(self):
+        self._patch.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._patch.stop()
+
+    def set_output(self, name, text):
+        with open(os.path.join(self.directory, name + '.stdout'), 'w') as f:
+            f.write(text)
+
+    def entries(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return [json.loads(line) for line in f]
+
+    def calls(self, name=None):
+        return [e['argv'] for e in self.entries() if name is None or e['argv'][0] == name]
+
+    def reset(self):
+        if os.path.exists(self.log):
+            os.remove(self.log)
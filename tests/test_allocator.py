@@ -0,0 +1,140 @@
+import unittest
+import os
+import random
+import shutil
+import ipaddress
+import threading
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager.allocator import AllocationError, parse_id_ranges, id_bitmap, lowest_free_id
+from vlan_manager.netindex import FreeSpaceTree
+
+class TestFreeSpace(unittest.TestCase):
+    def test_tree_matches_brute_force(self):
+        rng = random.Random(7)
+        supernet = ipaddress.ip_network('10.0.0.0/16')
+        tree = FreeSpaceTree(4)
+        used = []
+        for _ in range(300):
+            prefixlen = rng.choice([18, 20, 24, 26, 30])
+            expected = next((int(n.network_address) for n in supernet.subnets(new_prefix=prefixlen)
+                             if not any(n.overlaps(u) for u in used)), None)
+            self.assertEqual(tree.first_free(supernet, prefixlen), expected)
+            if expected is not None:
+                used.append(ipaddress.ip_network((expected, prefixlen)))
+                tree.mark(used[-1])
+            if used and rng.random() < 0.3:
+                tree.unmark(used.pop(rng.randrange(len(used))))
+
+        for network in used:
+            tree.unmark(network)
+        self.assertEqual(tree._largest, {})
+
+    def test_covering_network_and_double_marks(self):
+        tree = FreeSpaceTree(6)
+        supernet = ipaddress.ip_network('2001:db8::/48')
+        reservation = ipaddress.ip_network('2001:db8::/32')
+        vlan = ipaddress.ip_network('2001:db8::/64')
+        tree.mark(reservation)
+        tree.mark(vlan)
+        self.assertIsNone(tree.first_free(supernet, 64))
+        tree.unmark(reservation)
+        self.assertEqual(tree.first_free(supernet, 64), int(ipaddress.ip_address('2001:db8:0:1::')))
+
+    def test_lowest_free_id(self):
+        self.assertEqual(parse_id_ranges("200-299, 2"), [(2, 2), (200, 299)])
+        self.assertEqual(parse_id_ranges((10, 20)), [(10, 20)])
+        with self.assertRaises(ValueError):
+            parse_id_ranges("0-5000")
+        used = id_bitmap([2, 200, 201, 203])
+        self.assertEqual(lowest_free_id(used, parse_id_ranges("2, 200-299")), 202)
+        self.assertIsNone(lowest_free_id(used, [(200, 201)]))
+
+class TestAllocate(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_allocator_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'ALLOCATION_SUPERNETS', 'ALLOCATION_SUPERNETS6', 'ALLOCATION_RESERVED',
+            'ALLOCATION_ID_RANGE', 'ALLOCATION_RESERVED_IDS')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.ALLOCATION_SUPERNETS = '10.20.0.0/16'
+        Config.ALLOCATION_SUPERNETS6 = '2001:db8::/48'
+        Config.ALLOCATION_RESERVED = '10.20.0.0/24'
+        Config.ALLOCATION_ID_RANGE = '2-4094'
+        Config.ALLOCATION_RESERVED_IDS = '3'
+
+        self.manager = VlanManager()
+        self.manager.add_vlan({"id": 2, "cidr": "10.20.1.1/24"})
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def test_skips_used_and_reserved_space(self):
+        vlan = self.manager.allocate(24, dhcp=True)
+        self.assertEqual((vlan['id'], vlan['cidr']), (4, '10.20.2.1/24'))
+        self.assertEqual(vlan['dhcp_gateway'], '10.20.2.1')
+        self.assertEqual(self.manager.get_vlan(4), vlan)
+
+        vlan = self.manager.allocate(26, id_range="100-199", prefixlen6=64)
+        self.assertEqual((vlan['id'], vlan['cidr'], vlan['cidr6']), (100, '10.20.3.1/26', '2001:db8::1/64'))
+
+        # IDs are per trunk; an IPv6-only VLAN keeps its prefix in cidr
+        vlan = self.manager.allocate(prefixlen6=64, parent='bond1')
+        self.assertEqual((vlan['id'], vlan['parent'], vlan['cidr']), (2, 'bond1', '2001:db8:0:1::1/64'))
+
+        self.manager.delete_vlan(4)
+        self.assertEqual(self.manager.allocate(24)['cidr'], '10.20.2.1/24')
+
+    def test_used_ids_follow_every_change(self):
+        self.manager.add_vlans([{"id": 4, "cidr": "10.20.4.1/24"}, {"id": 5, "cidr": "10.20.5.1/24"}])
+        self.assertEqual(self.manager.allocate(24)['id'], 6)
+        self.manager.delete_vlan(5)
+        self.assertEqual(self.manager.allocate(24)['id'], 5)
+
+        # IDs taken by another process are seen after the reload
+        VlanManager().add_vlan({"id": 7, "cidr": "10.20.7.1/24"})
+        self.assertEqual(self.manager.allocate(24)['id'], 8)
+
+    def test_exhaustion(self):
+        with self.assertRaisesRegex(AllocationError, 'No free /24 left in 10.20.0.0/23'):
+            self.manager.allocate(24, supernet='10.20.0.0/23')
+        with self.assertRaisesRegex(AllocationError, 'No free VLAN ID in 2-3'):
+            self.manager.allocate(24, id_range='2-3')
+        with self.assertRaisesRegex(ValueError, 'does not fit'):
+            self.manager.allocate(8)
+        self.assertEqual(len(self.manager.vlans), 1)
+
+    def test_concurrent_allocations_do_not_collide(self):
+        # Separate managers share the store like gunicorn workers do
+        managers = [VlanManager() for _ in range(4)]
+        results = []
+        errors = []
+
+        def worker(manager):
+            for _ in range(5):
+                try:
+                    results.append(manager.allocate(28))
+                except Exception as e:
+                    errors.append(e)
+
+        threads = [threading.Thread(target=worker, args=(m,)) for m in managers]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(len({v['id'] for v in results}), 20)
+        self.assertEqual(len({v['cidr'] for v in results}), 20)
+        self.manager.refresh()
+        self.assertEqual(len(self.manager.vlans), 21)
+
+if __name__ == '__main__':
+    unittest.main()
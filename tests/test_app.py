@@ -23,6 +23,7 @@ class TestVlanApp(unittest.TestCase):
         Config.PARENT_INTERFACE = 'br0'
         Config.WAN_INTERFACE = 'eth0'
 
+        self.original_manager = app_module.vlan_manager
         app_module.vlan_manager = VlanManager()
 
         self.app = app_module.app.test_client()
@@ -38,6 +39,7 @@ class TestVlanApp(unittest.TestCase):
         Config.DATA_FILE = self.original_data_file
         Config.NETWORK_DIR = self.original_network_dir
         Config.NFTABLES_DIR = self.original_nftables_dir
+        app_module.vlan_manager = self.original_manager
 
     def test_get_vlans(self):
         response = self.app.get('/api/vlans')
@@ -59,6 +61,150 @@ class TestVlanApp(unittest.TestCase):
         self.assertEqual(len(response.json), 1)
         self.assertEqual(response.json[0]['id'], 40)
 
+    def test_get_and_update_vlan(self):
+        self.app.post('/api/vlans', json={"id": 40, "cidr": "192.168.40.1/24"})
+
+        response = self.app.get('/api/vlans/40')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['cidr'], "192.168.40.1/24")
+        self.assertEqual(self.app.get('/api/vlans/41').status_code, 404)
+
+        response = self.app.patch('/api/vlans/40', json={"nat": True})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json['nat'])
+        self.assertEqual(self.app.patch('/api/vlans/40', json={"cidr": "bad"}).status_code, 400)
+        self.assertEqual(self.app.patch('/api/vlans/40', json=["nat"]).status_code, 400)
+        self.assertEqual(self.app.patch('/api/vlans/40', json="nat").status_code, 400)
+        self.assertEqual(self.app.patch('/api/vlans/41', json={"nat": True}).status_code, 404)
+
+    def test_allocate(self):
+        self.app.post('/api/vlans', json={"id": 2, "cidr": "10.0.0.1/24"})
+        response = self.app.post('/api/vlans/allocate', json={"prefixlen": 24, "id_range": "100-110", "nat": True})
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual((response.json['id'], response.json['cidr']), (100, '10.0.1.1/24'))
+        self.assertTrue(response.json['nat'])
+
+        response = self.app.post('/api/vlans/allocate', json={"prefixlen": 24, "supernet": "10.0.0.0/23"})
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.app.post('/api/vlans/allocate', json={"prefixlen": "x"}).status_code, 400)
+
+    def test_list_etag(self):
+        self.app.post('/api/vlans', json={"id": 10, "cidr": "192.168.10.1/24"})
+        response = self.app.get('/api/vlans')
+        etag = response.headers['ETag']
+        self.assertTrue(etag.startswith(f'"r{app_module.vlan_manager.revision}-'))
+
+        response = self.app.get('/api/vlans', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.get_data(), b'')
+        self.assertEqual(self.app.get('/api/vlans/10', headers={'If-None-Match': etag}).status_code, 304)
+
+        self.app.post('/api/vlans', json={"id": 20, "cidr": "192.168.20.1/24"})
+        response = self.app.get('/api/vlans', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+        # Edits made outside the API change the ETag too
+        etag = response.headers['ETag']
+        store = app_module.vlan_manager.store
+        vlans = response.json + [{"id": 30, "cidr": "192.168.30.1/24"}]
+        for path in store.watched_files()[1:]:
+            if os.path.exists(path):
+                os.remove(path)
+        with open(Config.DATA_FILE, 'w') as f:
+            json.dump(vlans, f)
+        response = self.app.get('/api/vlans', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([v['id'] for v in response.json], [10, 20, 30])
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_list_pagination_and_filters(self):
+        self.app.post('/api/vlans/bulk', json=[
+            {"id": vid, "cidr": f"192.168.{vid}.1/24", "nat": vid in (10, 40)} for vid in (30, 10, 20, 40, 50)])
+        self.assertEqual([v['id'] for v in self.app.get('/api/vlans').json], [30, 10, 20, 40, 50])
+
+        seen = []
+        url = '/api/vlans?limit=2'
+        while url:
+            response = self.app.get(url)
+            seen.append([v['id'] for v in response.json])
+            link = response.headers.get('Link')
+            url = link[1:link.index('>')] if link else None
+        self.assertEqual(seen, [[10, 20], [30, 40], [50]])
+
+        response = self.app.get('/api/vlans?nat=1&limit=1')
+        self.assertEqual([v['id'] for v in response.json], [10])
+        self.assertIn('nat=1', response.headers['Link'])
+        self.assertEqual([v['id'] for v in self.app.get('/api/vlans?nat=false').json], [30, 20, 50])
+        self.assertEqual(self.app.get('/api/vlans?nat=maybe').status_code, 400)
+        self.assertEqual(self.app.get('/api/vlans?limit=2&cursor=bogus').status_code, 400)
+
+    def test_dashboard_is_paged(self):
+        Config.DASHBOARD_PAGE_SIZE, saved = 2, Config.DASHBOARD_PAGE_SIZE
+        try:
+            self.app.post('/api/vlans/bulk', json=[{"id": vid, "cidr": f"192.168.{vid}.1/24"} for vid in (10, 20, 30)])
+            page = self.app.get('/').get_data(as_text=True)
+            self.assertIn('192.168.20.1/24', page)
+            self.assertNotIn('192.168.30.1/24', page)
+            self.assertIn('Next page', page)
+        finally:
+            Config.DASHBOARD_PAGE_SIZE = saved
+
+    def test_bulk_import_formats(self):
+        response = self.app.post('/api/vlans/bulk', json=[
+            {"id": 10, "cidr": "192.168.10.1/24", "nat": True},
+            {"id": 11, "cidr": "192.168.11.1/24"},
+        ])
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json['added'], 2)
+
+        ndjson = '{"id": 12, "cidr": "192.168.12.1/24"}\n{"id": 13, "cidr": "192.168.13.1/24", "dhcp": true}\n'
+        response = self.app.post('/api/vlans/bulk', data=ndjson, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+
+        csv_data = "id,cidr,nat,dhcp\n14,192.168.14.1/24,yes,\n15,192.168.15.1/24,no,1\n"
+        response = self.app.post('/api/vlans/bulk', data=csv_data, content_type='text/csv')
+        self.assertEqual(response.status_code, 201)
+
+        vlans = {v['id']: v for v in self.app.get('/api/vlans').json}
+        self.assertEqual(sorted(vlans), [10, 11, 12, 13, 14, 15])
+        self.assertTrue(vlans[14]['nat'])
+        self.assertTrue(vlans[15]['dhcp'])
+        self.assertEqual(vlans[13]['dhcp_pools'], "192.168.13.52 - 192.168.13.254")
+
+    def test_bulk_import_is_all_or_nothing(self):
+        self.app.post('/api/vlans', json={"id": 10, "cidr": "192.168.10.1/24"})
+        response = self.app.post('/api/vlans/bulk', json=[
+            {"id": 20, "cidr": "192.168.20.1/24"},
+            {"id": 10, "cidr": "192.168.30.1/24"},
+            {"id": 21, "cidr": "192.168.20.0/25"},
+            {"id": 22, "cidr": "bad"},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual([e['row'] for e in response.json['errors']], [2, 3, 4])
+        self.assertIn("row 1", response.json['errors'][1]['message'])
+        self.assertEqual(len(self.app.get('/api/vlans').json), 1)
+
+    def test_export(self):
+        self.app.post('/api/vlans/bulk', json=[
+            {"id": 10, "cidr": "192.168.10.1/24", "nat": True},
+            {"id": 11, "cidr": "192.168.11.1/24"},
+        ])
+        response = self.app.get('/api/vlans/export?format=ndjson')
+        self.assertEqual(response.mimetype, 'application/x-ndjson')
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        self.assertEqual([v['id'] for v in lines], [10, 11])
+
+        response = self.app.get('/api/vlans/export?format=csv')
+        rows = response.get_data(as_text=True).splitlines()
+        self.assertEqual(rows[0], "id,cidr,dhcp,dhcp_gateway,dhcp_dns,dhcp_pools,forwarding,nat,parent,"
+                         "cidr6,dhcp6,dhcp6_dns,dhcp6_pools,nat6")
+        self.assertEqual(rows[1], "10,192.168.10.1/24,false,,,,false,true,,,,,,")
+
+        response = self.app.get('/api/vlans/export?format=json')
+        self.assertEqual(len(json.loads(response.get_data(as_text=True))), 2)
+        self.assertEqual(self.app.get('/api/vlans/export?format=xml').status_code, 400)
+
     def test_add_vlan_form(self):
         data = {
             "id": "50",
@@ -0,0 +1,30 @@
+import unittest
+import json
+from vlan_manager.config import Config
+from benchmarks.run import run_benchmarks, synthetic_vlans, compare
+
+class TestBenchmarks(unittest.TestCase):
+    def test_synthetic_vlans_do_not_overlap(self):
+        vlans = synthetic_vlans(4094)
+        self.assertEqual(len({v['cidr'] for v in vlans}), 4094)
+        self.assertEqual(vlans[-1]['id'], 4094)
+
+    def test_small_run_reports_every_phase(self):
+        data_file = Config.DATA_FILE
+        report = run_benchmarks([5])
+        self.assertEqual(Config.DATA_FILE, data_file)
+
+        phases = report['results']['5']
+        for name in ('add_vlan', 'check_for_overlaps', 'generate_systemd_config', 'generate_nftables_config',
+                     'generate_kea_config', 'load_vlans', 'apply_config'):
+            self.assertIn('seconds', phases[name])
+            self.assertIn('alloc_peak_bytes', phases[name])
+        self.assertEqual(phases['generate_systemd_config']['file_ops']['rename'], 15)
+        self.assertNotIn('rename', phases['generate_systemd_config_unchanged']['file_ops'])
+
+        json.dumps(report)
+        lines = list(compare(report, report))
+        self.assertTrue(lines and all(line.endswith('x1.00') for line in lines))
+
+if __name__ == '__main__':
+    unittest.main()
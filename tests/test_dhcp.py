@@ -2,7 +2,9 @@ import unittest
 import os
 import shutil
 import json
+import ipaddress
 from vlan_manager.core import VlanManager
+from vlan_manager.pools import host_range, plan_pools, parse_ranges, format_pools
 from vlan_manager.config import Config
 
 class TestDhcp(unittest.TestCase):
@@ -49,6 +51,57 @@ class TestDhcp(unittest.TestCase):
         # hosts[0] is .1. hosts[51] is .52. hosts[253] is .254.
         self.assertEqual(added_vlan['dhcp_pools'], "192.168.10.52 - 192.168.10.254")
 
+    def test_host_range_matches_hosts(self):
+        for cidr in ['10.0.0.0/24', '10.0.0.0/29', '10.0.0.0/30', '10.0.0.0/31', '10.0.0.0/32',
+                     '2001:db8::/120', '2001:db8::/126', '2001:db8::/127', '2001:db8::/128']:
+            network = ipaddress.ip_network(cidr)
+            hosts = list(network.hosts())
+            self.assertEqual(host_range(network), (int(hosts[0]), int(hosts[-1])), cidr)
+
+    def test_plan_pools_large_networks(self):
+        network = ipaddress.ip_network('10.0.0.0/8')
+        self.assertEqual(format_pools(plan_pools(network)), "10.51.51.52 - 10.255.255.254")
+
+        network = ipaddress.ip_network('2001:db8::/64')
+        pools = plan_pools(network)
+        self.assertEqual(pools[0][1], int(network.broadcast_address))
+
+    def test_plan_pools_ratio_reserved_and_count(self):
+        network = ipaddress.ip_network('192.168.10.0/24')
+        self.assertEqual(format_pools(plan_pools(network, ratio=0.5)), "192.168.10.128 - 192.168.10.254")
+
+        reserved = parse_ranges("192.168.10.200 - 192.168.10.209, 192.168.10.254")
+        self.assertEqual(format_pools(plan_pools(network, ratio=0.5, reserved=reserved)),
+                         "192.168.10.128 - 192.168.10.199, 192.168.10.210 - 192.168.10.253")
+
+        self.assertEqual(format_pools(plan_pools(network, ratio=0.5, count=2)),
+                         "192.168.10.128 - 192.168.10.190, 192.168.10.191 - 192.168.10.254")
+
+        with self.assertRaises(ValueError):
+            plan_pools(network, ratio=0)
+        with self.assertRaises(ValueError):
+            parse_ranges("192.168.10.9 - 192.168.10.1")
+
+    def test_dhcp_pool_options(self):
+        self.manager.add_vlan({
+            "id": 11,
+            "cidr": "192.168.11.1/24",
+            "dhcp": True,
+            "dhcp_pool_ratio": "0.5",
+            "dhcp_reserved": "192.168.11.250 - 192.168.11.254"
+        })
+        self.assertEqual(self.manager.get_vlan(11)['dhcp_pools'], "192.168.11.128 - 192.168.11.249")
+
+        self.manager.add_vlan({"id": 12, "cidr": "192.168.12.1/24", "dhcp": True,
+                               "dhcp_pool_ratio": "0.5", "dhcp_pool_count": "2"})
+        self.assertEqual(self.manager.get_vlan(12)['dhcp_pools'],
+                         "192.168.12.128 - 192.168.12.190, 192.168.12.191 - 192.168.12.254")
+        for count in ("two", "0", -1, Config.DHCP_MAX_POOL_COUNT + 1, 10 ** 6):
+            with self.assertRaisesRegex(ValueError, 'DHCP pool count'):
+                self.manager.add_vlan({"id": 13, "cidr": "10.0.0.1/8", "dhcp": True, "dhcp_pool_count": count})
+        # Only checked when DHCP is on
+        self.manager.add_vlan({"id": 14, "cidr": "192.168.14.1/24", "dhcp_pool_count": "two"})
+
     def test_kea_config_generation(self):
         vlan = {
             "id": 20,
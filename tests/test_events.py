@@ -0,0 +1,156 @@
+import unittest
+import os
+import json
+import shutil
+import threading
+from vlan_manager.config import Config
+from vlan_manager.core import VlanManager
+from vlan_manager.events import EventHub, RESET
+from vlan_manager.app import app as app_module
+
+class TestEventHub(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_events_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'EVENTS_FILE', 'EVENTS_POLL_INTERVAL', 'EVENTS_HEARTBEAT', 'EVENTS_STREAM_TIMEOUT',
+            'DASHBOARD_LIVE_UPDATES')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.EVENTS_FILE = None
+        Config.EVENTS_POLL_INTERVAL = 0.01
+        Config.EVENTS_HEARTBEAT = 0
+        Config.EVENTS_STREAM_TIMEOUT = 0.2
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def test_ids_are_shared_between_processes(self):
+        # Separate hubs on the same file behave like gunicorn workers
+        hubs = [EventHub() for _ in range(4)]
+        self.assertEqual(hubs[0].path, os.path.join(self.test_dir, 'events.log'))
+
+        def worker(hub):
+            for i in range(25):
+                hub.publish('vlan.added', {"n": i})
+
+        threads = [threading.Thread(target=worker, args=(h,)) for h in hubs]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        events = EventHub().since(0)
+        self.assertEqual([e['id'] for e in events], list(range(1, 101)))
+        self.assertEqual([e['id'] for e in hubs[1].since(95)], [96, 97, 98, 99, 100])
+        self.assertEqual(hubs[2].last_id(), 100)
+
+    def test_compaction_keeps_ids_and_resets_stale_clients(self):
+        hub = EventHub(max_bytes=2000)
+        for i in range(100):
+            hub.publish('vlan.updated', {"vlan": {"id": i}})
+        self.assertLess(os.path.getsize(hub.path), 2000)
+        self.assertEqual(hub.last_id(), 100)
+
+        events = hub.since(3)
+        self.assertEqual(events[0]['type'], RESET)
+        self.assertEqual(events[1]['id'], events[0]['id'] + 1)
+        self.assertEqual(events[-1]['id'], 100)
+        self.assertEqual(hub.since(99)[0]['id'], 100)
+        self.assertEqual(hub.publish('vlan.deleted', {})['id'], 101)
+
+    def test_compaction_keeps_an_oversized_newest_event(self):
+        hub = EventHub(max_bytes=2000)
+        for i in range(5):
+            hub.publish('vlan.updated', {"vlan": {"id": i}})
+        hub.publish('reconcile.drift', {"detail": "x" * 1500})
+        self.assertEqual(hub.last_id(), 6)
+        self.assertEqual(hub.publish('vlan.deleted', {})['id'], 7)
+
+        events = hub.since(5)
+        self.assertEqual([e['id'] for e in events], [6, 7])
+        self.assertEqual(hub.since(2)[0]['type'], RESET)
+
+    def test_follow_sees_events_from_other_hubs(self):
+        hub = EventHub()
+        hub.publish('vlan.added', {"vlan": {"id": 1}})
+        seen = []
+
+        def follow():
+            for event in hub.follow(1, timeout=2):
+                if event is not None:
+                    seen.append(event)
+                    if len(seen) == 2:
+                        return
+
+        thread = threading.Thread(target=follow)
+        thread.start()
+        EventHub().publish('vlan.updated', {"vlan": {"id": 1}})
+        EventHub().publish('vlan.deleted', {"id": 1})
+        thread.join(5)
+        self.assertEqual([e['type'] for e in seen], ['vlan.updated', 'vlan.deleted'])
+
+    def test_manager_publishes_changes_with_revisions(self):
+        manager = VlanManager()
+        received = []
+        manager.listeners.append(lambda event_type, data: received.append((event_type, data)))
+
+        manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24"})
+        manager.update_vlan(10, {"nat": True})
+        manager.add_vlans([{"id": 20, "cidr": "192.168.20.1/24", "parent": "bond1"}])
+        manager.delete_vlan(10)
+        manager.delete_vlan(10)
+
+        self.assertEqual([t for t, _ in received], ['vlan.added', 'vlan.updated', 'vlans.added', 'vlan.deleted'])
+        self.assertEqual([d['revision'] for _, d in received], [1, 2, 3, 4])
+        self.assertTrue(received[1][1]['vlan']['nat'])
+        self.assertEqual(received[2][1]['vlans'], [{"id": 20, "parent": "bond1"}])
+        self.assertEqual(received[3][1], {"id": 10, "parent": None, "revision": 4})
+
+    def test_sse_endpoint_resumes_from_last_event_id(self):
+        original = app_module.vlan_manager
+        app_module.vlan_manager = app_module.create_manager()
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        try:
+            client.post('/api/vlans', json={"id": 10, "cidr": "192.168.10.1/24"})
+            client.post('/api/vlans/delete/10')
+
+            response = client.get('/api/events', headers={'Last-Event-ID': '1'})
+            self.assertEqual(response.mimetype, 'text/event-stream')
+            body = response.get_data(as_text=True)
+            self.assertIn('id: 2\nevent: vlan.deleted\ndata: {"id": 10, "parent": null, "revision": 2}\n\n', body)
+            self.assertNotIn('vlan.added', body)
+            self.assertIn(': keepalive', body)
+
+            # Without an ID the stream starts at the newest event
+            body = client.get('/api/events').get_data(as_text=True)
+            self.assertNotIn('event:', body)
+
+            self.assertEqual(client.get('/api/events?last_event_id=x').status_code, 400)
+
+            app_module.publish_job_event({"id": "abc", "status": "succeeded", "steps": [], "pid": 1})
+            event = app_module.event_hub.since(2)[0]
+            self.assertEqual(event['type'], 'apply.succeeded')
+            self.assertEqual(event['data']['job']['id'], 'abc')
+            self.assertEqual(event['data']['revision'], 2)
+
+            # Subscribing ties up a worker, so the dashboard only does it when enabled
+            Config.DASHBOARD_LIVE_UPDATES = False
+            self.assertNotIn(b'EventSource', client.get('/').data)
+            Config.DASHBOARD_LIVE_UPDATES = True
+            self.assertIn(b'EventSource', client.get('/').data)
+        finally:
+            app_module.vlan_manager = original
+
+        with open(os.path.join(self.test_dir, 'events.log')) as f:
+            self.assertEqual([json.loads(line)['type'] for line in f], ['vlan.added', 'vlan.deleted', 'apply.succeeded'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+import threading
+from vlan_manager.graph import StepGraph, StepError
+
+class TestStepGraph(unittest.TestCase):
+    def test_independent_steps_run_concurrently(self):
+        barrier = threading.Barrier(2, timeout=5)
+        order = []
+
+        def meet(name):
+            barrier.wait()
+            order.append(name)
+            return name
+
+        graph = StepGraph(max_workers=4)
+        graph.add('a', meet, 'a')
+        graph.add('b', meet, 'b')
+        graph.add('c', order.append, 'c', depends=['a', 'b'])
+        results, steps = graph.run()
+
+        self.assertEqual(results['a'], 'a')
+        self.assertEqual(order[-1], 'c')
+        self.assertEqual([s['name'] for s in steps], ['a', 'b', 'c'])
+        self.assertEqual([s['status'] for s in steps], ['ok', 'ok', 'ok'])
+        self.assertEqual(steps[2]['depends'], ['a', 'b'])
+        self.assertGreaterEqual(steps[2]['start'], max(steps[0]['start'] + steps[0]['duration'],
+                                                       steps[1]['start'] + steps[1]['duration']))
+
+    def test_skips_and_results(self):
+        graph = StepGraph()
+        graph.add('write', lambda: None, skip=True)
+        graph.add('reload', lambda: {"action": "unchanged", "ok": True, "output": ""})
+        graph.add('command', lambda: {"ok": False, "output": "exit 1"})
+        graph.add('after', lambda: None, depends=['command'])
+        _, steps = graph.run()
+        self.assertEqual([s['status'] for s in steps], ['skipped', 'skipped', 'failed', 'blocked'])
+        self.assertFalse(steps[2]['ok'])
+        self.assertEqual(steps[2]['output'], 'exit 1')
+
+    def test_failure_blocks_dependents_only(self):
+        def boom():
+            raise RuntimeError("boom")
+
+        ran = []
+        graph = StepGraph()
+        graph.add('render', boom)
+        graph.add('activate', ran.append, 'activate', depends=['render'])
+        graph.add('after', ran.append, 'after', depends=['activate'])
+        graph.add('other', ran.append, 'other')
+        with self.assertRaises(StepError) as ctx:
+            graph.run()
+
+        self.assertEqual(ran, ['other'])
+        self.assertEqual(ctx.exception.step, 'render')
+        self.assertEqual([s['status'] for s in ctx.exception.steps], ['failed', 'blocked', 'blocked', 'ok'])
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(ValueError):
+            StepGraph().add('a', print, depends=['missing'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,125 @@
+import unittest
+import os
+import json
+import time
+import shutil
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager import nftables
+from vlan_manager.networkd import link_name
+from fakes import FakeBinaries
+
+class TestDualStack(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_ipv6_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'KEA6_CONFIG_FILE', 'SYSCTL_FILE',
+            'KEA_CONTROL_SOCKET', 'KEA6_CONTROL_SOCKET', 'WAN_INTERFACE')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.KEA6_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp6.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.KEA_CONTROL_SOCKET = None
+        Config.KEA6_CONTROL_SOCKET = None
+        Config.WAN_INTERFACE = 'eth0'
+
+        self.manager = VlanManager()
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def test_validation(self):
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "cidr6": "2001:db8:10::1/64"})
+        with self.assertRaisesRegex(ValueError, 'overlaps with existing VLAN 10'):
+            self.manager.add_vlan({"id": 11, "cidr": "192.168.11.1/24", "cidr6": "2001:db8:10::/48"})
+        with self.assertRaisesRegex(ValueError, 'Invalid IPv6 CIDR'):
+            self.manager.add_vlan({"id": 12, "cidr": "192.168.12.1/24", "cidr6": "10.0.0.1/24"})
+        with self.assertRaisesRegex(ValueError, 'dhcp6 needs an IPv6 prefix'):
+            self.manager.add_vlan({"id": 13, "cidr": "192.168.13.1/24", "dhcp6": True})
+        with self.assertRaisesRegex(ValueError, 'cidr6 can only be added to an IPv4 VLAN'):
+            self.manager.add_vlan({"id": 14, "cidr": "2001:db8:14::1/64", "cidr6": "2001:db8:15::1/64"})
+        with self.assertRaisesRegex(ValueError, 'use dhcp6'):
+            self.manager.add_vlan({"id": 15, "cidr": "2001:db8:15::1/64", "dhcp": True})
+
+        # IPv4-only records are stored without any IPv6 fields
+        self.manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24", "cidr6": "", "dhcp6": False})
+        self.assertEqual(set(self.manager.get_vlan(20)), {'id', 'cidr', 'dhcp', 'forwarding', 'nat'})
+
+    def test_a_48_of_64s_is_checked_arithmetically(self):
+        vlans = [{"id": i, "cidr": f"10.{i // 256}.{i % 256}.1/24", "cidr6": f"2001:db8:0:{i:x}::1/64", "dhcp6": True}
+                 for i in range(1, 4095)]
+        start = time.monotonic()
+        self.assertEqual(self.manager.add_vlans(vlans), 4094)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(self.manager.get_vlan(1)['dhcp6_pools'],
+                         "2001:db8:0:1:3333:3333:3333:3334 - 2001:db8:0:1:ffff:ffff:ffff:ffff")
+        with self.assertRaisesRegex(ValueError, 'overlaps'):
+            self.manager.add_vlan({"id": 4094, "parent": "bond1", "cidr": "10.99.0.1/24", "cidr6": "2001:db8::/48"})
+
+    def test_update_rederives_ipv6_settings(self):
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "cidr6": "2001:db8:10::1/64", "dhcp6": True})
+        vlan = self.manager.update_vlan(10, {"cidr6": "2001:db8:11::1/64"})
+        self.assertEqual(vlan['dhcp6_dns'], '2001:db8:11::1')
+        self.assertTrue(vlan['dhcp6_pools'].startswith('2001:db8:11:0:'))
+
+    def test_networkd_advertises_prefix(self):
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "cidr6": "2001:db8:10::1/64", "dhcp6": True})
+        self.manager.generate_systemd_config()
+        with open(os.path.join(Config.NETWORK_DIR, '20-vlan10.network')) as f:
+            content = f.read()
+        self.assertIn('Address=192.168.10.1/24\nAddress=2001:db8:10::1/64\n', content)
+        self.assertIn('IPv6SendRA=yes', content)
+        self.assertIn('[IPv6SendRA]\nManaged=yes', content)
+        self.assertIn('[IPv6Prefix]\nPrefix=2001:db8:10::/64', content)
+
+    def test_kea6_and_nat66(self):
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "nat": True,
+                               "cidr6": "fd00:10::1/64", "dhcp6": True, "nat6": True})
+        self.manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24", "dhcp": True, "cidr6": "2001:db8:20::1/64"})
+
+        dhcp6 = self.manager.generate_kea6_config()['Dhcp6']
+        self.assertEqual(dhcp6['interfaces-config']['interfaces'], ['vlan10'])
+        subnet = dhcp6['subnet6'][0]
+        self.assertEqual((subnet['id'], subnet['subnet']), (10, 'fd00:10::/64'))
+        self.assertEqual(subnet['option-data'], [{"name": "dns-servers", "data": "fd00:10::1"}])
+        self.assertEqual([s['id'] for s in self.manager.generate_kea_config()['Dhcp4']['subnet4']], [20])
+
+        state = nftables.desired_state(self.manager.vlans, 'eth0', link_name)
+        self.assertEqual(state['sets']['nat_sources'], ['192.168.10.0/24'])
+        self.assertEqual(state['sets']['nat_sources6'], ['fd00:10::/64'])
+        content = nftables.render_ruleset(state)
+        self.assertIn('ip6 saddr @nat_sources6 oifname "eth0" masquerade', content)
+
+    def test_apply_enables_ipv6_forwarding_and_kea6(self):
+        with FakeBinaries(os.path.join(self.test_dir, 'bin'), ['networkctl', 'sysctl', 'nft', 'systemctl']) as fakes:
+            self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "forwarding": True})
+            report = self.manager.apply_config()
+            self.assertIsNone(report['kea6'])
+            self.assertFalse(os.path.exists(Config.KEA6_CONFIG_FILE))
+            with open(Config.SYSCTL_FILE) as f:
+                self.assertEqual(f.read(), "net.ipv4.ip_forward=1\n")
+
+            fakes.reset()
+            self.manager.update_vlan(10, {"cidr6": "2001:db8:10::1/64", "dhcp6": True})
+            report = self.manager.apply_config()
+            self.assertEqual(report['kea6']['action'], 'restart')
+            self.assertIn(['systemctl', 'restart', Config.KEA6_SERVICE_NAME], fakes.calls('systemctl'))
+            with open(Config.KEA6_CONFIG_FILE) as f:
+                self.assertEqual([s['id'] for s in json.load(f)['Dhcp6']['subnet6']], [10])
+            with open(Config.SYSCTL_FILE) as f:
+                content = f.read()
+            self.assertIn("net.ipv6.conf.all.forwarding=1\n", content)
+            self.assertIn("net.ipv6.conf.eth0.accept_ra=2\n", content)
+            self.assertIn(['sysctl', '-p', Config.SYSCTL_FILE], fakes.calls('sysctl'))
+
+if __name__ == '__main__':
+    unittest.main()
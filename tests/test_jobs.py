@@ -0,0 +1,122 @@
+import unittest
+import os
+import shutil
+import threading
+from vlan_manager.config import Config
+from vlan_manager.jobs import ApplyQueue, QUEUED, SUCCEEDED, FAILED, RUNNING
+from vlan_manager.app import app as app_module
+
+class TestApplyQueue(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_jobs_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.original_jobs_dir = Config.APPLY_JOBS_DIR
+        Config.APPLY_JOBS_DIR = os.path.join(self.test_dir, 'jobs')
+
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.queues = []
+
+    def tearDown(self):
+        self.release.set()
+        for queue in self.queues:
+            queue.stop()
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        Config.APPLY_JOBS_DIR = self.original_jobs_dir
+
+    def queue(self, apply_func):
+        queue = ApplyQueue(apply_func, jobs_dir=Config.APPLY_JOBS_DIR)
+        self.queues.append(queue)
+        return queue
+
+    def blocking_apply(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(10)
+        return {"steps": [{"name": "networkd", "ok": True, "duration": 0.01, "output": ""}]}
+
+    def test_job_runs_in_background(self):
+        queue = self.queue(self.blocking_apply)
+        job = queue.submit()
+        self.assertTrue(self.started.wait(5))
+        self.assertEqual(queue.get(job['id'])['status'], RUNNING)
+
+        self.release.set()
+        job = queue.wait(job['id'], timeout=5)
+        self.assertEqual(job['status'], SUCCEEDED)
+        self.assertEqual(job['steps'][0]['name'], 'networkd')
+        self.assertIsNotNone(job['duration'])
+
+    def test_submits_coalesce_while_queued(self):
+        queue = self.queue(self.blocking_apply)
+        first = queue.submit()
+        self.assertTrue(self.started.wait(5))
+
+        followups = [queue.submit() for _ in range(5)]
+        self.assertEqual(len({j['id'] for j in followups}), 1)
+        self.assertNotEqual(followups[0]['id'], first['id'])
+        self.assertEqual(followups[-1]['requests'], 5)
+
+        self.release.set()
+        self.assertEqual(queue.wait(followups[0]['id'], timeout=5)['status'], SUCCEEDED)
+        self.assertEqual(self.calls, 2)
+
+    def test_failure_is_recorded(self):
+        def failing_apply():
+            raise RuntimeError("nft exploded")
+        queue = self.queue(failing_apply)
+        job = queue.wait(queue.submit()['id'], timeout=5)
+        self.assertEqual(job['status'], FAILED)
+        self.assertEqual(job['error'], "nft exploded")
+
+    def test_failed_step_fails_the_job(self):
+        def apply():
+            return {"steps": [{"name": "networkd", "ok": True}, {"name": "nftables", "ok": False}]}
+        queue = self.queue(apply)
+        job = queue.wait(queue.submit()['id'], timeout=5)
+        self.assertEqual(job['status'], FAILED)
+        self.assertEqual(job['error'], "Failed steps: nftables")
+        self.assertEqual(len(job['steps']), 2)
+
+    def test_pending_job_runs_after_restart(self):
+        first = self.queue(self.blocking_apply)
+        running = first.submit()
+        self.assertTrue(self.started.wait(5))
+        pending = first.submit()
+        # The process goes away with a job still queued
+        first.stop(timeout=0)
+        self.release.set()
+        self.assertEqual(first.wait(running['id'], timeout=5)['status'], SUCCEEDED)
+        self.assertEqual(first.get(pending['id'])['status'], QUEUED)
+
+        self.queue(self.blocking_apply).start()
+        self.assertEqual(first.wait(pending['id'], timeout=5)['status'], SUCCEEDED)
+        self.assertEqual(self.calls, 2)
+
+    def test_status_endpoint(self):
+        original_queue = app_module.apply_queue
+        app_module.apply_queue = self.queue(self.blocking_apply)
+        self.release.set()
+        try:
+            client = app_module.app.test_client()
+            with client.session_transaction() as sess:
+                sess['logged_in'] = True
+
+            response = client.post('/api/apply', json={})
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json['job']['id']
+            app_module.apply_queue.wait(job_id, timeout=5)
+
+            response = client.get(response.json['status_url'])
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['status'], SUCCEEDED)
+            self.assertEqual(client.get('/api/apply/ffff').status_code, 404)
+        finally:
+            app_module.apply_queue = original_queue
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,151 @@
+import unittest
+import os
+import json
+import shutil
+import threading
+import socketserver
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager.kea import KeaControl, KeaControlError
+from fakes import FakeBinaries
+
+class FakeKeaServer(socketserver.ThreadingUnixStreamServer):
+    """Answers Kea control commands and records what it received."""
+
+    def __init__(self, path, result=0, responses=None):
+        self.commands = []
+        self.result = result
+        # Canned responses by command name, e.g. a recorded config-get
+        self.responses = responses or {}
+        super().__init__(path, FakeKeaHandler)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+class FakeKeaHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        buffer = b''
+        while True:
+            buffer += self.request.recv(65536)
+            try:
+                command = json.loads(buffer.decode())
+                break
+            except ValueError:
+                continue
+        self.server.commands.append(command)
+        response = self.server.responses.get(command['command'], {"result": self.server.result, "text": "fake"})
+        self.request.sendall(json.dumps([response]).encode())
+
+class TestKeaReload(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_kea_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'SYSCTL_FILE', 'KEA_CONTROL_SOCKET',
+            'KEA_CONFIG_MODE')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.KEA_CONTROL_SOCKET = os.path.join(self.test_dir, 'kea.sock')
+
+        self.kea = FakeKeaServer(Config.KEA_CONTROL_SOCKET)
+        self.fakes = FakeBinaries(os.path.join(self.test_dir, 'bin'), ['networkctl', 'sysctl', 'nft', 'systemctl'])
+        self.fakes.__enter__()
+
+        self.manager = VlanManager()
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "dhcp": True})
+
+    def tearDown(self):
+        self.fakes.__exit__(None, None, None)
+        self.kea.stop()
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def test_first_apply_restarts_then_hot_reloads(self):
+        report = self.manager.apply_config()
+        self.assertEqual(report['kea']['action'], 'restart')
+        self.assertEqual(self.fakes.calls('systemctl'), [['systemctl', 'restart', Config.KEA_SERVICE_NAME]])
+
+        self.fakes.reset()
+        self.manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24", "dhcp": True})
+        report = self.manager.apply_config()
+        self.assertEqual(report['kea']['action'], 'config-set')
+        self.assertEqual(self.fakes.calls('systemctl'), [])
+        self.assertEqual(self.kea.commands[-1]['command'], 'config-set')
+        subnets = self.kea.commands[-1]['arguments']['Dhcp4']['subnet4']
+        self.assertEqual([s['id'] for s in subnets], [10, 20])
+
+    def test_unchanged_config_skips_kea(self):
+        self.manager.apply_config()
+        self.fakes.reset()
+        self.manager.add_vlan({"id": 30, "cidr": "192.168.30.1/24", "dhcp": False})
+        report = self.manager.apply_config()
+        self.assertEqual(report['kea']['action'], 'unchanged')
+        self.assertEqual(self.kea.commands, [])
+        self.assertEqual(self.fakes.calls('systemctl'), [])
+
+    def test_failed_hot_reload_falls_back_to_restart(self):
+        self.manager.apply_config()
+        self.fakes.reset()
+        self.kea.result = 1
+        self.manager.update_vlan(10, {"dhcp_dns": "1.1.1.1"})
+        report = self.manager.apply_config()
+        self.assertEqual(report['kea']['action'], 'restart')
+        self.assertEqual(len(self.fakes.calls('systemctl')), 1)
+
+    def test_merge_mode_keeps_operator_settings(self):
+        Config.KEA_CONFIG_MODE = 'merge'
+        os.makedirs(os.path.dirname(Config.KEA_CONFIG_FILE), exist_ok=True)
+        with open(Config.KEA_CONFIG_FILE, 'w') as f:
+            f.write('''{
+    // tuned by hand
+    "Dhcp4": {
+        "interfaces-config": {"interfaces": ["eth1"]},
+        "lease-database": {"type": "postgresql", "name": "kea"},  # not memfile
+        "valid-lifetime": 7200,
+        "multi-threading": {"enable-multi-threading": true, "thread-pool-size": 8},
+        /* a subnet we do not manage */
+        "subnet4": [{"id": 900, "subnet": "10.99.0.0/24", "pools": []}],
+        "control-socket": {"socket-type": "unix", "socket-name": "%s"}
+    }
+}''' % Config.KEA_CONTROL_SOCKET)
+
+        report = self.manager.apply_config()
+        self.assertEqual(report['kea']['action'], 'config-set')
+        with open(Config.KEA_CONFIG_FILE) as f:
+            dhcp4 = json.load(f)['Dhcp4']
+        self.assertEqual(dhcp4['lease-database']['type'], 'postgresql')
+        self.assertEqual(dhcp4['valid-lifetime'], 7200)
+        self.assertEqual(dhcp4['multi-threading']['thread-pool-size'], 8)
+        self.assertEqual([s['id'] for s in dhcp4['subnet4']], [900, 10])
+        self.assertEqual(dhcp4['interfaces-config']['interfaces'], ['eth1', 'vlan10'])
+
+        self.assertEqual(self.manager.apply_config()['kea']['action'], 'unchanged')
+
+        self.manager.delete_vlan(10)
+        self.manager.apply_config()
+        with open(Config.KEA_CONFIG_FILE) as f:
+            dhcp4 = json.load(f)['Dhcp4']
+        self.assertEqual([s['id'] for s in dhcp4['subnet4']], [900])
+        self.assertEqual(dhcp4['interfaces-config']['interfaces'], ['eth1'])
+        self.assertEqual(self.fakes.calls('systemctl'), [])
+
+    def test_control_client_errors(self):
+        self.kea.result = 1
+        with self.assertRaises(KeaControlError):
+            KeaControl(Config.KEA_CONTROL_SOCKET).command('config-get')
+        with self.assertRaises(OSError):
+            KeaControl(os.path.join(self.test_dir, 'missing.sock')).command('config-get')
+
+if __name__ == '__main__':
+    unittest.main()
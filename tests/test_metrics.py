@@ -0,0 +1,127 @@
+import unittest
+import os
+import json
+import shutil
+from vlan_manager.config import Config
+from vlan_manager.metrics import Registry
+from vlan_manager.app import app as app_module
+from vlan_manager.core import VlanManager
+from fakes import FakeBinaries
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_metrics_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+        self.original_metrics_dir = Config.METRICS_DIR
+        self.registry = Registry()
+
+    def tearDown(self):
+        Config.METRICS_DIR = self.original_metrics_dir
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+
+    def test_text_format(self):
+        hist = self.registry.histogram('t_seconds', 'Timings.', ['step'], buckets=(0.1, 1.0))
+        hist.observe(0.05, step='a')
+        hist.observe(0.5, step='a')
+        hist.observe(7, step='a')
+        self.registry.counter('t_total', 'Things.', ['kind']).inc(3, kind='x"y')
+        self.registry.gauge('t_gauge', 'Computed.', lambda: 42)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('# TYPE t_seconds histogram', lines)
+        self.assertIn('t_seconds_bucket{step="a",le="0.1"} 1', lines)
+        self.assertIn('t_seconds_bucket{step="a",le="1"} 2', lines)
+        self.assertIn('t_seconds_bucket{step="a",le="+Inf"} 3', lines)
+        self.assertIn('t_seconds_sum{step="a"} 7.55', lines)
+        self.assertIn('t_seconds_count{step="a"} 3', lines)
+        self.assertIn('t_total{kind="x\\"y"} 3', lines)
+        self.assertIn('t_gauge 42', lines)
+
+    def test_gauges_are_computed_at_scrape_time(self):
+        calls = []
+        self.registry.gauge('t_gauge', 'Computed.', lambda: calls.append(1) or len(calls))
+        self.assertEqual(calls, [])
+        self.assertIn('t_gauge 1', self.registry.render())
+        self.assertIn('t_gauge 2', self.registry.render())
+
+    def test_snapshots_of_other_processes_are_summed(self):
+        Config.METRICS_DIR = self.test_dir
+        counter = self.registry.counter('t_total', 'Things.', ['kind'])
+        counter.inc(2, kind='a')
+        hist = self.registry.histogram('t_seconds', 'Timings.', buckets=(1.0,))
+        hist.observe(0.5)
+
+        # The parent process stands in for another live worker...
+        with open(os.path.join(self.test_dir, f"{os.getppid()}.json"), 'w') as f:
+            json.dump({"t_total": [[["a"], 5]], "t_seconds": [[[], [1, 1, 3.0]]]}, f)
+        # ...and a pid that cannot exist for one that has exited.
+        stale = os.path.join(self.test_dir, '999999999.json')
+        with open(stale, 'w') as f:
+            json.dump({"t_total": [[["a"], 100]]}, f)
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('t_total{kind="a"} 7', lines)
+        self.assertIn('t_seconds_count 3', lines)
+        self.assertIn('t_seconds_sum 3.5', lines)
+        self.assertFalse(os.path.exists(stale))
+
+        self.registry.maybe_flush()
+        with open(os.path.join(self.test_dir, f"{os.getpid()}.json")) as f:
+            self.assertEqual(json.load(f)['t_total'], [[["a"], 2]])
+
+class TestMetricsEndpoint(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_metrics_app_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'SYSCTL_FILE', 'KEA_CONTROL_SOCKET',
+            'METRICS_TOKEN')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.KEA_CONTROL_SOCKET = None
+        Config.METRICS_TOKEN = None
+
+        app_module.vlan_manager = VlanManager()
+        self.app = app_module.app.test_client()
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def test_metrics(self):
+        app_module.vlan_manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "nat": True, "dhcp": True})
+        app_module.vlan_manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24", "nat": True})
+        with FakeBinaries(os.path.join(self.test_dir, 'bin'), ['networkctl', 'sysctl', 'nft', 'systemctl']):
+            app_module.vlan_manager.apply_config()
+        self.app.get('/login')
+
+        body = self.app.get('/metrics').get_data(as_text=True)
+        lines = body.splitlines()
+        self.assertIn('vlan_manager_vlans 2', lines)
+        self.assertIn('vlan_manager_nat_vlans 2', lines)
+        self.assertIn('vlan_manager_dhcp_vlans 1', lines)
+        self.assertIn('vlan_manager_apply_step_seconds_count{step="networkd"}', body)
+        self.assertIn('vlan_manager_command_seconds_count{command="nft",ok="true"}', body)
+        self.assertIn('vlan_manager_apply_files_total{change="created"}', body)
+        self.assertIn('vlan_manager_store_seconds_count{operation="commit"}', body)
+        self.assertIn('vlan_manager_http_request_seconds_count{route="/login",method="GET",status="200"}', body)
+
+    def test_token(self):
+        Config.METRICS_TOKEN = 's3cret'
+        self.assertEqual(self.app.get('/metrics').status_code, 401)
+        response = self.app.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+        self.assertEqual(response.status_code, 200)
+
+if __name__ == '__main__':
+    unittest.main()
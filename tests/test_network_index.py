@@ -0,0 +1,47 @@
+import unittest
+import ipaddress
+from vlan_manager.netindex import NetworkIndex
+
+class TestNetworkIndex(unittest.TestCase):
+    def setUp(self):
+        self.index = NetworkIndex()
+        self.index.add(10, '192.168.10.0/24')
+        self.index.add(20, '10.0.0.0/16')
+        self.index.add(30, '172.16.0.1/30')
+
+    def keys(self, cidr, **kwargs):
+        return sorted(key for key, _ in self.index.overlapping(cidr, **kwargs))
+
+    def test_disjoint(self):
+        self.assertEqual(self.keys('192.168.11.0/24'), [])
+        self.assertEqual(self.keys('10.1.0.0/16'), [])
+        self.assertEqual(self.keys('172.16.0.4/30'), [])
+
+    def test_equal_subnet_and_supernet(self):
+        self.assertEqual(self.keys('192.168.10.1/24'), [10])
+        self.assertEqual(self.keys('192.168.10.128/25'), [10])
+        self.assertEqual(self.keys('192.168.0.0/16'), [10])
+        # A supernet aligned with the query is reported once
+        self.assertEqual(self.index.overlapping('10.0.0.0/24'), [(20, ipaddress.ip_network('10.0.0.0/16'))])
+        self.assertEqual(self.keys('192.168.10.0/26'), [10])
+        self.assertEqual(self.keys('0.0.0.0/0'), [10, 20, 30])
+
+    def test_reports_matching_network(self):
+        matches = self.index.overlapping('10.0.5.0/24')
+        self.assertEqual(matches, [(20, ipaddress.ip_network('10.0.0.0/16'))])
+
+    def test_remove_and_exclude(self):
+        self.assertEqual(self.keys('10.0.5.0/24', exclude=20), [])
+        self.index.remove(20)
+        self.assertEqual(self.keys('10.0.5.0/24'), [])
+        self.assertNotIn(20, self.index)
+        self.assertEqual(len(self.index), 2)
+
+    def test_families_are_separate(self):
+        self.index.add(40, '2001:db8::/48')
+        self.assertEqual(self.keys('2001:db8:0:10::/64'), [40])
+        self.assertEqual(self.keys('::/0'), [40])
+        self.assertEqual(self.keys('0.0.0.0/0'), [10, 20, 30])
+
+if __name__ == '__main__':
+    unittest.main()
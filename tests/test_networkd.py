@@ -0,0 +1,201 @@
+import unittest
+import unittest.mock
+import os
+import shutil
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager.networkd import NetworkFileIndex, parse_match, name_matches
+from fakes import FakeBinaries
+
+class TestNetworkdSync(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_networkd_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.original_data_file = Config.DATA_FILE
+        self.original_network_dir = Config.NETWORK_DIR
+        self.original_nftables_dir = Config.NFTABLES_DIR
+        self.original_kea_config = Config.KEA_CONFIG_FILE
+        self.original_sysctl_file = Config.SYSCTL_FILE
+
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.PARENT_INTERFACE = 'br0'
+
+        os.makedirs(Config.NETWORK_DIR, exist_ok=True)
+        with open(os.path.join(Config.NETWORK_DIR, '10-br0.network'), 'w') as f:
+            f.write('[Match]\nName=br0\n')
+
+        self.manager = VlanManager()
+        for vid in (10, 20, 30):
+            self.manager.add_vlan({"id": vid, "cidr": f"192.168.{vid}.1/24"})
+        self.dropin_dir = os.path.join(Config.NETWORK_DIR, '10-br0.network.d')
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        Config.DATA_FILE = self.original_data_file
+        Config.NETWORK_DIR = self.original_network_dir
+        Config.NFTABLES_DIR = self.original_nftables_dir
+        Config.KEA_CONFIG_FILE = self.original_kea_config
+        Config.SYSCTL_FILE = self.original_sysctl_file
+
+    def test_initial_generation_creates_files(self):
+        changes = self.manager.generate_systemd_config()
+        self.assertEqual(len(changes.created), 9)
+        self.assertFalse(changes.removed)
+
+    def test_unchanged_files_are_not_rewritten(self):
+        self.manager.generate_systemd_config()
+        netdev = os.path.join(Config.NETWORK_DIR, '20-vlan10.netdev')
+        os.utime(netdev, (1000000000, 1000000000))
+
+        changes = self.manager.generate_systemd_config()
+        self.assertFalse(changes.changed)
+        self.assertEqual(len(changes.unchanged), 9)
+        self.assertEqual(os.stat(netdev).st_mtime, 1000000000)
+
+    def test_single_vlan_edit_touches_its_files_only(self):
+        self.manager.generate_systemd_config()
+
+        self.manager.update_vlan(20, {"nat": True})
+        changes = self.manager.generate_systemd_config()
+        self.assertEqual(changes.updated, [os.path.join(Config.NETWORK_DIR, '20-vlan20.network')])
+
+        self.manager.delete_vlan(30)
+        changes = self.manager.generate_systemd_config()
+        self.assertEqual(sorted(changes.removed), sorted([
+            os.path.join(Config.NETWORK_DIR, '20-vlan30.netdev'),
+            os.path.join(Config.NETWORK_DIR, '20-vlan30.network'),
+            os.path.join(self.dropin_dir, 'vlan-30.conf'),
+        ]))
+        self.assertEqual(len(changes.unchanged), 6)
+
+    def test_legacy_file_with_same_content_is_renamed(self):
+        self.manager.generate_systemd_config()
+        os.rename(os.path.join(Config.NETWORK_DIR, '20-vlan10.netdev'),
+                  os.path.join(Config.NETWORK_DIR, '10-vlan10.netdev'))
+
+        changes = self.manager.generate_systemd_config()
+        self.assertEqual(changes.renamed, [(
+            os.path.join(Config.NETWORK_DIR, '10-vlan10.netdev'),
+            os.path.join(Config.NETWORK_DIR, '20-vlan10.netdev'),
+        )])
+        self.assertFalse(changes.created or changes.removed)
+
+    def test_apply_targets_changed_links(self):
+        with FakeBinaries(os.path.join(self.test_dir, 'bin'),
+                          ['networkctl', 'sysctl', 'nft', 'systemctl']) as fakes:
+            report = self.manager.apply_config()
+            self.assertEqual(fakes.calls('networkctl'), [['networkctl', 'reload'], ['networkctl', 'reconfigure', 'br0']])
+            self.assertTrue(report['networkd']['reload']['ok'])
+            self.assertEqual(report['networkd']['links']['br0']['action'], 'reconfigure')
+
+            # Nothing changed: networkd is left alone
+            fakes.reset()
+            report = self.manager.apply_config()
+            self.assertEqual(fakes.calls('networkctl'), [])
+            self.assertIsNone(report['networkd']['reload'])
+            self.assertEqual(fakes.calls('sysctl'), [])
+            statuses = {step['name']: step['status'] for step in report['steps']}
+            self.assertEqual(statuses['networkd'], 'skipped')
+            self.assertEqual(statuses['sysctl'], 'skipped')
+            self.assertEqual(statuses['generate_networkd'], 'ok')
+
+            # A .network-only change reloads the files, then reconfigures just that link
+            fakes.reset()
+            self.manager.update_vlan(20, {"nat": True})
+            report = self.manager.apply_config()
+            self.assertEqual(fakes.calls('networkctl'), [['networkctl', 'reload'], ['networkctl', 'reconfigure', 'vlan20']])
+            self.assertGreaterEqual(report['networkd']['links']['vlan20']['duration'], 0)
+
+            # Removing a VLAN deletes its netdev and reloads for the parent's drop-ins
+            fakes.reset()
+            self.manager.delete_vlan(30)
+            self.manager.apply_config()
+            self.assertEqual(fakes.calls('networkctl'), [
+                ['networkctl', 'delete', 'vlan30'],
+                ['networkctl', 'reload'],
+                ['networkctl', 'reconfigure', 'br0'],
+            ])
+
+class TestParentDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.network_dir = 'test_networkd_match'
+        if os.path.exists(self.network_dir):
+            shutil.rmtree(self.network_dir)
+        os.makedirs(self.network_dir)
+        self.index = NetworkFileIndex()
+
+    def tearDown(self):
+        shutil.rmtree(self.network_dir)
+
+    def write(self, name, content):
+        with open(os.path.join(self.network_dir, name), 'w') as f:
+            f.write(content)
+
+    def test_parse_match(self):
+        match = parse_match("""# Name=wrong
+[Match]
+Name=eth0 \\
+     eth1
+Name=eth2
+; comment
+MACAddress=00:11:22:33:44:55
+
+[Network]
+Name=ignored
+[Match]
+Type=ether
+""")
+        self.assertEqual(match['Name'], ['eth0', 'eth1', 'eth2'])
+        self.assertEqual(match['Type'], ['ether'])
+        self.assertEqual(parse_match('[Match]\nName=eth0\nName=\nName=eth3\n')['Name'], ['eth3'])
+
+    def test_name_patterns(self):
+        self.assertTrue(name_matches(['br*'], 'br0'))
+        self.assertFalse(name_matches(['br0'], 'br01'))
+        self.assertTrue(name_matches(['!eth*', 'wl*'], 'br0'))
+        self.assertFalse(name_matches(['!eth*', 'br*'], 'br0'))
+        self.assertFalse(name_matches([], 'br0'))
+
+    def test_no_substring_false_positives(self):
+        self.write('05-br01.network', '[Match]\nName=br01\n')
+        self.write('30-br0.network', '[Match]\nName=br0\n')
+        self.assertEqual(self.index.find(self.network_dir, 'br0'), '30-br0.network')
+
+    def test_first_match_in_lexical_order(self):
+        self.write('50-bridges.network', '[Match]\nName=br*\n')
+        self.write('40-trunk1.network', '[Match]\nName=trunk1 br1\n')
+        self.write('01-any.network', '[Match]\nType=bridge\n')
+        self.assertEqual({i: self.index.find(self.network_dir, i) for i in ('br0', 'br1', 'eth0')},
+                         {'br0': '50-bridges.network', 'br1': '40-trunk1.network', 'eth0': None})
+
+    def test_cache_invalidation(self):
+        self.write('30-br0.network', '[Match]\nName=br0\n')
+        self.assertEqual(self.index.find(self.network_dir, 'br0'), '30-br0.network')
+
+        reads = []
+        original_open = open
+        def counting_open(path, *args, **kwargs):
+            reads.append(path)
+            return original_open(path, *args, **kwargs)
+        with unittest.mock.patch('builtins.open', counting_open):
+            self.assertEqual(self.index.find(self.network_dir, 'br0'), '30-br0.network')
+        self.assertEqual(reads, [])
+
+        # Edited in place: size changes, so the file is parsed again
+        self.write('30-br0.network', '[Match]\nName=br9\n\n')
+        self.assertIsNone(self.index.find(self.network_dir, 'br0'))
+
+        # A new file shows up in the cached listing once the directory changes
+        self.write('20-br0.network', '[Match]\nName=br0\n')
+        self.assertEqual(self.index.find(self.network_dir, 'br0'), '20-br0.network')
+
+if __name__ == '__main__':
+    unittest.main()
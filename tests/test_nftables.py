@@ -0,0 +1,182 @@
+import unittest
+import unittest.mock
+import os
+import json
+import shutil
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager import nftables
+from vlan_manager.networkd import link_name
+from fakes import FakeBinaries
+
+class TestNftablesRender(unittest.TestCase):
+    def test_sets_replace_per_vlan_rules(self):
+        vlans = [{"id": i, "cidr": f"10.{i}.0.1/24", "nat": i % 2 == 0} for i in range(1, 201)]
+        content = nftables.render_ruleset(nftables.desired_state(vlans, 'eth0', link_name))
+        self.assertEqual(content.count('accept\n'), 2)
+        # one masquerade rule per address family, however many VLANs there are
+        self.assertEqual(content.count('masquerade'), 2)
+        self.assertIn('iifname @nat_ifaces oifname "eth0" accept', content)
+        self.assertIn('"vlan2"', content)
+        self.assertNotIn('"vlan1"', content)
+        self.assertIn('10.2.0.0/24', content)
+        self.assertNotIn('10.1.0.0/24', content)
+
+    def test_empty_sets_have_no_elements(self):
+        content = nftables.render_ruleset(nftables.desired_state([], 'eth0', link_name))
+        self.assertIn('set nat_sources {', content)
+        self.assertNotIn('elements', content)
+
+    def test_nested_networks_are_collapsed(self):
+        vlans = [{"id": 1, "cidr": "10.0.0.1/16", "nat": True}, {"id": 2, "cidr": "10.0.5.1/24", "nat": True}]
+        state = nftables.desired_state(vlans, 'eth0', link_name)
+        self.assertEqual(state['sets']['nat_sources'], ['10.0.0.0/16'])
+        self.assertEqual(state['sets']['nat_ifaces'], ['vlan1', 'vlan2'])
+
+    def test_batch_only_touches_changed_elements(self):
+        old = nftables.desired_state([{"id": 1, "cidr": "10.1.0.1/24", "nat": True}], 'eth0', link_name)
+        new = nftables.desired_state([{"id": 2, "cidr": "10.2.0.1/24", "nat": True}], 'eth0', link_name)
+        batch = nftables.render_batch(old, new)
+        self.assertEqual(batch.splitlines(), [
+            'delete element inet vlan_mgmt nat_ifaces { "vlan1" }',
+            'add element inet vlan_mgmt nat_ifaces { "vlan2" }',
+            'delete element inet vlan_mgmt nat_sources { 10.1.0.0/24 }',
+            'add element inet vlan_mgmt nat_sources { 10.2.0.0/24 }',
+        ])
+        self.assertEqual(nftables.render_batch(new, new), '')
+        self.assertIn('delete table inet vlan_mgmt', nftables.render_batch(None, new))
+
+    def test_wan_change_refills_chains_without_deleting_table(self):
+        old = nftables.desired_state([{"id": 1, "cidr": "10.1.0.1/24", "nat": True}], 'eth0', link_name)
+        batch = nftables.render_batch(old, dict(old, wan='eth9'))
+        self.assertNotIn('delete table', batch)
+        self.assertIn('flush chain inet vlan_mgmt forward', batch)
+        self.assertIn('add rule inet vlan_mgmt postrouting ip saddr @nat_sources oifname "eth9" masquerade', batch)
+        self.assertNotIn('element', batch)
+
+    def test_parse_live_table(self):
+        state = nftables.parse_table(live_table('eth0', ['vlan10'], [
+            {"prefix": {"addr": "192.168.10.0", "len": 24}},
+            "10.9.9.9",
+            {"range": ["10.1.0.0", "10.1.1.255"]},
+        ]))
+        self.assertEqual(state['wan'], 'eth0')
+        self.assertEqual(state['sets']['nat_ifaces'], ['vlan10'])
+        self.assertEqual(state['sets']['nat_sources'], ['192.168.10.0/24', '10.9.9.9/32', '10.1.0.0/23'])
+
+        self.assertIsNone(nftables.parse_table(''))
+        self.assertIsNone(nftables.parse_table('{"nftables": [{"metainfo": {}}]}'))
+
+        # A hand-edited table with an extra rule is not trusted for diffing
+        tampered = json.loads(live_table('eth0', [], []))
+        tampered['nftables'].append(rule('forward', [{"accept": None}]))
+        self.assertIsNone(nftables.parse_table(json.dumps(tampered))['wan'])
+
+
+def rule(chain, expr):
+    return {"rule": {"family": "inet", "table": "vlan_mgmt", "chain": chain, "handle": 9, "expr": expr}}
+
+
+def live_table(wan, ifaces, sources, sources6=()):
+    """What ``nft -j list table inet vlan_mgmt`` prints for our table."""
+    oifname = {"match": {"op": "==", "left": {"meta": {"key": "oifname"}}, "right": wan}}
+    objects = [
+        {"metainfo": {"version": "1.0.6", "json_schema_version": 1}},
+        {"table": {"family": "inet", "name": "vlan_mgmt", "handle": 1}},
+        {"set": {"family": "inet", "name": "nat_ifaces", "table": "vlan_mgmt", "type": "ifname",
+                 "handle": 2, "elem": ifaces}},
+        {"set": {"family": "inet", "name": "nat_sources", "table": "vlan_mgmt", "type": "ipv4_addr",
+                 "handle": 3, "flags": ["interval"], "elem": sources}},
+        {"set": {"family": "inet", "name": "nat_sources6", "table": "vlan_mgmt", "type": "ipv6_addr",
+                 "handle": 6, "flags": ["interval"], "elem": list(sources6)}},
+        {"chain": {"family": "inet", "table": "vlan_mgmt", "name": "forward", "handle": 4}},
+        rule('forward', [{"match": {"op": "in", "left": {"ct": {"key": "state"}},
+                                    "right": ["established", "related"]}}, {"accept": None}]),
+        rule('forward', [{"match": {"op": "==", "left": {"meta": {"key": "iifname"}}, "right": "@nat_ifaces"}},
+                         oifname, {"accept": None}]),
+        {"chain": {"family": "inet", "table": "vlan_mgmt", "name": "postrouting", "handle": 5}},
+        rule('postrouting', [{"match": {"op": "==", "left": {"payload": {"protocol": "ip", "field": "saddr"}},
+                                        "right": "@nat_sources"}}, oifname, {"masquerade": None}]),
+        rule('postrouting', [{"match": {"op": "==", "left": {"payload": {"protocol": "ip6", "field": "saddr"}},
+                                        "right": "@nat_sources6"}}, oifname, {"masquerade": None}]),
+    ]
+    for obj in objects:
+        body = next(iter(obj.values()))
+        if 'elem' in body and not body['elem']:
+            del body['elem']
+    return json.dumps({"nftables": objects})
+
+class TestNftablesApply(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_nftables_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'SYSCTL_FILE', 'KEA_CONTROL_SOCKET',
+            'WAN_INTERFACE')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.KEA_CONTROL_SOCKET = None
+        Config.WAN_INTERFACE = 'eth0'
+
+        self.fakes = FakeBinaries(os.path.join(self.test_dir, 'bin'), ['networkctl', 'sysctl', 'nft', 'systemctl'])
+        self.fakes.__enter__()
+        self.manager = VlanManager()
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "nat": True})
+
+    def tearDown(self):
+        self.fakes.__exit__(None, None, None)
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def nft_entries(self):
+        return [e for e in self.fakes.entries() if e['argv'][0] == 'nft']
+
+    def test_missing_table_loads_full_ruleset(self):
+        report = self.manager.apply_config()
+        self.assertEqual(report['nftables']['action'], 'load')
+        listing, check, commit = self.nft_entries()
+        self.assertEqual(listing['argv'], ['nft', '-j', 'list', 'table', 'inet', 'vlan_mgmt'])
+        self.assertEqual(check['argv'], ['nft', '-c', '-f', '-'])
+        self.assertEqual(commit['argv'], ['nft', '-f', '-'])
+        self.assertEqual(check['stdin'], commit['stdin'])
+        self.assertIn('elements = { 192.168.10.0/24 }', commit['stdin'])
+
+    def test_diff_against_live_table(self):
+        self.fakes.set_output('nft', live_table('eth0', ['vlan10'], [{"prefix": {"addr": "192.168.10.0", "len": 24}}]))
+        report = self.manager.apply_config()
+        self.assertEqual(report['nftables']['action'], 'unchanged')
+        self.assertEqual(len(self.nft_entries()), 1)
+
+        self.fakes.reset()
+        self.manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24", "nat": True})
+        report = self.manager.apply_config()
+        self.assertEqual(report['nftables']['action'], 'update')
+        commit = self.nft_entries()[-1]
+        self.assertEqual(commit['stdin'].splitlines(), [
+            'add element inet vlan_mgmt nat_ifaces { "vlan20" }',
+            'add element inet vlan_mgmt nat_sources { 192.168.20.0/24 }',
+        ])
+
+    def test_failed_check_does_not_commit(self):
+        with unittest.mock.patch.dict(os.environ, {'FAKE_EXIT_NFT': '1'}):
+            report = self.manager.apply_config()
+        self.assertEqual(report['nftables']['action'], 'check-failed')
+        self.assertFalse(report['nftables']['ok'])
+        self.assertEqual([e['argv'][1] for e in self.nft_entries()], ['-j', '-c'])
+
+    def test_check_only(self):
+        result = self.manager.check_nftables()
+        self.assertTrue(result['ok'])
+        self.assertIn('192.168.10.0/24', result['batch'])
+        self.assertEqual([e['argv'][1] for e in self.nft_entries()], ['-j', '-c'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+import unittest
+import unittest.mock
+import os
+import json
+import shutil
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager import networkd
+from vlan_manager.app import app as app_module
+from fakes import FakeBinaries
+
+class TestPlan(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_plan_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'KEA6_CONFIG_FILE', 'SYSCTL_FILE',
+            'KEA_CONTROL_SOCKET', 'KEA_CONFIG_MODE', 'PARENT_INTERFACE', 'WAN_INTERFACE')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.KEA6_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp6.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.KEA_CONTROL_SOCKET = None
+        Config.KEA_CONFIG_MODE = 'replace'
+        Config.PARENT_INTERFACE = 'br0'
+        Config.WAN_INTERFACE = 'eth0'
+
+        self.manager = VlanManager()
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "dhcp": True, "nat": True})
+        self.manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24"})
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def apply(self):
+        with FakeBinaries(os.path.join(self.test_dir, 'bin'), ['networkctl', 'sysctl', 'nft', 'systemctl']):
+            return self.manager.apply_config()
+
+    def test_plan_has_no_side_effects(self):
+        before = sorted(os.listdir(self.test_dir))
+        plan = self.manager.plan()
+        self.assertEqual(sorted(os.listdir(self.test_dir)), before)
+        self.assertFalse(os.path.exists(Config.NETWORK_DIR))
+
+        netdev = os.path.join(Config.NETWORK_DIR, '20-vlan10.netdev')
+        self.assertIn('Id=10', plan['files'][netdev])
+        self.assertIn('192.168.10.0/24', json.loads(plan['files'][Config.KEA_CONFIG_FILE])['Dhcp4']['subnet4'][0]['subnet'])
+        self.assertNotIn(Config.KEA6_CONFIG_FILE, plan['files'])
+        self.assertEqual(set(plan['changes'].values()), {'create'})
+        self.assertEqual(len(plan['changes']), 9)
+        self.assertIn(f'--- /dev/null\n+++ {netdev}\n', plan['diff'])
+        self.assertEqual(plan['revision'], self.manager.revision)
+
+    def test_plan_matches_what_apply_writes(self):
+        self.apply()
+        plan = self.manager.plan()
+        self.assertEqual(set(plan['changes'].values()), {'unchanged'})
+        self.assertEqual(plan['diff'], '')
+
+        self.manager.update_vlan(10, {"cidr": "192.168.11.1/24"})
+        self.manager.delete_vlan(20)
+        plan = self.manager.plan()
+        network = os.path.join(Config.NETWORK_DIR, '20-vlan10.network')
+        self.assertEqual(plan['changes'][network], 'update')
+        self.assertIn('-Address=192.168.10.1/24\n+Address=192.168.11.1/24\n', plan['diff'])
+        self.assertEqual(plan['remove'], sorted(p for p, c in plan['changes'].items() if c == 'remove'))
+        self.assertEqual(len(plan['remove']), 3)
+        self.assertIn(f'--- {os.path.join(Config.NETWORK_DIR, "20-vlan20.netdev")}\n+++ /dev/null\n', plan['diff'])
+        self.assertEqual(plan['changes'][Config.KEA_CONFIG_FILE], 'update')
+
+        self.apply()
+        self.assertEqual(self.manager.plan()['diff'], '')
+
+    def test_rendering_is_cached_per_revision(self):
+        with unittest.mock.patch.object(networkd, 'desired_files', wraps=networkd.desired_files) as render:
+            first = self.manager.plan()
+            self.manager.plan()
+            self.apply()
+            self.assertEqual(render.call_count, 1)
+
+            self.manager.update_vlan(20, {"nat": True})
+            second = self.manager.plan()
+            self.assertEqual(render.call_count, 2)
+        self.assertGreater(second['revision'], first['revision'])
+
+        # Changes written by another process are picked up too
+        VlanManager().delete_vlan(20)
+        self.assertEqual(self.manager.plan()['changes'][os.path.join(Config.NETWORK_DIR, '20-vlan20.netdev')],
+                         'remove')
+
+    def test_apply_reports_render_steps_on_a_cache_miss(self):
+        names = [step['name'] for step in self.apply()['steps']]
+        for name in ('render_networkd', 'render_nftables', 'generate_kea', 'generate_kea6', 'render_sysctl'):
+            self.assertIn(name, names)
+
+        # A plan() of the same revision already rendered everything
+        self.manager.update_vlan(20, {"nat": True})
+        self.manager.plan()
+        names = [step['name'] for step in self.apply()['steps']]
+        self.assertNotIn('generate_kea', names)
+        self.assertIn('generate_networkd', names)
+
+    def test_plan_endpoint(self):
+        original = app_module.vlan_manager
+        app_module.vlan_manager = self.manager
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        try:
+            response = client.get('/api/plan')
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json['changed'], 9)
+            self.assertNotIn('files', response.json)
+            self.assertIn(Config.SYSCTL_FILE, client.get('/api/plan?files=1').json['files'])
+
+            response = client.get('/api/plan?format=diff')
+            self.assertEqual(response.mimetype, 'text/x-diff')
+            self.assertIn('+Id=20\n', response.get_data(as_text=True))
+        finally:
+            app_module.vlan_manager = original
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,213 @@
+import unittest
+import unittest.mock
+import os
+import io
+import json
+import shutil
+import contextlib
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager import reconcile
+from vlan_manager.reconcile import Reconciler
+from fakes import FakeBinaries
+from test_kea import FakeKeaServer
+from vlan_manager.app import app as app_module
+
+FIXTURES = os.path.join(os.path.dirname(__file__), 'fixtures', 'reconcile')
+
+def fixture(name):
+    with open(os.path.join(FIXTURES, name)) as f:
+        return json.load(f)
+
+class TestReconcile(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_reconcile_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'KEA6_CONFIG_FILE', 'SYSCTL_FILE',
+            'KEA_CONTROL_SOCKET', 'KEA6_CONTROL_SOCKET', 'APPLY_JOBS_DIR', 'PARENT_INTERFACE', 'WAN_INTERFACE',
+            'RECONCILE_INTERVAL', 'RECONCILE_MAX_INTERVAL', 'RECONCILE_MAX_FIXES', 'RECONCILE_COST_FACTOR')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.KEA6_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp6.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.KEA_CONTROL_SOCKET = os.path.join(self.test_dir, 'kea.sock')
+        Config.KEA6_CONTROL_SOCKET = None
+        Config.APPLY_JOBS_DIR = os.path.join(self.test_dir, 'jobs')
+        Config.PARENT_INTERFACE = 'br0'
+        Config.WAN_INTERFACE = 'eth0'
+        Config.RECONCILE_INTERVAL = 30
+        Config.RECONCILE_MAX_INTERVAL = 600
+        Config.RECONCILE_MAX_FIXES = 20
+        Config.RECONCILE_COST_FACTOR = 0
+
+        self.links = fixture('ip_link.json')
+        self.table = fixture('nft_table.json')
+        self.kea_response = fixture('kea_config_get.json')
+        self.kea = FakeKeaServer(Config.KEA_CONTROL_SOCKET, responses={'config-get': self.kea_response})
+        self.fakes = FakeBinaries(os.path.join(self.test_dir, 'bin'), ['ip', 'nft', 'networkctl', 'systemctl'])
+        self.fakes.__enter__()
+        self.record()
+
+        self.manager = VlanManager()
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "dhcp": True, "nat": True})
+        self.manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24", "parent": "bond1"})
+        self.reconciler = Reconciler(lambda: self.manager)
+
+    def tearDown(self):
+        self.fakes.__exit__(None, None, None)
+        self.kea.stop()
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def record(self):
+        """Make the fake binaries print the (possibly edited) fixtures."""
+        self.fakes.set_output('ip', json.dumps(self.links))
+        self.fakes.set_output('nft', json.dumps(self.table))
+
+    def drift(self, report):
+        return [(d['component'], d['kind'], d['name']) for d in report['drift']]
+
+    def test_host_in_sync(self):
+        report = self.reconciler.run_once()
+        self.assertEqual(report['drift'], [])
+        self.assertEqual(report['errors'], [])
+        # Foreign VLAN links (eth0.7) and subnets (id 500) are left alone
+        self.assertEqual(self.fakes.calls(), [
+            ['ip', '-j', '-d', 'link', 'show', 'type', 'vlan'],
+            ['nft', '-j', 'list', 'table', 'inet', 'vlan_mgmt'],
+        ])
+        self.assertEqual([c['command'] for c in self.kea.commands], ['config-get'])
+
+    def test_link_drift_is_reported_and_repaired(self):
+        del self.links[1]
+        self.links[0]['flags'].remove('UP')
+        extra = json.loads(json.dumps(self.links[0]))
+        extra.update(ifname='vlan30', flags=['UP'])
+        extra['linkinfo']['info_data']['id'] = 30
+        self.links.append(extra)
+        self.record()
+
+        report = self.reconciler.check()
+        self.assertEqual(self.drift(report), [('links', 'missing', 'bond1.20'), ('links', 'down', 'vlan10'),
+                                              ('links', 'unexpected', 'vlan30')])
+        self.assertEqual(self.fakes.calls('networkctl'), [])
+
+        self.fakes.reset()
+        report = self.reconciler.run_once(fix=True)
+        self.assertEqual(self.fakes.calls('networkctl'), [
+            ['networkctl', 'delete', 'vlan30'],
+            ['networkctl', 'reload'],
+            ['networkctl', 'reconfigure', 'vlan10'],
+        ])
+        self.assertTrue(all(f['ok'] for f in report['fixes']))
+        self.assertEqual(reconcile.exit_status(report), 0)
+
+    def test_repairs_per_cycle_are_bounded(self):
+        Config.RECONCILE_MAX_FIXES = 1
+        for link in self.links:
+            link['flags'].remove('UP')
+        self.record()
+        report = self.reconciler.run_once(fix=True)
+        self.assertEqual(self.fakes.calls('networkctl'), [['networkctl', 'reconfigure', 'bond1.20']])
+        self.assertEqual(report['deferred'], 1)
+        self.assertEqual(reconcile.exit_status(report), 1)
+
+    def test_nftables_and_kea_drift(self):
+        self.table['nftables'][3]['set']['elem'] = [{"prefix": {"addr": "192.168.99.0", "len": 24}}]
+        self.record()
+        self.kea_response['arguments']['Dhcp4']['subnet4'][0]['pools'][0]['pool'] = '192.168.10.10-192.168.10.20'
+
+        report = self.reconciler.run_once(fix=True)
+        self.assertEqual(self.drift(report), [('nftables', 'changed', 'nat_sources'), ('kea', 'changed', '10')])
+        self.assertIn('missing 192.168.10.0/24; unexpected 192.168.99.0/24', report['drift'][0]['detail'])
+        batch = [e['stdin'] for e in self.fakes.entries() if e['argv'] == ['nft', '-f', '-']]
+        self.assertIn('delete element inet vlan_mgmt nat_sources { 192.168.99.0/24 }', batch[0])
+        # No config file yet, so apply's Kea step writes it and restarts the server
+        self.assertEqual([f['action'] for f in report['fixes']], ['update', 'restart'])
+
+        # The file is current now; a server still running something else gets it pushed
+        report = self.reconciler.run_once(fix=True)
+        self.assertEqual(report['fixes'][-1]['action'], 'config-set')
+        pushed = self.kea.commands[-1]
+        self.assertEqual(pushed['command'], 'config-set')
+        self.assertEqual(pushed['arguments']['Dhcp4']['subnet4'][0]['pools'], [{"pool": "192.168.10.52 - 192.168.10.254"}])
+
+    def test_missing_table_and_unreachable_kea(self):
+        self.kea.stop()
+        os.remove(Config.KEA_CONTROL_SOCKET)
+        with unittest.mock.patch.dict(os.environ, {'FAKE_EXIT_NFT': '1'}):
+            self.fakes.set_output('nft', 'Error: No such file or directory\n')
+            report = self.reconciler.run_once(fix=True)
+        self.assertEqual(self.drift(report), [('nftables', 'missing', 'inet vlan_mgmt'),
+                                              ('kea', 'unreachable', Config.KEA_SERVICE_NAME)])
+        self.assertIn(['systemctl', 'restart', Config.KEA_SERVICE_NAME], self.fakes.calls('systemctl'))
+        self.kea = FakeKeaServer(Config.KEA_CONTROL_SOCKET)
+
+    def test_unreadable_live_state_is_an_error(self):
+        with unittest.mock.patch.dict(os.environ, {'FAKE_EXIT_IP': '1'}):
+            report = self.reconciler.run_once(fix=True)
+        self.assertEqual(report['drift'], [])
+        self.assertEqual([e['component'] for e in report['errors']], ['links'])
+        self.assertEqual(reconcile.exit_status(report), 2)
+
+    def test_adaptive_backoff(self):
+        intervals = [self.reconciler.run_once()['next_interval'] for _ in range(6)]
+        self.assertEqual(intervals, [30, 60, 120, 240, 480, 600])
+
+        # A VLAN change or new drift brings the next check forward
+        self.manager.update_vlan(20, {"forwarding": True}, parent="bond1")
+        self.assertEqual(self.reconciler.run_once()['next_interval'], 30)
+        self.assertEqual(self.reconciler.run_once()['next_interval'], 60)
+        self.links[0]['flags'].remove('UP')
+        self.record()
+        self.assertEqual(self.reconciler.run_once()['next_interval'], 30)
+        # Drift nobody repairs backs off like a clean host
+        self.assertEqual(self.reconciler.run_once()['next_interval'], 60)
+
+        # A slow cycle is never repeated more often than its cost allows
+        Config.RECONCILE_COST_FACTOR = 1e6
+        self.assertGreater(self.reconciler.run_once()['next_interval'], 600)
+
+    def test_cli(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(reconcile.main([]), 0)
+        self.assertEqual(out.getvalue(), "in sync\n")
+
+        self.links[0]['flags'].remove('UP')
+        self.record()
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(reconcile.main(['--json']), 1)
+        self.assertEqual(json.loads(out.getvalue())['drift'][0]['name'], 'vlan10')
+        self.assertEqual(self.fakes.calls('networkctl'), [])
+
+    def test_reconcile_endpoint(self):
+        original = app_module.vlan_manager
+        app_module.vlan_manager = self.manager
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+        try:
+            self.links[0]['flags'].remove('UP')
+            self.record()
+            response = client.get('/api/reconcile')
+            self.assertEqual(response.json['drift'][0]['kind'], 'down')
+            self.assertEqual(self.fakes.calls('networkctl'), [])
+
+            response = client.post('/api/reconcile')
+            self.assertEqual(response.json['fixes'][0]['action'], 'reconfigure')
+            self.assertEqual(self.fakes.calls('networkctl'), [['networkctl', 'reconfigure', 'vlan10']])
+        finally:
+            app_module.vlan_manager = original
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,274 @@
+import unittest
+import os
+import json
+import shutil
+import sqlite3
+import multiprocessing
+from unittest.mock import patch
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager.storage import JournalStore, JsonFileStore, SqliteStore, StoreError
+
+class TestJournalStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_storage_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.original_data_file = Config.DATA_FILE
+        self.original_backend = Config.STORE_BACKEND
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.STORE_BACKEND = 'journal'
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        Config.DATA_FILE = self.original_data_file
+        Config.STORE_BACKEND = self.original_backend
+
+    def test_mutations_are_journaled_and_replayed(self):
+        manager = VlanManager()
+        manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24"})
+        manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24"})
+        manager.update_vlan(10, {"nat": True})
+        manager.delete_vlan(20)
+
+        self.assertFalse(os.path.exists(Config.DATA_FILE))
+        with open(Config.DATA_FILE + '.journal') as f:
+            self.assertEqual(len(f.readlines()), 4)
+
+        reloaded = VlanManager()
+        self.assertEqual([v['id'] for v in reloaded.get_vlans()], [10])
+        self.assertTrue(reloaded.get_vlan(10)['nat'])
+
+    def test_compaction_writes_snapshot(self):
+        manager = VlanManager()
+        manager.store.compact_interval = 3
+        for vid in (10, 20, 30):
+            manager.add_vlan({"id": vid, "cidr": f"192.168.{vid}.1/24"})
+
+        with open(Config.DATA_FILE) as f:
+            self.assertEqual([v['id'] for v in json.load(f)], [10, 20, 30])
+        self.assertEqual(os.path.getsize(Config.DATA_FILE + '.journal'), 0)
+
+        manager.delete_vlan(20)
+        self.assertEqual([v['id'] for v in VlanManager().get_vlans()], [10, 30])
+
+    def test_revision_counts_writes(self):
+        manager = VlanManager()
+        manager.store.compact_interval = 2
+        self.assertEqual(manager.revision, 0)
+        manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24"})
+        manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24"})
+        manager.delete_vlan(20)
+        self.assertEqual(manager.revision, 3)
+        self.assertEqual(VlanManager().revision, 3)
+
+        other = VlanManager()
+        other.update_vlan(10, {"nat": True})
+        self.assertTrue(manager.refresh())
+        self.assertEqual(manager.revision, 4)
+
+    def test_torn_last_entry_is_discarded(self):
+        manager = VlanManager()
+        manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24"})
+        with open(Config.DATA_FILE + '.journal', 'a') as f:
+            f.write('{"op": "put", "vlan": {"id": 20, "ci')
+        size = os.path.getsize(Config.DATA_FILE + '.journal')
+
+        reloaded = VlanManager()
+        self.assertEqual([v['id'] for v in reloaded.get_vlans()], [10])
+        # Loading never writes; the next commit cuts the torn entry off
+        self.assertEqual(os.path.getsize(Config.DATA_FILE + '.journal'), size)
+        reloaded.add_vlan({"id": 30, "cidr": "192.168.30.1/24"})
+        self.assertEqual([v['id'] for v in VlanManager().get_vlans()], [10, 30])
+
+    def test_corrupt_snapshot_is_preserved(self):
+        with open(Config.DATA_FILE, 'w') as f:
+            f.write('[{"id": 10, "cidr": ')
+
+        store = JournalStore(Config.DATA_FILE)
+        with self.assertRaises(StoreError):
+            store.load()
+        self.assertFalse(os.path.exists(Config.DATA_FILE))
+        preserved = [f for f in os.listdir(self.test_dir) if f.startswith('vlans.json.corrupt-')]
+        self.assertEqual(len(preserved), 1)
+
+    def test_reads_legacy_json_file(self):
+        JsonFileStore(Config.DATA_FILE).save([{"id": 10, "cidr": "192.168.10.1/24"}])
+        manager = VlanManager()
+        self.assertTrue(manager.has_vlan(10))
+
+def _add_vlans_in_worker(worker, count):
+    manager = VlanManager()
+    for i in range(count):
+        vid = worker * 100 + i + 1
+        manager.add_vlan({"id": vid, "cidr": f"10.{worker}.{i}.1/24"})
+
+class TestCrossWorker(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_worker_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.original_data_file = Config.DATA_FILE
+        self.original_backend = Config.STORE_BACKEND
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.STORE_BACKEND = 'journal'
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        Config.DATA_FILE = self.original_data_file
+        Config.STORE_BACKEND = self.original_backend
+
+    def test_refresh_sees_other_writers(self):
+        worker_a = VlanManager()
+        worker_b = VlanManager()
+
+        worker_a.add_vlan({"id": 10, "cidr": "192.168.10.1/24"})
+        self.assertTrue(worker_b.refresh())
+        self.assertTrue(worker_b.has_vlan(10))
+
+        with patch.object(worker_b.store, 'load') as load:
+            self.assertFalse(worker_b.refresh())
+            self.assertFalse(load.called)
+
+        # B's write is validated against A's latest state even without a refresh
+        worker_a.add_vlan({"id": 20, "cidr": "192.168.20.1/24"})
+        with self.assertRaises(ValueError):
+            worker_b.add_vlan({"id": 20, "cidr": "192.168.21.1/24"})
+        with self.assertRaises(ValueError):
+            worker_b.add_vlan({"id": 21, "cidr": "192.168.20.1/24"})
+
+        worker_b.delete_vlan(10)
+        worker_a.refresh()
+        self.assertEqual([v['id'] for v in worker_a.get_vlans()], [20])
+
+    def test_concurrent_processes_do_not_lose_writes(self):
+        ctx = multiprocessing.get_context('fork')
+        procs = [ctx.Process(target=_add_vlans_in_worker, args=(w, 10)) for w in range(1, 5)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(30)
+            self.assertEqual(p.exitcode, 0)
+
+        self.assertEqual(len(VlanManager().get_vlans()), 40)
+
+class TestSqliteStore(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_sqlite_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.original_data_file = Config.DATA_FILE
+        self.original_backend = Config.STORE_BACKEND
+        self.original_sqlite_file = Config.SQLITE_FILE
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.SQLITE_FILE = os.path.join(self.test_dir, 'vlans.db')
+        Config.STORE_BACKEND = 'sqlite'
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        Config.DATA_FILE = self.original_data_file
+        Config.STORE_BACKEND = self.original_backend
+        Config.SQLITE_FILE = self.original_sqlite_file
+
+    def test_crud_and_filters(self):
+        manager = VlanManager()
+        self.assertIsInstance(manager.store, SqliteStore)
+        manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "nat": True})
+        manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24", "dhcp": True})
+        manager.add_vlan({"id": 5, "cidr": "192.168.5.1/24", "nat": True, "dhcp": True})
+        manager.update_vlan(20, {"nat": True})
+        manager.delete_vlan(10)
+
+        reloaded = VlanManager()
+        self.assertEqual([v['id'] for v in reloaded.get_vlans()], [20, 5])
+        self.assertEqual([v['id'] for v in reloaded.get_vlans(nat=True, dhcp=True)], [20, 5])
+        self.assertEqual([v['id'] for v in reloaded.get_vlans(nat=False)], [])
+        with self.assertRaises(ValueError):
+            reloaded.get_vlans(cidr="x")
+
+        conn = sqlite3.connect(Config.SQLITE_FILE)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], 'wal')
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT data FROM vlans WHERE nat = 1").fetchall()
+        self.assertIn('vlans_nat', str(plan))
+        plan = conn.execute("EXPLAIN QUERY PLAN SELECT data FROM vlans WHERE forwarding = 1").fetchall()
+        self.assertIn('vlans_forwarding', str(plan))
+
+    def test_revision_is_committed_with_the_data(self):
+        manager = VlanManager()
+        manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24"})
+        manager.update_vlan(10, {"nat": True})
+        self.assertEqual(manager.revision, 2)
+        self.assertEqual(VlanManager().revision, 2)
+        manager.save_vlans()
+        self.assertEqual(manager.revision, 3)
+
+    def test_one_shot_json_migration(self):
+        JsonFileStore(Config.DATA_FILE).save([
+            {"id": 10, "cidr": "192.168.10.1/24", "nat": True},
+            {"id": 20, "cidr": "192.168.20.1/24"},
+        ])
+        manager = VlanManager()
+        self.assertEqual([v['id'] for v in manager.get_vlans()], [10, 20])
+
+        # Later edits to the JSON file are not imported again
+        JsonFileStore(Config.DATA_FILE).save([{"id": 30, "cidr": "192.168.30.1/24"}])
+        manager.delete_vlan(10)
+        self.assertEqual([v['id'] for v in VlanManager().get_vlans()], [20])
+
+    def test_schema_v1_is_upgraded(self):
+        conn = sqlite3.connect(Config.SQLITE_FILE)
+        conn.executescript("""
+            CREATE TABLE vlans (id INTEGER PRIMARY KEY, position INTEGER NOT NULL, family INTEGER NOT NULL,
+                                net_start TEXT NOT NULL, net_end TEXT NOT NULL, nat INTEGER NOT NULL DEFAULT 0,
+                                dhcp INTEGER NOT NULL DEFAULT 0, forwarding INTEGER NOT NULL DEFAULT 0,
+                                data TEXT NOT NULL);
+            CREATE INDEX vlans_nat ON vlans (nat);
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            INSERT INTO meta VALUES ('migrated_from', 'vlans.json');
+            INSERT INTO vlans VALUES (10, 1, 4, '0a', '0b', 1, 0, 0, '{"id": 10, "cidr": "10.0.0.1/24", "nat": true}');
+            PRAGMA user_version = 1;
+        """)
+        conn.close()
+
+        manager = VlanManager()
+        manager.add_vlan({"id": 10, "parent": "bond1", "cidr": "10.1.0.1/24"})
+        manager.delete_vlan(10)
+        self.assertEqual(VlanManager().get_vlans(), [{"id": 10, "parent": "bond1", "cidr": "10.1.0.1/24",
+                                                     "dhcp": False, "forwarding": False, "nat": False}])
+        conn = sqlite3.connect(Config.SQLITE_FILE)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], 3)
+        self.assertEqual(conn.execute("SELECT parent, id FROM vlans").fetchall(), [('bond1', 10)])
+
+    def test_schema_v2_is_upgraded(self):
+        conn = sqlite3.connect(Config.SQLITE_FILE)
+        conn.executescript("""
+            CREATE TABLE vlans (parent TEXT NOT NULL DEFAULT '', id INTEGER NOT NULL, position INTEGER NOT NULL,
+                                family INTEGER NOT NULL, net_start TEXT NOT NULL, net_end TEXT NOT NULL,
+                                nat INTEGER NOT NULL DEFAULT 0, dhcp INTEGER NOT NULL DEFAULT 0,
+                                forwarding INTEGER NOT NULL DEFAULT 0, data TEXT NOT NULL, PRIMARY KEY (parent, id));
+            CREATE INDEX vlans_network ON vlans (family, net_start, net_end);
+            CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+            INSERT INTO meta VALUES ('migrated_from', 'vlans.json');
+            INSERT INTO vlans VALUES ('bond1', 10, 1, 4, '0a', '0b', 1, 0, 0,
+                                      '{"id": 10, "parent": "bond1", "cidr": "10.0.0.1/24", "nat": true}');
+            PRAGMA user_version = 2;
+        """)
+        conn.close()
+
+        self.assertEqual([v['id'] for v in VlanManager().get_vlans(nat=True)], [10])
+        conn = sqlite3.connect(Config.SQLITE_FILE)
+        self.assertEqual(conn.execute("PRAGMA user_version").fetchone()[0], 3)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(vlans)")]
+        self.assertEqual(columns, ['parent', 'id', 'position', 'nat', 'dhcp', 'forwarding', 'data'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+import unittest
+import os
+import shutil
+from vlan_manager.core import VlanManager
+from vlan_manager.config import Config
+from vlan_manager import networkd
+from fakes import FakeBinaries
+
+class TestTrunks(unittest.TestCase):
+    def setUp(self):
+        self.test_dir = 'test_trunks_data'
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        os.makedirs(self.test_dir, exist_ok=True)
+
+        self.saved = {k: getattr(Config, k) for k in (
+            'DATA_FILE', 'NETWORK_DIR', 'NFTABLES_DIR', 'KEA_CONFIG_FILE', 'SYSCTL_FILE', 'KEA_CONTROL_SOCKET',
+            'PARENT_INTERFACE')}
+        Config.DATA_FILE = os.path.join(self.test_dir, 'vlans.json')
+        Config.NETWORK_DIR = os.path.join(self.test_dir, 'network')
+        Config.NFTABLES_DIR = os.path.join(self.test_dir, 'nftables')
+        Config.KEA_CONFIG_FILE = os.path.join(self.test_dir, 'kea/kea-dhcp4.conf')
+        Config.SYSCTL_FILE = os.path.join(self.test_dir, '99-vlan-manager.conf')
+        Config.KEA_CONTROL_SOCKET = None
+        Config.PARENT_INTERFACE = 'br0'
+
+        os.makedirs(Config.NETWORK_DIR)
+        for name in ('br0', 'bond1'):
+            with open(os.path.join(Config.NETWORK_DIR, f'10-{name}.network'), 'w') as f:
+                f.write(f'[Match]\nName={name}\n')
+
+        self.manager = VlanManager()
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "dhcp": True})
+        self.manager.add_vlan({"id": 10, "parent": "bond1", "cidr": "10.10.0.1/24", "dhcp": True, "nat": True})
+
+    def tearDown(self):
+        if os.path.exists(self.test_dir):
+            shutil.rmtree(self.test_dir)
+        for key, value in self.saved.items():
+            setattr(Config, key, value)
+
+    def path(self, *parts):
+        return os.path.join(Config.NETWORK_DIR, *parts)
+
+    def test_ids_are_unique_per_trunk(self):
+        self.assertEqual(self.manager.get_vlan(10)['cidr'], '192.168.10.1/24')
+        self.assertEqual(self.manager.get_vlan(10, 'bond1')['cidr'], '10.10.0.1/24')
+        self.assertEqual(self.manager.get_vlan(10, 'br0')['cidr'], '192.168.10.1/24')
+
+        with self.assertRaisesRegex(ValueError, 'VLAN ID 10 on bond1 already exists'):
+            self.manager.add_vlan({"id": 10, "parent": "bond1", "cidr": "10.11.0.1/24"})
+        with self.assertRaisesRegex(ValueError, 'VLAN ID 10 already exists'):
+            self.manager.add_vlan({"id": 10, "parent": "br0", "cidr": "10.12.0.1/24"})
+        # Networks are routed on one host, so they must not overlap across trunks
+        with self.assertRaisesRegex(ValueError, 'overlaps with existing VLAN 10 on bond1'):
+            self.manager.add_vlan({"id": 20, "cidr": "10.10.0.1/16"})
+        with self.assertRaisesRegex(ValueError, 'longer than 15'):
+            self.manager.add_vlan({"id": 30, "parent": "bond-uplink12", "cidr": "10.30.0.1/24"})
+        with self.assertRaisesRegex(ValueError, 'parent cannot be changed'):
+            self.manager.update_vlan(10, {"parent": "bond1"})
+
+        self.manager.update_vlan(10, {"nat": False}, parent='bond1')
+        self.manager.delete_vlan(10)
+        reloaded = VlanManager()
+        self.assertIsNone(reloaded.get_vlan(10))
+        self.assertFalse(reloaded.get_vlan(10, 'bond1')['nat'])
+
+    def test_files_are_scoped_per_trunk(self):
+        changes = self.manager.generate_systemd_config()
+        self.assertIn(self.path('20-bond1.10.netdev'), changes.created)
+        self.assertIn(self.path('20-vlan10.netdev'), changes.created)
+        with open(self.path('10-bond1.network.d', 'vlan-bond1.10.conf')) as f:
+            self.assertEqual(f.read(), '[Network]\nVLAN=bond1.10\n')
+        with open(self.path('10-br0.network.d', 'vlan-10.conf')) as f:
+            self.assertEqual(f.read(), '[Network]\nVLAN=vlan10\n')
+
+        self.manager.add_vlan({"id": 20, "parent": "bond1", "cidr": "10.20.0.1/24"})
+        changes = self.manager.generate_systemd_config()
+        self.assertTrue(all('bond1' in path for path in changes.touched()))
+        actions = networkd.link_actions(changes, Config.PARENT_INTERFACE)
+        self.assertEqual(actions['reconfigure'], ['bond1'])
+
+        # Only the requested trunks are synced
+        self.manager.add_vlan({"id": 30, "cidr": "192.168.30.1/24"})
+        self.assertFalse(self.manager.generate_systemd_config(parents=['bond1']).changed)
+
+        # Emptying a trunk removes its files
+        self.manager.delete_vlan(10, 'bond1')
+        self.manager.delete_vlan(20, 'bond1')
+        changes = self.manager.generate_systemd_config()
+        self.assertEqual(len(changes.removed), 6)
+        self.assertEqual(os.listdir(self.path('10-bond1.network.d')), [])
+        self.assertEqual(networkd.link_actions(changes, 'br0')['delete'], ['bond1.10', 'bond1.20'])
+
+    def test_hand_written_files_are_left_alone(self):
+        with open(self.path('20-eth3.5.netdev'), 'w') as f:
+            f.write('[NetDev]\nName=eth3.5\nKind=vlan\n# managed by hand\n\n[VLAN]\nId=5\n')
+        self.manager.generate_systemd_config()
+        self.assertTrue(os.path.exists(self.path('20-eth3.5.netdev')))
+
+    def test_shared_parent_network_file_is_rejected(self):
+        os.remove(self.path('10-bond1.network'))
+        with open(self.path('10-br0.network'), 'w') as f:
+            f.write('[Match]\nName=br0 bond1\n')
+        with self.assertRaisesRegex(ValueError, 'both use 10-br0.network'):
+            self.manager.generate_systemd_config()
+
+    def test_kea_and_nftables(self):
+        kea_config = self.manager.generate_kea_config()['Dhcp4']
+        ids = [s['id'] for s in kea_config['subnet4']]
+        self.assertEqual(ids[0], 10)
+        self.assertGreater(ids[1], 4094)
+        self.assertEqual(ids[1] % 4096, 10)
+        self.assertEqual(kea_config['interfaces-config']['interfaces'], ['vlan10', 'bond1.10'])
+        self.assertEqual(kea_config['subnet4'][1]['user-context']['vlan-manager'], {"vlan": 10, "parent": "bond1"})
+
+        with open(self.manager.generate_nftables_config()) as f:
+            self.assertIn('"bond1.10"', f.read())
+
+    def test_apply_reconfigures_only_the_changed_trunk(self):
+        with FakeBinaries(os.path.join(self.test_dir, 'bin'), ['networkctl', 'sysctl', 'nft', 'systemctl']) as fakes:
+            self.manager.apply_config()
+            fakes.reset()
+            self.manager.update_vlan(10, {"cidr": "10.10.0.2/24"}, parent='bond1')
+            self.manager.apply_config()
+            self.assertEqual(fakes.calls('networkctl'), [['networkctl', 'reload'], ['networkctl', 'reconfigure', 'bond1.10']])
+
+    def test_api(self):
+        from vlan_manager.app import app as app_module
+        app_module.vlan_manager = self.manager
+        client = app_module.app.test_client()
+        with client.session_transaction() as sess:
+            sess['logged_in'] = True
+
+        self.assertEqual(client.get('/api/vlans/10?parent=bond1').json['cidr'], '10.10.0.1/24')
+        self.assertEqual(client.get('/api/vlans/10').json['cidr'], '192.168.10.1/24')
+        self.assertEqual(client.get('/api/vlans/11?parent=bond1').status_code, 404)
+        response = client.patch('/api/vlans/10?parent=bond1', json={"nat": False})
+        self.assertFalse(response.json['nat'])
+        client.post('/api/vlans/delete/10?parent=bond1')
+        self.assertIsNone(self.manager.get_vlan(10, 'bond1'))
+        self.assertIsNotNone(self.manager.get_vlan(10))
+
+if __name__ == '__main__':
+    unittest.main()
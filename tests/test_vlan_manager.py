@@ -57,6 +57,47 @@ class TestVlanManager(unittest.TestCase):
         with self.assertRaises(ValueError):
             self.manager.add_vlan(vlan)
 
+    def test_get_and_update_vlan(self):
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24", "dhcp": True})
+        self.manager.add_vlan({"id": 20, "cidr": "192.168.20.1/24"})
+
+        self.assertTrue(self.manager.has_vlan(10))
+        self.assertTrue(self.manager.has_vlan("20"))
+        self.assertFalse(self.manager.has_vlan(30))
+        self.assertIsNone(self.manager.get_vlan(30))
+        self.assertEqual(self.manager.get_vlan("10")['cidr'], "192.168.10.1/24")
+
+        updated = self.manager.update_vlan(10, {"cidr": "192.168.30.1/24", "nat": True})
+        self.assertTrue(updated['nat'])
+        self.assertEqual(updated['dhcp_gateway'], "192.168.30.1")
+        self.assertEqual(updated['dhcp_pools'], "192.168.30.52 - 192.168.30.254")
+        # Order is stable across updates
+        self.assertEqual([v['id'] for v in self.manager.get_vlans()], [10, 20])
+
+        with self.assertRaises(ValueError):
+            self.manager.update_vlan(10, {"cidr": "192.168.20.0/25"})
+        with self.assertRaises(ValueError):
+            self.manager.update_vlan(10, {"id": 11})
+        with self.assertRaises(ValueError):
+            self.manager.update_vlan(99, {"nat": True})
+
+        reloaded = VlanManager()
+        self.assertEqual(reloaded.get_vlan(10)['cidr'], "192.168.30.1/24")
+
+    def test_delete_vlan(self):
+        self.manager.add_vlan({"id": 10, "cidr": "192.168.10.1/24"})
+        self.manager.delete_vlan("10")
+        self.assertFalse(self.manager.has_vlan(10))
+        # The freed network can be reused
+        self.manager.add_vlan({"id": 11, "cidr": "192.168.10.1/24"})
+
+    def test_add_vlans_single_write(self):
+        with patch.object(self.manager.store, 'commit', wraps=self.manager.store.commit) as commit:
+            added = self.manager.add_vlans({"id": i, "cidr": f"10.0.{i}.1/24"} for i in range(1, 101))
+        self.assertEqual(added, 100)
+        self.assertEqual(commit.call_count, 1)
+        self.assertEqual(len(VlanManager().get_vlans()), 100)
+
     def test_add_vlan_invalid_cidr(self):
         vlan = {
             "id": 50,
@@ -119,7 +160,8 @@ class TestVlanManager(unittest.TestCase):
             self.assertIn('table inet vlan_mgmt', content)
             self.assertIn('chain postrouting', content)
             self.assertIn('masquerade', content)
-            self.assertIn('172.16.0.1/24', content)
+            self.assertIn('elements = { 172.16.0.0/24 }', content)
+            self.assertIn('ip saddr @nat_sources', content)
 
     @patch('subprocess.run')
     def test_apply_config(self, mock_run):
@@ -0,0 +1,93 @@
+import ipaddress
+
+
+class AllocationError(ValueError):
+    """Raised when no free network or VLAN ID is left to allocate."""
+
+
+def parse_networks(value):
+    """Parse a comma separated string (or list) of networks."""
+    if not value:
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    networks = []
+    for item in value:
+        item = str(item).strip()
+        if not item:
+            continue
+        try:
+            networks.append(ipaddress.ip_network(item, strict=True))
+        except ValueError:
+            raise ValueError(f"Invalid network: {item}")
+    return networks
+
+
+def parse_id_ranges(value):
+    """Parse ``"2-99, 200"`` or a ``(first, last)`` pair into sorted ID ranges."""
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)) and len(value) == 2 and all(isinstance(v, int) for v in value):
+        value = [f"{value[0]}-{value[1]}"]
+    elif isinstance(value, str):
+        value = value.split(',')
+    ranges = []
+    for item in value:
+        item = str(item).strip()
+        if not item:
+            continue
+        first, _, last = item.partition('-')
+        try:
+            first, last = int(first), int(last or first)
+        except ValueError:
+            raise ValueError(f"Invalid VLAN ID range: {item}")
+        if not 1 <= first <= last <= 4094:
+            raise ValueError(f"Invalid VLAN ID range: {item}")
+        ranges.append((first, last))
+    return sorted(ranges)
+
+
+def id_bitmap(ids):
+    """An int with bit N set for every ID N."""
+    bitmap = 0
+    for vlan_id in ids:
+        bitmap |= 1 << vlan_id
+    return bitmap
+
+
+def lowest_free_id(used, ranges):
+    """Lowest ID within ``ranges`` whose bit is clear in ``used``, or None.
+
+    One mask-and-complement per range: the lowest set bit of the free mask
+    is the answer, so no ID is tried individually.
+    """
+    for first, last in ranges:
+        free = ~used & (((1 << (last - first + 1)) - 1) << first)
+        if free:
+            return (free & -free).bit_length() - 1
+    return None
+
+
+def first_free_network(index, supernets, prefixlen, reserved=()):
+    """Lowest free ``prefixlen`` network in the first ``supernets`` with room.
+
+    ``index`` is the NetworkIndex of the VLANs; ``reserved`` networks are
+    treated as used for this lookup only. Returns None when all are full.
+    """
+    for supernet in supernets:
+        if not supernet.prefixlen <= prefixlen <= supernet.max_prefixlen:
+            raise ValueError(f"Prefix length /{prefixlen} does not fit in {supernet}")
+
+    for supernet in supernets:
+        tree = index.free_space(supernet.version)
+        marked = [n for n in reserved if n.version == supernet.version]
+        for network in marked:
+            tree.mark(network)
+        try:
+            start = tree.first_free(supernet, prefixlen)
+        finally:
+            for network in marked:
+                tree.unmark(network)
+        if start is not None:
+            return ipaddress.ip_network((start, prefixlen))
+    return None
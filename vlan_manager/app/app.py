@@ -1,8 +1,18 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g
 from functools import wraps
-from vlan_manager.core import VlanManager
+from vlan_manager.core import VlanManager, FILTER_FIELDS
 from vlan_manager.config import Config
+from vlan_manager.jobs import ApplyQueue
+from vlan_manager.events import EventHub
+from vlan_manager.reconcile import Reconciler
+from vlan_manager.bulk import BulkValidationError, detect_format, parse_vlans, export_vlans, MIMETYPES
+from vlan_manager.allocator import AllocationError
+from vlan_manager import metrics
 import logging
+import time
+import json
+import base64
+import hashlib
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -11,7 +21,70 @@ app.secret_key = Config.SECRET_KEY
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-vlan_manager = VlanManager()
+event_hub = EventHub()
+
+def publish_vlan_event(event_type, data):
+    event_hub.publish(event_type, data)
+
+def publish_job_event(job):
+    event_hub.publish(f"apply.{job['status']}", {
+        "job": {k: job.get(k) for k in ('id', 'status', 'steps', 'error', 'duration')},
+        "revision": vlan_manager.revision,
+    })
+
+def create_manager():
+    manager = VlanManager()
+    manager.listeners.append(publish_vlan_event)
+    return manager
+
+vlan_manager = create_manager()
+# Looks up vlan_manager at run time so it always applies the current instance.
+apply_queue = ApplyQueue(lambda: vlan_manager.apply_config())
+apply_queue.listeners.append(publish_job_event)
+reconciler = Reconciler(lambda: vlan_manager)
+reconciler.listeners.append(lambda report: event_hub.publish('reconcile.drift', report))
+
+@app.before_request
+def start_timer():
+    g.request_start = time.monotonic()
+
+@app.after_request
+def record_latency(response):
+    start = g.pop('request_start', None)
+    if start is not None:
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.REQUEST_SECONDS.observe(time.monotonic() - start, route=route,
+                                        method=request.method, status=response.status_code)
+        metrics.REGISTRY.maybe_flush()
+    return response
+
+@app.before_request
+def start_reconciler():
+    # Started lazily so the thread lives in the worker, not a preloading master
+    if Config.RECONCILE_ENABLED:
+        reconciler.start()
+
+@app.before_request
+def start_apply_queue():
+    # Runs a job a restarted worker left queued without waiting for a new submit
+    apply_queue.start()
+
+@app.before_request
+def refresh_vlans():
+    # Other gunicorn workers may have written; this is a stat() when they did not.
+    vlan_manager.refresh()
+
+def vlan_counts():
+    vlans = vlan_manager.vlans
+    return {
+        "all": len(vlans),
+        "nat": sum(1 for v in vlans if v.get('nat')),
+        "dhcp": sum(1 for v in vlans if v.get('dhcp')),
+    }
+
+metrics.REGISTRY.gauge('vlan_manager_vlans', 'Configured VLANs.', lambda: vlan_counts()['all'])
+metrics.REGISTRY.gauge('vlan_manager_nat_vlans', 'VLANs with NAT enabled.', lambda: vlan_counts()['nat'])
+metrics.REGISTRY.gauge('vlan_manager_dhcp_vlans', 'VLANs with DHCP enabled.', lambda: vlan_counts()['dhcp'])
 
 def login_required(f):
     @wraps(f)
@@ -21,6 +94,70 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+TRUE_VALUES = ('1', 'true', 'yes', 'on')
+FALSE_VALUES = ('0', 'false', 'no', 'off')
+
+def list_filters():
+    """Flag filters from the query string, e.g. ?nat=1&dhcp=0."""
+    filters = {}
+    for field in FILTER_FIELDS:
+        value = request.args.get(field)
+        if value is None or value == '':
+            continue
+        if value.lower() in TRUE_VALUES:
+            filters[field] = True
+        elif value.lower() in FALSE_VALUES:
+            filters[field] = False
+        else:
+            raise ValueError(f"Invalid value for {field}: {value}")
+    return filters
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    try:
+        parent, vlan_id = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return (str(parent), int(vlan_id))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor")
+
+def page_args(default_limit=None, max_limit=None):
+    """(limit, after) from ?limit= and ?cursor=; limit is None for no paging."""
+    limit = request.args.get('limit', default_limit)
+    if limit is None and 'cursor' not in request.args:
+        return None, None
+    try:
+        limit = int(limit or default_limit or max_limit)
+    except ValueError:
+        raise ValueError(f"Invalid limit: {limit}")
+    if max_limit:
+        limit = min(limit, max_limit)
+    cursor = request.args.get('cursor')
+    return limit, decode_cursor(cursor) if cursor else None
+
+def page_url(endpoint, limit, after):
+    args = request.args.to_dict()
+    args.update(limit=limit, cursor=encode_cursor(after))
+    return url_for(endpoint, **args)
+
+def revision_etag():
+    # The revision only counts writes made through the API; the generation
+    # also changes when the data files are edited by hand.
+    generation = hashlib.sha1(repr(vlan_manager.generation).encode()).hexdigest()[:12]
+    return f"r{vlan_manager.revision}-{generation}"
+
+def not_modified():
+    """A 304 response when the client's If-None-Match is the current revision."""
+    if request.if_none_match.contains(revision_etag()):
+        response = Response(status=304)
+        response.set_etag(revision_etag())
+        return response
+    return None
+
+def wants_json():
+    return request.is_json or request.accept_mimetypes.best_match(['text/html', 'application/json']) == 'application/json'
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -41,13 +178,48 @@ def logout():
 @app.route('/')
 @login_required
 def dashboard():
-    vlans = vlan_manager.get_vlans()
-    return render_template('dashboard.html', vlans=vlans)
+    # Paged so thousands of VLANs don't turn into a multi-megabyte page
+    try:
+        filters = list_filters()
+        limit, after = page_args(Config.DASHBOARD_PAGE_SIZE, Config.API_MAX_PAGE_SIZE)
+        vlans, next_key = vlan_manager.page_vlans(limit, after, **filters)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('dashboard'))
+    return render_template('dashboard.html', vlans=vlans, default_parent=Config.PARENT_INTERFACE,
+                           total=len(vlan_manager.vlans), filters=filters,
+                           live_updates=Config.DASHBOARD_LIVE_UPDATES,
+                           next_url=page_url('dashboard', limit, next_key) if next_key else None,
+                           first_url=url_for('dashboard', **filters) if after else None)
 
 @app.route('/api/vlans', methods=['GET'])
 @login_required
 def get_vlans():
-    return jsonify(vlan_manager.get_vlans())
+    """List VLANs; the body is always a JSON list.
+
+    The store revision and generation form the ETag, so pollers get a
+    304 with no body while nothing changed. ?nat=, ?dhcp= and
+    ?forwarding= filter by flag.
+    With ?limit= the list is paged in (parent, id) order and a Link
+    header with rel="next" points at the following page.
+    """
+    response = not_modified()
+    if response:
+        return response
+    try:
+        filters = list_filters()
+        limit, after = page_args(max_limit=Config.API_MAX_PAGE_SIZE)
+        if limit is None:
+            vlans, next_key = vlan_manager.get_vlans(**filters), None
+        else:
+            vlans, next_key = vlan_manager.page_vlans(limit, after, **filters)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    response = jsonify(vlans)
+    response.set_etag(revision_etag())
+    if next_key:
+        response.headers['Link'] = f'<{page_url("get_vlans", limit, next_key)}>; rel="next"'
+    return response
 
 @app.route('/api/vlans', methods=['POST'])
 @login_required
@@ -65,6 +237,15 @@ def add_vlan():
              data['dhcp_gateway'] = request.form.get('dhcp_gateway')
              data['dhcp_dns'] = request.form.get('dhcp_dns')
              data['dhcp_pools'] = request.form.get('dhcp_pools')
+             data['dhcp_reserved'] = request.form.get('dhcp_reserved')
+             data['dhcp_pool_count'] = request.form.get('dhcp_pool_count')
+             data['parent'] = request.form.get('parent')
+             data['cidr6'] = request.form.get('cidr6')
+             data['dhcp6'] = 'dhcp6' in request.form
+             data['nat6'] = 'nat6' in request.form
+             data['dhcp6_dns'] = request.form.get('dhcp6_dns')
+             data['dhcp6_pools'] = request.form.get('dhcp6_pools')
+             data['dhcp6_reserved'] = request.form.get('dhcp6_reserved')
 
         vlan_manager.add_vlan(data)
         flash('VLAN added successfully', 'success')
@@ -77,11 +258,89 @@ def add_vlan():
             return jsonify({"status": "error", "message": str(e)}), 400
         return redirect(url_for('dashboard'))
 
+@app.route('/api/vlans/bulk', methods=['POST'])
+@login_required
+def add_vlans_bulk():
+    try:
+        fmt = detect_format(request.mimetype, request.args.get('format'))
+        vlans = parse_vlans(request.get_data(as_text=True), fmt)
+        added = vlan_manager.add_vlans(vlans)
+    except BulkValidationError as e:
+        return jsonify({"status": "error", "message": str(e), "errors": e.errors}), 400
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify({"status": "success", "added": added}), 201
+
+@app.route('/api/vlans/allocate', methods=['POST'])
+@login_required
+def allocate_vlan():
+    """Create a VLAN on the next free ID and network.
+
+    Takes prefixlen (and/or prefixlen6), optional supernet, supernet6,
+    id_range and parent, plus any other VLAN fields to set.
+    """
+    data = dict(request.get_json(force=True, silent=True) or {})
+    args = {key: data.pop(key) for key in ('prefixlen', 'supernet', 'id_range', 'parent', 'prefixlen6', 'supernet6')
+            if key in data}
+    try:
+        vlan = vlan_manager.allocate(**args, **data)
+    except AllocationError as e:
+        return jsonify({"status": "error", "message": str(e)}), 409
+    except (TypeError, ValueError) as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(vlan), 201
+
+@app.route('/api/vlans/export', methods=['GET'])
+@login_required
+def export_vlans_route():
+    try:
+        fmt = detect_format(None, request.args.get('format', 'ndjson'))
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    vlans = vlan_manager.get_vlans()
+    response = Response(stream_with_context(export_vlans(vlans, fmt)), mimetype=MIMETYPES[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename=vlans.{fmt}'
+    return response
+
+def vlan_not_found(vlan_id, parent):
+    where = f" on {parent}" if parent else ""
+    return jsonify({"status": "error", "message": f"VLAN ID {vlan_id}{where} does not exist"}), 404
+
+# VLANs on trunks other than PARENT_INTERFACE are addressed with ?parent=<interface>
+@app.route('/api/vlans/<int:vlan_id>', methods=['GET'])
+@login_required
+def get_vlan(vlan_id):
+    response = not_modified()
+    if response:
+        return response
+    parent = request.args.get('parent')
+    vlan = vlan_manager.get_vlan(vlan_id, parent)
+    if vlan is None:
+        return vlan_not_found(vlan_id, parent)
+    response = jsonify(vlan)
+    response.set_etag(revision_etag())
+    return response
+
+@app.route('/api/vlans/<int:vlan_id>', methods=['PATCH'])
+@login_required
+def update_vlan(vlan_id):
+    parent = request.args.get('parent')
+    if not vlan_manager.has_vlan(vlan_id, parent):
+        return vlan_not_found(vlan_id, parent)
+    patch = request.get_json(force=True) or {}
+    if not isinstance(patch, dict):
+        return jsonify({"status": "error", "message": "Request body must be a JSON object"}), 400
+    try:
+        vlan = vlan_manager.update_vlan(vlan_id, patch, parent)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    return jsonify(vlan)
+
 @app.route('/api/vlans/delete/<int:vlan_id>', methods=['POST'])
 @login_required
 def delete_vlan(vlan_id):
     try:
-        vlan_manager.delete_vlan(vlan_id)
+        vlan_manager.delete_vlan(vlan_id, request.args.get('parent') or request.form.get('parent'))
         flash('VLAN deleted successfully', 'success')
     except Exception as e:
         flash(f'Error deleting VLAN: {e}', 'error')
@@ -91,11 +350,81 @@ def delete_vlan(vlan_id):
 @login_required
 def apply_config():
     try:
-        vlan_manager.apply_config()
-        flash('Configuration applied successfully', 'success')
+        job = apply_queue.submit()
     except Exception as e:
-        flash(f'Failed to apply configuration: {e}', 'error')
+        if wants_json():
+            return jsonify({"status": "error", "message": str(e)}), 500
+        flash(f'Failed to queue configuration apply: {e}', 'error')
+        return redirect(url_for('dashboard'))
+
+    if wants_json():
+        return jsonify({
+            "status": job['status'],
+            "job": job,
+            "status_url": url_for('apply_status', job_id=job['id']),
+        }), 202
+    flash(f"Configuration apply queued (job {job['id']})", 'success')
     return redirect(url_for('dashboard'))
 
+# Preview of what an apply would write: ?format=diff returns the plain
+# unified diff, ?files=1 adds the content of every desired file.
+@app.route('/api/plan', methods=['GET'])
+@login_required
+def plan():
+    try:
+        result = vlan_manager.plan()
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+    if request.args.get('format') == 'diff':
+        return Response(result['diff'], mimetype='text/x-diff')
+    if request.args.get('files', '').lower() not in TRUE_VALUES:
+        del result['files']
+    result['changed'] = sum(1 for change in result['changes'].values() if change != 'unchanged')
+    return jsonify(result)
+
+@app.route('/api/apply/<job_id>', methods=['GET'])
+@login_required
+def apply_status(job_id):
+    job = apply_queue.get(job_id)
+    if job is None:
+        return jsonify({"status": "error", "message": f"Apply job {job_id} does not exist"}), 404
+    return jsonify(job)
+
+# Change feed for dashboards and API clients instead of polling /api/vlans.
+# Each stream ends after EVENTS_STREAM_TIMEOUT; clients resume with the
+# Last-Event-ID header (or ?last_event_id=, for EventSource polyfills).
+# Each open stream holds a sync gunicorn worker until it ends.
+@app.route('/api/events', methods=['GET'])
+@login_required
+def events():
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    if last_id is not None:
+        try:
+            last_id = int(last_id)
+        except ValueError:
+            return jsonify({"status": "error", "message": f"Invalid event ID: {last_id}"}), 400
+    response = Response(stream_with_context(event_hub.stream(last_id)), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+# GET reports drift between the host and the VLAN list, POST also repairs it.
+@app.route('/api/reconcile', methods=['GET', 'POST'])
+@login_required
+def reconcile():
+    try:
+        if request.method == 'POST':
+            return jsonify(reconciler.run_once(fix=True, blocking=True))
+        return jsonify(reconciler.check())
+    except Exception as e:
+        return jsonify({"status": "error", "message": str(e)}), 500
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    # Scrapers cannot log in; protect with a bearer token when one is configured.
+    if Config.METRICS_TOKEN and request.headers.get('Authorization') != f"Bearer {Config.METRICS_TOKEN}":
+        return Response("Unauthorized\n", status=401, mimetype='text/plain')
+    return Response(metrics.REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
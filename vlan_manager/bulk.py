@@ -0,0 +1,124 @@
+import io
+import csv
+import json
+
+FORMATS = ('json', 'ndjson', 'csv')
+CSV_FIELDS = ['id', 'cidr', 'dhcp', 'dhcp_gateway', 'dhcp_dns', 'dhcp_pools', 'forwarding', 'nat', 'parent',
+              'cidr6', 'dhcp6', 'dhcp6_dns', 'dhcp6_pools', 'nat6']
+BOOLEAN_FIELDS = ('dhcp', 'forwarding', 'nat', 'dhcp6', 'nat6')
+MIMETYPES = {
+    'json': 'application/json',
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class BulkValidationError(ValueError):
+    """Raised when any row of a batch is invalid; nothing is written.
+
+    ``errors`` is a list of ``{"row": n, "id": ..., "message": ...}`` dicts
+    with 1-based row numbers.
+    """
+
+    def __init__(self, errors):
+        self.errors = sorted(errors, key=lambda e: e['row'])
+        super().__init__(f"{len(self.errors)} of the submitted VLANs are invalid; nothing was added")
+
+
+def detect_format(content_type, explicit=None):
+    """Pick the batch format from an explicit name or the request mimetype."""
+    if explicit:
+        if explicit not in FORMATS:
+            raise ValueError(f"Unsupported format: {explicit}")
+        return explicit
+    mimetype = (content_type or '').split(';')[0].strip().lower()
+    if mimetype in ('application/x-ndjson', 'application/ndjson', 'application/jsonl', 'application/x-jsonlines'):
+        return 'ndjson'
+    if mimetype in ('text/csv', 'application/csv'):
+        return 'csv'
+    return 'json'
+
+
+def parse_vlans(text, fmt):
+    """Parse a batch into a list of VLAN dicts, collecting per-row errors."""
+    if fmt == 'json':
+        try:
+            rows = json.loads(text)
+        except ValueError as e:
+            raise BulkValidationError([{"row": 0, "id": None, "message": f"Invalid JSON: {e}"}])
+        if isinstance(rows, dict):
+            rows = rows.get('vlans', [])
+        if not isinstance(rows, list):
+            raise BulkValidationError([{"row": 0, "id": None, "message": "Expected a list of VLANs"}])
+        return _check_objects(rows)
+
+    if fmt == 'ndjson':
+        rows = []
+        errors = []
+        for line_no, line in enumerate(text.splitlines(), 1):
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                errors.append({"row": line_no, "id": None, "message": f"Invalid JSON: {e}"})
+        if errors:
+            raise BulkValidationError(errors)
+        return _check_objects(rows)
+
+    if fmt == 'csv':
+        rows = []
+        for record in csv.DictReader(io.StringIO(text)):
+            vlan = {}
+            for key, value in record.items():
+                if key is None or value is None or value.strip() == '':
+                    continue
+                key = key.strip()
+                value = value.strip()
+                if key in BOOLEAN_FIELDS:
+                    vlan[key] = value.lower() in ('1', 'true', 'yes', 'on', 'y')
+                else:
+                    vlan[key] = value
+            rows.append(vlan)
+        return rows
+
+    raise ValueError(f"Unsupported format: {fmt}")
+
+
+def export_vlans(vlans, fmt):
+    """Yield the VLANs serialised as ``fmt``, one chunk per VLAN."""
+    if fmt == 'json':
+        yield '['
+        for i, vlan in enumerate(vlans):
+            yield (',' if i else '') + json.dumps(vlan)
+        yield ']\n'
+    elif fmt == 'ndjson':
+        for vlan in vlans:
+            yield json.dumps(vlan) + '\n'
+    elif fmt == 'csv':
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore', lineterminator='\n')
+        writer.writeheader()
+        for vlan in vlans:
+            writer.writerow({k: _csv_value(vlan.get(k)) for k in CSV_FIELDS})
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        if buffer.getvalue():
+            yield buffer.getvalue()
+    else:
+        raise ValueError(f"Unsupported format: {fmt}")
+
+
+def _csv_value(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    return '' if value is None else value
+
+
+def _check_objects(rows):
+    errors = [{"row": i, "id": None, "message": "Expected a JSON object"}
+              for i, row in enumerate(rows, 1) if not isinstance(row, dict)]
+    if errors:
+        raise BulkValidationError(errors)
+    return rows
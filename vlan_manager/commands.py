@@ -0,0 +1,37 @@
+import time
+import logging
+import subprocess
+from .metrics import COMMAND_SECONDS, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+def run_command(cmd, timeout=None, input=None):
+    """Run ``cmd`` and return a result dict instead of raising.
+
+    Missing binaries and non-zero exits are logged as warnings, matching
+    how the manager has always treated networkctl, nft and systemctl on
+    hosts where they are unavailable.
+    """
+    result = {"command": list(cmd), "ok": False, "returncode": None, "output": "", "duration": 0.0}
+    start = time.monotonic()
+    try:
+        stdin = {"input": input} if input is not None else {"stdin": subprocess.DEVNULL}
+        proc = subprocess.run(cmd, check=True, capture_output=True, text=True, timeout=timeout, **stdin)
+        result["ok"] = True
+        result["returncode"] = proc.returncode
+        result["output"] = (proc.stdout or '') + (proc.stderr or '')
+    except FileNotFoundError:
+        result["output"] = f"{cmd[0]}: command not found"
+        logger.warning(f"{cmd[0]} not found. Skipping '{' '.join(cmd)}'.")
+    except subprocess.CalledProcessError as e:
+        result["returncode"] = e.returncode
+        result["output"] = (e.stdout or '') + (e.stderr or '')
+        logger.warning(f"'{' '.join(cmd)}' failed with exit code {e.returncode}: {result['output'].strip()}")
+    except subprocess.TimeoutExpired:
+        result["output"] = f"timed out after {timeout}s"
+        logger.warning(f"'{' '.join(cmd)}' timed out after {timeout}s")
+    result["duration"] = time.monotonic() - start
+    COMMAND_SECONDS.observe(result["duration"], command=cmd[0], ok=str(result["ok"]).lower())
+    REGISTRY.maybe_flush()
+    return result
@@ -5,10 +5,66 @@ class Config:
     PARENT_INTERFACE = os.environ.get('PARENT_INTERFACE', 'br0')
     WAN_INTERFACE = os.environ.get('WAN_INTERFACE', 'eth0')
     DATA_FILE = os.environ.get('DATA_FILE', 'vlan_manager/data/vlans.json')
+    STORE_BACKEND = os.environ.get('STORE_BACKEND', 'journal')
+    STORE_COMPACT_INTERVAL = int(os.environ.get('STORE_COMPACT_INTERVAL', '500'))
+    SQLITE_FILE = os.environ.get('SQLITE_FILE', 'vlan_manager/data/vlans.db')
     NETWORK_DIR = os.environ.get('NETWORK_DIR', '/etc/systemd/network')
     NFTABLES_DIR = os.environ.get('NFTABLES_DIR', '/etc/nftables.d')
     NFTABLES_INCLUDE_FILE = 'vlans.nft'
+    APPLY_JOBS_DIR = os.environ.get('APPLY_JOBS_DIR', 'vlan_manager/data/jobs')
+    APPLY_MAX_WORKERS = int(os.environ.get('APPLY_MAX_WORKERS', '4'))
+    APPLY_JOBS_KEEP = int(os.environ.get('APPLY_JOBS_KEEP', '50'))
+    # Shared directory for per-process metric snapshots (one per gunicorn
+    # worker); unset means /metrics only reports the worker that answers.
+    METRICS_DIR = os.environ.get('METRICS_DIR')
+    METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '10'))
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # Change feed behind GET /api/events, shared by all workers; defaults to
+    # events.log next to DATA_FILE. Streams end after EVENTS_STREAM_TIMEOUT
+    # seconds, below gunicorn's default 30s worker timeout, and browsers
+    # reconnect EVENTS_RETRY seconds later. An open stream occupies a sync
+    # worker, so the dashboard only subscribes with DASHBOARD_LIVE_UPDATES
+    # (use threaded or async workers then, e.g. --worker-class gthread).
+    EVENTS_FILE = os.environ.get('EVENTS_FILE')
+    EVENTS_MAX_BYTES = int(os.environ.get('EVENTS_MAX_BYTES', str(1024 * 1024)))
+    EVENTS_POLL_INTERVAL = float(os.environ.get('EVENTS_POLL_INTERVAL', '0.5'))
+    EVENTS_HEARTBEAT = float(os.environ.get('EVENTS_HEARTBEAT', '15'))
+    EVENTS_STREAM_TIMEOUT = float(os.environ.get('EVENTS_STREAM_TIMEOUT', '25'))
+    EVENTS_RETRY = float(os.environ.get('EVENTS_RETRY', '3'))
+    DASHBOARD_LIVE_UPDATES = os.environ.get('DASHBOARD_LIVE_UPDATES', '').lower() in ('1', 'true', 'yes')
+    SYSCTL_FILE = os.environ.get('SYSCTL_FILE', '/etc/sysctl.d/99-vlan-manager.conf')
+    # Largest ?limit= accepted by GET /api/vlans, and rows per dashboard page
+    API_MAX_PAGE_SIZE = int(os.environ.get('API_MAX_PAGE_SIZE', '1000'))
+    DASHBOARD_PAGE_SIZE = int(os.environ.get('DASHBOARD_PAGE_SIZE', '100'))
+    # Drift checks of the live links, nft table and Kea subnets. A check
+    # runs every RECONCILE_INTERVAL seconds while something changes and
+    # backs off up to RECONCILE_MAX_INTERVAL while the host stays in sync.
+    RECONCILE_ENABLED = os.environ.get('RECONCILE_ENABLED', '').lower() in ('1', 'true', 'yes')
+    RECONCILE_FIX = os.environ.get('RECONCILE_FIX', '').lower() in ('1', 'true', 'yes')
+    RECONCILE_INTERVAL = float(os.environ.get('RECONCILE_INTERVAL', '30'))
+    RECONCILE_MAX_INTERVAL = float(os.environ.get('RECONCILE_MAX_INTERVAL', '600'))
+    # Each cycle waits at least this many times its own duration, and
+    # repairs at most RECONCILE_MAX_FIXES links; the rest waits for the next.
+    RECONCILE_COST_FACTOR = float(os.environ.get('RECONCILE_COST_FACTOR', '20'))
+    RECONCILE_MAX_FIXES = int(os.environ.get('RECONCILE_MAX_FIXES', '20'))
+    RECONCILE_TIMEOUT = float(os.environ.get('RECONCILE_TIMEOUT', '10'))
     ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'password')
     KEA_CONFIG_FILE = os.environ.get('KEA_CONFIG_FILE', '/etc/kea/kea-dhcp4.conf')
     KEA_SERVICE_NAME = os.environ.get('KEA_SERVICE_NAME', 'kea-dhcp4-server')
+    KEA_CONFIG_MODE = os.environ.get('KEA_CONFIG_MODE', 'replace')
+    KEA_CONTROL_SOCKET = os.environ.get('KEA_CONTROL_SOCKET', '/run/kea/kea4-ctrl-socket')
+    # Kea's DHCPv6 server runs separately; it is only configured once a VLAN enables dhcp6.
+    KEA6_CONFIG_FILE = os.environ.get('KEA6_CONFIG_FILE', '/etc/kea/kea-dhcp6.conf')
+    KEA6_SERVICE_NAME = os.environ.get('KEA6_SERVICE_NAME', 'kea-dhcp6-server')
+    KEA6_CONTROL_SOCKET = os.environ.get('KEA6_CONTROL_SOCKET', '/run/kea/kea6-ctrl-socket')
+    # Defaults for VlanManager.allocate(): comma separated supernets to carve
+    # VLAN networks from, prefixes never handed out, and the VLAN ID range.
+    ALLOCATION_SUPERNETS = os.environ.get('ALLOCATION_SUPERNETS', '10.0.0.0/8')
+    ALLOCATION_SUPERNETS6 = os.environ.get('ALLOCATION_SUPERNETS6', '')
+    ALLOCATION_RESERVED = os.environ.get('ALLOCATION_RESERVED', '')
+    ALLOCATION_ID_RANGE = os.environ.get('ALLOCATION_ID_RANGE', '2-4094')
+    ALLOCATION_RESERVED_IDS = os.environ.get('ALLOCATION_RESERVED_IDS', '')
+    DHCP_POOL_RATIO = float(os.environ.get('DHCP_POOL_RATIO', '0.8'))
+    # Most ranges a VLAN's dhcp_pool_count may split its default pool into
+    DHCP_MAX_POOL_COUNT = int(os.environ.get('DHCP_MAX_POOL_COUNT', '16'))
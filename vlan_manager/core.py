@@ -1,87 +1,514 @@
 import os
 import json
-import subprocess
+import bisect
+import difflib
 import logging
 import ipaddress
+import time
+import threading
+from contextlib import contextmanager
 from .config import Config
+from .netindex import NetworkIndex, vlan_networks, ipv6_interface
+from .pools import parse_ranges, default_pools, host_range
+from .allocator import AllocationError, parse_networks, parse_id_ranges, id_bitmap, lowest_free_id, first_free_network
+from .files import sync_files, write_atomic, ChangeSet
+from .kea import KeaControl, KeaControlError
+from . import kea
+from .commands import run_command
+from .storage import create_store, put_op, delete_op, record_key
+from .bulk import BulkValidationError
+from . import networkd
+from . import nftables
+from .graph import StepGraph, StepError, SKIPPED, BLOCKED
+from . import metrics
 
 logger = logging.getLogger(__name__)
 
+FILTER_FIELDS = ('nat', 'dhcp', 'forwarding')
+SYSCTL_CONTENT = "net.ipv4.ip_forward=1\n"
+# Forwarding makes the kernel ignore router advertisements unless
+# accept_ra=2, which would drop a WAN address configured by SLAAC.
+SYSCTL_IPV6_CONTENT = "net.ipv6.conf.all.forwarding=1\nnet.ipv6.conf.{wan}.accept_ra=2\n"
+
 class VlanManager:
     def __init__(self, data_file=None):
         self.data_file = data_file or Config.DATA_FILE
+        self.store = create_store(self.data_file)
+        self.index = NetworkIndex()
+        self._lock = threading.RLock()
+        self._vlans = {}
+        # trunk -> bitmap of the VLAN IDs in use on it, for allocate()
+        self._used_ids = {}
+        self._generation = self.store.generation()
+        # Store revision the in-memory VLANs correspond to; see BaseStore.revision
+        self.revision = self.store.revision()
+        self._sorted = (None, [])
+        self._network_files = networkd.NetworkFileIndex()
+        # Output of _render(), reused until the VLANs or the config change
+        self._rendered = None
+        # Called as listener(event_type, data) after each change is written
+        self.listeners = []
         self.vlans = self.load_vlans()
 
+    @property
+    def vlans(self):
+        """All VLANs in insertion order."""
+        return list(self._vlans.values())
+
+    @vlans.setter
+    def vlans(self, vlans):
+        self._vlans = {}
+        self._used_ids = {}
+        self._rendered = None
+        for v in vlans:
+            try:
+                key = record_key(v)
+            except (KeyError, TypeError, ValueError):
+                logger.warning(f"Ignoring VLAN with invalid ID: {v.get('id')}")
+                continue
+            if key in self._vlans:
+                logger.warning(f"Duplicate {self._id_label(key)} in data file, keeping the last entry")
+            self._vlans[key] = v
+            self._mark_id(key)
+
+    def _mark_id(self, key):
+        trunk, vlan_id = key
+        self._used_ids[trunk] = self._used_ids.get(trunk, 0) | (1 << vlan_id)
+
+    def _clear_id(self, key):
+        trunk, vlan_id = key
+        self._used_ids[trunk] = self._used_ids.get(trunk, 0) & ~(1 << vlan_id)
+
     def load_vlans(self):
-        if not os.path.exists(self.data_file):
-            return []
         try:
-            with open(self.data_file, 'r') as f:
-                vlans = json.load(f)
-                self._check_for_overlaps(vlans, raise_error=False)
-                return vlans
+            # Shared lock: a writer's append is never seen half done
+            with self.store.lock(shared=True), metrics.STORE_SECONDS.time(operation='load'):
+                vlans = self.store.load()
+                self._generation = self.store.generation()
+                self.revision = self.store.revision()
+            self.index = self._check_for_overlaps(vlans, raise_error=False)
+            return vlans
         except Exception as e:
             logger.error(f"Failed to load VLANs: {e}")
             return []
 
+    @property
+    def generation(self):
+        """The store generation the current VLANs were loaded at."""
+        return self._generation
+
+    def refresh(self):
+        """Pick up changes written by other processes (e.g. gunicorn workers).
+
+        When nothing changed this costs one stat() per backing file.
+        Returns True if the VLANs were reloaded.
+        """
+        if self.store.generation() == self._generation:
+            return False
+        with self._lock, self.store.lock(shared=True):
+            return self._reload()
+
+    def _reload(self):
+        generation = self.store.generation()
+        if generation == self._generation:
+            return False
+        try:
+            with metrics.STORE_SECONDS.time(operation='load'):
+                vlans = self.store.load()
+        except Exception as e:
+            logger.error(f"Failed to reload VLANs, keeping the current set: {e}")
+            return False
+        self.index = self._check_for_overlaps(vlans, raise_error=False)
+        self.vlans = vlans
+        self._generation = generation
+        self.revision = self.store.revision()
+        return True
+
+    @contextmanager
+    def _writing(self):
+        """Serialise a read-validate-write cycle across threads and processes."""
+        with self._lock, self.store.lock():
+            self._reload()
+            try:
+                yield
+            finally:
+                self._rendered = None
+            self._generation = self.store.generation()
+            self.revision = self.store.revision()
+
+    def _notify(self, event_type, **data):
+        data['revision'] = self.revision
+        for listener in self.listeners:
+            try:
+                listener(event_type, data)
+            except Exception as e:
+                logger.warning(f"VLAN event listener failed: {e}")
+
     def _check_for_overlaps(self, vlans, raise_error=True):
-        """Check for overlapping network ranges in the provided list of VLANs."""
-        networks = []
+        """Check for overlapping network ranges in the provided list of VLANs.
+
+        Returns the NetworkIndex built along the way so callers can keep it.
+        """
+        index = NetworkIndex()
         for v in vlans:
             try:
-                new_net = ipaddress.ip_network(v['cidr'], strict=False)
-            except ValueError:
-                msg = f"VLAN {v.get('id')} has invalid CIDR: {v.get('cidr')}"
+                key = record_key(v)
+                networks = vlan_networks(v)
+            except (KeyError, TypeError, ValueError):
+                msg = f"VLAN {v.get('id')} has invalid ID or CIDR: {v.get('cidr')}"
                 if raise_error:
                     raise ValueError(msg)
                 logger.warning(msg)
                 continue
 
-            for existing_id, existing_net in networks:
-                if new_net.overlaps(existing_net):
-                    msg = f"Network {new_net} (VLAN {v['id']}) overlaps with existing VLAN {existing_id} ({existing_net})"
+            for new_net in networks:
+                for existing_key, existing_net in index.overlapping(new_net):
+                    msg = self._overlap_message(key, new_net, existing_key, existing_net)
                     if raise_error:
                         raise ValueError(msg)
                     logger.warning(msg)
-            networks.append((v['id'], new_net))
+                index.add(key, new_net)
+        return index
+
+    @classmethod
+    def _overlap_message(cls, key, network, existing_key, existing_net):
+        return (f"Network {network} ({cls._vlan_label(key)}) overlaps with existing "
+                f"{cls._vlan_label(existing_key)} ({existing_net})")
+
+    @staticmethod
+    def _vlan_label(key):
+        parent, vlan_id = key
+        return f"VLAN {vlan_id} on {parent}" if parent else f"VLAN {vlan_id}"
+
+    @staticmethod
+    def _id_label(key):
+        parent, vlan_id = key
+        return f"VLAN ID {vlan_id} on {parent}" if parent else f"VLAN ID {vlan_id}"
 
     def save_vlans(self):
-        os.makedirs(os.path.dirname(self.data_file), exist_ok=True)
-        with open(self.data_file, 'w') as f:
-            json.dump(self.vlans, f, indent=4)
+        """Write a full snapshot of the current VLANs."""
+        with self._lock, self.store.lock(), metrics.STORE_SECONDS.time(operation='save'):
+            self.store.save(self.vlans)
+            self._generation = self.store.generation()
+            self.revision = self.store.revision()
+
+    def _persist(self, ops):
+        try:
+            with metrics.STORE_SECONDS.time(operation='commit'):
+                self.store.commit(ops, self.get_vlans)
+        except Exception:
+            # Memory is now ahead of the store; fall back to what was persisted.
+            self._generation = None
+            self._reload()
+            raise
+
+    @classmethod
+    def _vlan_key(cls, vlan_id, parent=None):
+        """(trunk, id) key of a VLAN; see ``_trunk`` for the trunk part."""
+        try:
+            return (cls._trunk(parent), int(vlan_id))
+        except (TypeError, ValueError):
+            raise ValueError("Invalid VLAN ID")
+
+    @staticmethod
+    def _trunk(parent):
+        """Normalise a parent interface name: '' stands for the default trunk.
+
+        VLANs on Config.PARENT_INTERFACE are stored without a parent, like
+        every VLAN was before trunks existed.
+        """
+        if parent is None:
+            return ''
+        if not isinstance(parent, str):
+            raise ValueError(f"Invalid parent interface: {parent!r}")
+        parent = parent.strip()
+        return '' if parent == Config.PARENT_INTERFACE else parent
+
+    def get_vlans(self, **filters):
+        """Return all VLANs, or those whose flags match ``filters``.
+
+        e.g. ``get_vlans(nat=True)``. Stores with column indexes answer
+        filtered listings with a query instead of a list walk.
+        """
+        if not filters:
+            return self.vlans
+        if self.store.indexed:
+            return self.store.query(**filters)
+        self._check_filters(filters)
+        return [v for v in self._vlans.values() if self._matches(v, filters)]
+
+    def page_vlans(self, limit, after=None, **filters):
+        """One page of VLANs in (parent, id) order after the key ``after``.
+
+        Returns ``(vlans, next_key)``; ``next_key`` is None on the last page.
+        """
+        self._check_filters(filters)
+        if limit < 1:
+            raise ValueError("Page size must be at least 1")
+        keys = self._sorted_keys()
+        pos = bisect.bisect_right(keys, tuple(after)) if after else 0
+        page = []
+        while pos < len(keys) and len(page) <= limit:
+            vlan = self._vlans.get(keys[pos])
+            pos += 1
+            if vlan is not None and self._matches(vlan, filters):
+                page.append(vlan)
+        if len(page) > limit:
+            page = page[:limit]
+            return page, record_key(page[-1])
+        return page, None
+
+    def _sorted_keys(self):
+        generation, keys = self._sorted
+        if generation != self._generation or len(keys) != len(self._vlans):
+            keys = sorted(self._vlans)
+            self._sorted = (self._generation, keys)
+        return keys
+
+    @staticmethod
+    def _check_filters(filters):
+        for key in filters:
+            if key not in FILTER_FIELDS:
+                raise ValueError(f"Unsupported filter: {key}")
+
+    @staticmethod
+    def _matches(vlan, filters):
+        return all(bool(vlan.get(k)) == bool(val) for k, val in filters.items())
+
+    def get_vlan(self, vlan_id, parent=None):
+        """Return the VLAN with the given ID on ``parent``'s trunk, or None."""
+        try:
+            return self._vlans.get(self._vlan_key(vlan_id, parent))
+        except ValueError:
+            return None
 
-    def get_vlans(self):
-        return self.vlans
+    def has_vlan(self, vlan_id, parent=None):
+        return self.get_vlan(vlan_id, parent) is not None
 
     def add_vlan(self, vlan_data):
         """Add a new VLAN after validating its ID and network range."""
+        key, networks = self._validate_vlan(vlan_data)
+
+        with self._writing():
+            self._insert(key, networks, vlan_data)
+        self._notify('vlan.added', vlan=vlan_data)
+
+    def _insert(self, key, networks, vlan_data):
+        if key in self._vlans:
+            raise ValueError(f"{self._id_label(key)} already exists")
+
+        self._check_overlap(key, networks)
+
+        self._vlans[key] = vlan_data
+        self._mark_id(key)
+        self._index(key, networks)
+        self._persist([put_op(vlan_data)])
+
+    def allocate(self, prefixlen=None, supernet=None, id_range=None, parent=None,
+                 prefixlen6=None, supernet6=None, **fields):
+        """Add a VLAN on the lowest free ID and first free network; return it.
+
+        Defaults come from the ALLOCATION_* settings. Runs under the write
+        lock, so concurrent allocations never collide. Raises
+        AllocationError when nothing is free.
+        """
+        if prefixlen is None and prefixlen6 is None:
+            raise ValueError("A prefix length is required")
+        id_range = id_range or Config.ALLOCATION_ID_RANGE
+        ranges = parse_id_ranges(id_range)
+        reserved_ids = id_bitmap(vlan_id for first, last in parse_id_ranges(Config.ALLOCATION_RESERVED_IDS)
+                                 for vlan_id in range(first, last + 1))
+        reserved = parse_networks(Config.ALLOCATION_RESERVED)
+        wanted = []
+        if prefixlen is not None:
+            wanted.append(('cidr', prefixlen, parse_networks(supernet or Config.ALLOCATION_SUPERNETS)))
+        if prefixlen6 is not None:
+            wanted.append(('cidr6' if wanted else 'cidr', prefixlen6,
+                           parse_networks(supernet6 or Config.ALLOCATION_SUPERNETS6)))
+        for field, length, supernets in wanted:
+            if not supernets:
+                raise ValueError(f"No supernet to allocate {field} from")
+            if isinstance(length, bool) or not isinstance(length, int):
+                raise ValueError(f"Invalid prefix length: {length!r}")
+        trunk = self._trunk(parent)
+
+        with self._writing():
+            used = reserved_ids | self._used_ids.get(trunk, 0)
+            vlan_id = lowest_free_id(used, ranges)
+            if vlan_id is None:
+                where = f" on {trunk}" if trunk else ""
+                raise AllocationError(f"No free VLAN ID in {id_range}{where}")
+
+            vlan_data = dict(fields, id=vlan_id, parent=trunk)
+            for field, length, supernets in wanted:
+                network = first_free_network(self.index, supernets, length, reserved)
+                if network is None:
+                    raise AllocationError(f"No free /{length} left in {', '.join(map(str, supernets))}")
+                first = host_range(network)[0] - int(network.network_address)
+                vlan_data[field] = f"{network[first]}/{length}"
+
+            key, networks = self._validate_vlan(vlan_data)
+            self._insert(key, networks, vlan_data)
+        self._notify('vlan.added', vlan=vlan_data)
+        return vlan_data
+
+    def add_vlans(self, vlans):
+        """Add a batch of VLANs with one validation pass and one write.
+
+        Every row is checked against the existing VLANs and the rest of the
+        batch. If any row is invalid a BulkValidationError listing all
+        problems is raised and nothing is added. Returns the number added.
+        """
+        errors = []
+        prepared = []
+        for row, vlan_data in enumerate(vlans, 1):
+            try:
+                key, networks = self._validate_vlan(vlan_data)
+            except ValueError as e:
+                errors.append({"row": row, "id": vlan_data.get('id'), "message": str(e)})
+                continue
+            prepared.append((row, key, networks, vlan_data))
+
+        with self._writing():
+            batch_rows = {}
+            batch_index = NetworkIndex()
+            for row, key, networks, vlan_data in prepared:
+                message = None
+                if key in self._vlans:
+                    message = f"{self._id_label(key)} already exists"
+                elif key in batch_rows:
+                    message = f"{self._id_label(key)} is also used in row {batch_rows[key]}"
+                else:
+                    for network in networks:
+                        for existing_key, existing_net in self.index.overlapping(network):
+                            message = message or self._overlap_message(key, network, existing_key, existing_net)
+                            break
+                        for other_key, other_net in batch_index.overlapping(network):
+                            message = message or (f"Network {network} ({self._vlan_label(key)}) overlaps with "
+                                                  f"{self._vlan_label(other_key)} ({other_net}) in row {batch_rows[other_key]}")
+                            break
+                if message:
+                    errors.append({"row": row, "id": key[1], "message": message})
+                    continue
+                batch_rows[key] = row
+                for network in networks:
+                    batch_index.add(key, network)
+
+            if errors:
+                raise BulkValidationError(errors)
+
+            for row, key, networks, vlan_data in prepared:
+                self._vlans[key] = vlan_data
+                self._mark_id(key)
+                self._index(key, networks)
+            self._persist([put_op(vlan_data) for _, _, _, vlan_data in prepared])
+        # Only the keys: a bulk import can be thousands of VLANs
+        self._notify('vlans.added', count=len(prepared),
+                     vlans=[{"id": key[1], "parent": key[0] or None} for _, key, _, _ in prepared])
+        return len(prepared)
+
+    def update_vlan(self, vlan_id, patch, parent=None):
+        """Apply ``patch`` to an existing VLAN and return the updated VLAN.
+
+        The ID and parent cannot be changed. When ``cidr`` or ``cidr6``
+        changes, the DHCP settings of that family that are not part of the
+        patch are re-derived from the new network.
+        """
+        key = self._vlan_key(vlan_id, parent)
+        if 'id' in patch and self._vlan_key(patch['id'], parent) != key:
+            raise ValueError("VLAN ID cannot be changed")
+        if 'parent' in patch and self._trunk(patch['parent']) != key[0]:
+            raise ValueError("VLAN parent cannot be changed; delete and re-add the VLAN instead")
+
+        with self._writing():
+            current = self._vlans.get(key)
+            if current is None:
+                raise ValueError(f"{self._id_label(key)} does not exist")
+
+            vlan_data = dict(current)
+            vlan_data.update(patch)
+            for cidr, derived in (('cidr', ('dhcp_gateway', 'dhcp_dns', 'dhcp_pools')),
+                                  ('cidr6', ('dhcp6_dns', 'dhcp6_pools'))):
+                if vlan_data.get(cidr) != current.get(cidr):
+                    for field in derived:
+                        if field not in patch:
+                            vlan_data.pop(field, None)
+
+            _, networks = self._validate_vlan(vlan_data)
+            self._check_overlap(key, networks, exclude=key)
+
+            self._vlans[key] = vlan_data
+            self.index.remove(key)
+            self._index(key, networks)
+            self._persist([put_op(vlan_data)])
+        self._notify('vlan.updated', vlan=vlan_data)
+        return vlan_data
+
+    def delete_vlan(self, vlan_id, parent=None):
+        try:
+            key = self._vlan_key(vlan_id, parent)
+        except ValueError:
+            return
+        with self._writing():
+            if self._vlans.pop(key, None) is None:
+                return
+            self._clear_id(key)
+            self.index.remove(key)
+            self._persist([delete_op(key)])
+        self._notify('vlan.deleted', id=key[1], parent=key[0] or None)
+
+    def _validate_vlan(self, vlan_data):
+        """Validate and normalise ``vlan_data`` in place.
+
+        Returns the VLAN's (trunk, id) key and the list of its networks.
+        """
         try:
             v_id = int(vlan_data['id'])
             if v_id < 1 or v_id > 4094:
                 raise ValueError("VLAN ID must be between 1 and 4094")
-        except ValueError as e:
+        except (KeyError, TypeError, ValueError) as e:
             if "VLAN ID" in str(e):
                 raise
             raise ValueError("Invalid VLAN ID")
 
-        for v in self.vlans:
-            if int(v['id']) == v_id:
-                raise ValueError(f"VLAN ID {v_id} already exists")
-
         # Validate CIDR
         try:
-            ipaddress.ip_network(vlan_data['cidr'], strict=False)
-        except ValueError:
+            network = ipaddress.ip_network(vlan_data['cidr'], strict=False)
+        except (KeyError, TypeError, ValueError):
              raise ValueError("Invalid CIDR format")
 
+        networks = [network]
+        if vlan_data.get('cidr6'):
+            try:
+                iface6 = ipaddress.ip_interface(vlan_data['cidr6'])
+            except (TypeError, ValueError):
+                raise ValueError("Invalid IPv6 CIDR format")
+            if iface6.version != 6:
+                raise ValueError("Invalid IPv6 CIDR format")
+            if network.version == 6:
+                raise ValueError("cidr6 can only be added to an IPv4 VLAN; an IPv6-only VLAN has its prefix in cidr")
+            networks.append(iface6.network)
+        else:
+            vlan_data.pop('cidr6', None)
+
+        parent = self._trunk(vlan_data.get('parent') or None)
+        if parent:
+            networkd.check_link_name(parent, v_id)
+            vlan_data['parent'] = parent
+        else:
+            vlan_data.pop('parent', None)
+
         vlan_data['id'] = v_id
         vlan_data['dhcp'] = bool(vlan_data.get('dhcp'))
         vlan_data['forwarding'] = bool(vlan_data.get('forwarding'))
         vlan_data['nat'] = bool(vlan_data.get('nat'))
 
+        if vlan_data['dhcp'] and network.version == 6:
+            raise ValueError("dhcp is DHCPv4 only; use dhcp6 for DHCP on an IPv6 prefix")
+
         if vlan_data['dhcp']:
             iface = ipaddress.ip_interface(vlan_data['cidr'])
-            network = iface.network
+            pool_count = self._pool_count(vlan_data)
 
             if not vlan_data.get('dhcp_gateway'):
                 vlan_data['dhcp_gateway'] = str(iface.ip)
@@ -90,160 +517,145 @@ class VlanManager:
                 vlan_data['dhcp_dns'] = str(iface.ip)
 
             if not vlan_data.get('dhcp_pools'):
-                hosts = list(network.hosts())
-                num_hosts = len(hosts)
-                pool_size = int(num_hosts * 0.8)
-                if pool_size > 0:
-                    pool_start = hosts[-pool_size]
-                    pool_end = hosts[-1]
-                    vlan_data['dhcp_pools'] = f"{pool_start} - {pool_end}"
-                else:
-                    vlan_data['dhcp_pools'] = ""
+                ratio = vlan_data.get('dhcp_pool_ratio') or Config.DHCP_POOL_RATIO
+                reserved = parse_ranges(vlan_data.get('dhcp_reserved'), network.version)
+                vlan_data['dhcp_pools'] = default_pools(network, ratio=ratio, reserved=reserved, count=pool_count)
 
-        # Check for overlaps
-        potential_vlans = self.vlans + [vlan_data]
-        self._check_for_overlaps(potential_vlans, raise_error=True)
+        # IPv6 flags are only stored when set, so IPv4-only records keep their shape.
+        iface6 = ipv6_interface(vlan_data)
+        for flag in ('dhcp6', 'nat6'):
+            if not vlan_data.get(flag):
+                vlan_data.pop(flag, None)
+                continue
+            if iface6 is None:
+                raise ValueError(f"{flag} needs an IPv6 prefix (cidr6)")
+            vlan_data[flag] = True
 
-        self.vlans.append(vlan_data)
-        self.save_vlans()
+        if vlan_data.get('dhcp6'):
+            pool_count = self._pool_count(vlan_data)
+            if not vlan_data.get('dhcp6_dns'):
+                vlan_data['dhcp6_dns'] = str(iface6.ip)
 
-    def delete_vlan(self, vlan_id):
-        self.vlans = [v for v in self.vlans if str(v['id']) != str(vlan_id)]
-        self.save_vlans()
+            if not vlan_data.get('dhcp6_pools'):
+                # Pure integer arithmetic, so even a /64 costs nothing.
+                ratio = vlan_data.get('dhcp_pool_ratio') or Config.DHCP_POOL_RATIO
+                reserved = parse_ranges(vlan_data.get('dhcp6_reserved'), 6)
+                vlan_data['dhcp6_pools'] = default_pools(iface6.network, ratio=ratio, reserved=reserved,
+                                                         count=pool_count)
 
-    def generate_systemd_config(self):
-        network_dir = Config.NETWORK_DIR
-        os.makedirs(network_dir, exist_ok=True)
+        return (parent, v_id), networks
 
-        # Find the actual config file for the parent interface
-        parent_config_file = self._find_parent_config_file(network_dir, Config.PARENT_INTERFACE)
-        parent_dropin_dir = os.path.join(network_dir, f"{parent_config_file}.d")
-        os.makedirs(parent_dropin_dir, exist_ok=True)
-
-        self._cleanup_configs(network_dir, parent_dropin_dir)
-
-        for vlan in self.vlans:
-            vid = vlan['id']
-            name = f"vlan{vid}"
-
-            netdev_content = f"""[NetDev]
-Name={name}
-Kind=vlan
-
-[VLAN]
-Id={vid}
-"""
-            with open(os.path.join(network_dir, f"20-{name}.netdev"), 'w') as f:
-                f.write(netdev_content)
-
-            network_content = f"""[Match]
-Name={name}
-
-[Network]
-Address={vlan['cidr']}
-DHCPServer=no
-IPMasquerade={'yes' if vlan.get('nat') else 'no'}
-IPForward={'yes' if vlan.get('forwarding', True) else 'no'}
-"""
-            with open(os.path.join(network_dir, f"20-{name}.network"), 'w') as f:
-                f.write(network_content)
-
-            dropin_content = f"""[Network]
-VLAN={name}
-"""
-            with open(os.path.join(parent_dropin_dir, f"vlan-{vid}.conf"), 'w') as f:
-                f.write(dropin_content)
+    @staticmethod
+    def _pool_count(vlan_data):
+        """How many ranges the default pools are split into (``dhcp_pool_count``)."""
+        count = vlan_data.get('dhcp_pool_count')
+        if count is None or count == '':
+            return 1
+        try:
+            count = int(count)
+        except (TypeError, ValueError):
+            raise ValueError("DHCP pool count must be a whole number")
+        if not 1 <= count <= Config.DHCP_MAX_POOL_COUNT:
+            raise ValueError(f"DHCP pool count must be between 1 and {Config.DHCP_MAX_POOL_COUNT}")
+        return count
 
-    def _find_parent_config_file(self, network_dir, interface_name):
-        # Scan for a .network file that matches Name=interface_name
-        if not os.path.exists(network_dir):
-            return f"{interface_name}.network"
-
-        for f in os.listdir(network_dir):
-            if f.endswith(".network"):
-                try:
-                    with open(os.path.join(network_dir, f), 'r') as file:
-                        content = file.read()
-                        # Simple check for Name=interface_name
-                        # This is naive but works for standard configs
-                        if f"Name={interface_name}" in content:
-                            return f
-                except:
-                    continue
-        # Fallback to standard naming convention if not found
-        return f"10-{interface_name}.network"
-
-    def _cleanup_configs(self, network_dir, parent_dropin_dir):
-        if os.path.exists(network_dir):
-            for f in os.listdir(network_dir):
-                if (f.startswith("10-vlan") or f.startswith("20-vlan")) and (f.endswith(".netdev") or f.endswith(".network")):
-                    try:
-                        os.remove(os.path.join(network_dir, f))
-                    except OSError:
-                        pass
-
-        if os.path.exists(parent_dropin_dir):
-             for f in os.listdir(parent_dropin_dir):
-                if f.startswith("vlan-") and f.endswith(".conf"):
-                    try:
-                        os.remove(os.path.join(parent_dropin_dir, f))
-                    except OSError:
-                        pass
+    def _check_overlap(self, key, networks, exclude=None):
+        for network in networks:
+            for existing_key, existing_net in self.index.overlapping(network, exclude=exclude):
+                raise ValueError(self._overlap_message(key, network, existing_key, existing_net))
 
-    def generate_nftables_config(self):
-        lines = []
-        lines.append("table inet vlan_mgmt")
-        lines.append("delete table inet vlan_mgmt")
-        lines.append("table inet vlan_mgmt {")
+    def _index(self, key, networks):
+        for network in networks:
+            self.index.add(key, network)
 
-        lines.append("  chain forward {")
-        lines.append("    type filter hook forward priority 0; policy accept;")
-        lines.append("    ct state established,related accept")
+    def generate_systemd_config(self, parents=None):
+        """Bring the networkd files in line with the VLAN list.
 
-        for vlan in self.vlans:
-             if vlan.get('nat'):
-                 lines.append(f'    iifname "vlan{vlan["id"]}" oifname "{Config.WAN_INTERFACE}" accept')
+        Every trunk (parent interface) is synced on its own: its VLANs'
+        .netdev/.network files and the drop-ins in its parent's .network.d
+        directory. ``parents`` limits the sync to those trunks. Only files
+        whose content changed are written and stale VLAN files are removed,
+        so a change on one trunk never touches another trunk's files.
+        Returns the ChangeSet describing what was touched.
+        """
+        network_dir = Config.NETWORK_DIR
+        os.makedirs(network_dir, exist_ok=True)
+        wanted = None if parents is None else {self._trunk(p) for p in parents}
 
-        lines.append("  }")
+        changes = ChangeSet()
+        for trunk, (parent_dropin_dir, desired) in sorted(self._render()['networkd'].items()):
+            if wanted is not None and trunk not in wanted:
+                continue
+            if desired or not trunk:
+                os.makedirs(parent_dropin_dir, exist_ok=True)
+            existing = networkd.managed_files(network_dir, parent_dropin_dir, trunk)
+            changes.merge(sync_files(desired, existing))
 
-        lines.append("  chain postrouting {")
-        lines.append("    type nat hook postrouting priority 100; policy accept;")
+        if changes.changed:
+            logger.info(f"networkd configuration: {changes}")
+        return changes
 
-        for vlan in self.vlans:
-            if vlan.get('nat'):
-                lines.append(f'    ip saddr {vlan["cidr"]} oifname "{Config.WAN_INTERFACE}" masquerade')
+    def _networkd_layout(self):
+        """{trunk: drop-in directory of its parent's .network file}.
+
+        Covers the default trunk, every trunk with VLANs and every trunk
+        that still has files on disk (so they can be cleaned up).
+        """
+        network_dir = Config.NETWORK_DIR
+        trunks = {''} | {v.get('parent') or '' for v in self._vlans.values()}
+        trunks |= networkd.trunks_on_disk(network_dir)
 
-        lines.append("  }")
-        lines.append("}")
+        layout = {}
+        dropin_dirs = {}
+        for trunk in sorted(trunks):
+            interface = trunk or Config.PARENT_INTERFACE
+            # Find the actual config file for the parent interface
+            parent_config_file = self._find_parent_config_file(network_dir, interface)
+            parent_dropin_dir = os.path.join(network_dir, f"{parent_config_file}.d")
+            if parent_dropin_dir in dropin_dirs:
+                raise ValueError(f"Parent interfaces {dropin_dirs[parent_dropin_dir]} and {interface} both use "
+                                 f"{parent_config_file}; give each trunk its own .network file")
+            dropin_dirs[parent_dropin_dir] = interface
+            layout[trunk] = parent_dropin_dir
+        return layout
 
-        nft_dir = Config.NFTABLES_DIR
-        os.makedirs(nft_dir, exist_ok=True)
-        filepath = os.path.join(nft_dir, Config.NFTABLES_INCLUDE_FILE)
+    def _find_parent_config_file(self, network_dir, interface_name):
+        found = self._network_files.find(network_dir, interface_name)
+        # Fallback to standard naming convention if not found
+        return found or f"10-{interface_name}.network"
 
-        with open(filepath, 'w') as f:
-            f.write("\n".join(lines))
+    def generate_nftables_config(self):
+        """Write the vlan_mgmt table to the nftables include file.
 
+        NAT interfaces and source networks live in named sets, so the
+        forward and postrouting chains do one set lookup each regardless
+        of the number of VLANs.
+        """
+        filepath = os.path.join(Config.NFTABLES_DIR, Config.NFTABLES_INCLUDE_FILE)
+        os.makedirs(Config.NFTABLES_DIR, exist_ok=True)
+        write_atomic(filepath, self._render()['nftables_ruleset'])
         return filepath
 
+    def _nftables_state(self):
+        return nftables.desired_state(self._vlans.values(), Config.WAN_INTERFACE, networkd.link_name)
+
     def generate_kea_config(self):
         subnets = []
         interfaces = []
-        for vlan in self.vlans:
+        for vlan in self._vlans.values():
             if vlan.get('dhcp'):
                 iface = ipaddress.ip_interface(vlan['cidr'])
-                name = f"vlan{vlan['id']}"
+                if iface.version != 4:
+                    continue
+                name = networkd.link_name(vlan)
                 interfaces.append(name)
 
-                pools = []
-                if vlan.get('dhcp_pools'):
-                    for p in vlan['dhcp_pools'].split(','):
-                        pools.append({"pool": p.strip()})
-
                 subnet = {
                     "subnet": str(iface.network),
-                    "id": vlan['id'],
+                    "id": kea.subnet_id(vlan),
+                    "user-context": {kea.MANAGED_TAG: self._kea_context(vlan)},
                     "interface": name,
-                    "pools": pools,
+                    "pools": self._kea_pools(vlan.get('dhcp_pools')),
                     "option-data": [
                         {
                             "name": "routers",
@@ -257,8 +669,53 @@ VLAN={name}
                 }
                 subnets.append(subnet)
 
+        return self._kea_document(kea.DHCP4, interfaces, subnets, Config.KEA_CONTROL_SOCKET)
+
+    def generate_kea6_config(self):
+        """The Dhcp6 counterpart of ``generate_kea_config`` for ``dhcp6`` VLANs.
+
+        Routers are announced by networkd's RAs, so subnets only carry
+        pools and DNS servers.
+        """
+        subnets = []
+        interfaces = []
+        for vlan in self._vlans.values():
+            iface = ipv6_interface(vlan)
+            if not vlan.get('dhcp6') or iface is None:
+                continue
+            name = networkd.link_name(vlan)
+            interfaces.append(name)
+            subnets.append({
+                "subnet": str(iface.network),
+                "id": kea.subnet_id(vlan),
+                "user-context": {kea.MANAGED_TAG: self._kea_context(vlan)},
+                "interface": name,
+                "pools": self._kea_pools(vlan.get('dhcp6_pools')),
+                "option-data": [
+                    {
+                        "name": "dns-servers",
+                        "data": vlan.get('dhcp6_dns', str(iface.ip))
+                    }
+                ]
+            })
+
+        return self._kea_document(kea.DHCP6, interfaces, subnets, Config.KEA6_CONTROL_SOCKET)
+
+    @staticmethod
+    def _kea_pools(text):
+        return [{"pool": p.strip()} for p in text.split(',')] if text else []
+
+    @staticmethod
+    def _kea_document(server, interfaces, subnets, control_socket):
+        seen = {}
+        for subnet in subnets:
+            other = seen.setdefault(subnet['id'], subnet)
+            if other is not subnet:
+                raise ValueError(f"Kea subnet id {subnet['id']} is used by both {other['interface']} and "
+                                 f"{subnet['interface']}; rename one of the parent interfaces")
+
         kea_config = {
-            "Dhcp4": {
+            server: {
                 "interfaces-config": {
                     "interfaces": interfaces
                 },
@@ -266,41 +723,335 @@ VLAN={name}
                     "type": "memfile",
                     "lfc-interval": 3600
                 },
-                "subnet4": subnets
+                kea.SUBNET_KEYS[server]: subnets
             }
         }
+        if control_socket:
+            # Needed for hot reloads; config-set replaces the whole config.
+            kea_config[server]["control-socket"] = {
+                "socket-type": "unix",
+                "socket-name": control_socket
+            }
         return kea_config
 
-    def apply_config(self):
-        try:
-            self.generate_systemd_config()
-            nft_file = self.generate_nftables_config()
-            kea_config = self.generate_kea_config()
+    @staticmethod
+    def _kea_context(vlan):
+        context = {"vlan": vlan['id']}
+        if vlan.get('parent'):
+            context["parent"] = vlan['parent']
+        return context
 
-            with open('/etc/sysctl.d/99-vlan-manager.conf', 'w') as f:
-                f.write("net.ipv4.ip_forward=1\n")
+    def _render(self, steps=None):
+        """Everything apply writes, rendered from the in-memory VLANs.
 
-            subprocess.run(['sysctl', '-p', '/etc/sysctl.d/99-vlan-manager.conf'], check=False)
+        Nothing on the host is changed. The result is cached until the
+        VLANs change (see ``_writing``) or a setting that affects the
+        output does, so a plan() and the apply that follows render once.
+        On a miss the renderers run concurrently as a StepGraph, whose
+        steps are appended to ``steps`` if given.
+        """
+        layout = self._networkd_layout()
+        key = (self.revision, self._generation, tuple(sorted(layout.items())), Config.NETWORK_DIR,
+               Config.NFTABLES_DIR, Config.WAN_INTERFACE, Config.KEA_CONTROL_SOCKET, Config.KEA6_CONTROL_SOCKET)
+        rendered = self._rendered
+        if rendered is not None and rendered['key'] == key:
+            return rendered
 
-            os.makedirs(os.path.dirname(Config.KEA_CONFIG_FILE), exist_ok=True)
-            with open(Config.KEA_CONFIG_FILE, 'w') as f:
-                json.dump(kea_config, f, indent=4)
+        by_trunk = {}
+        for vlan in self._vlans.values():
+            by_trunk.setdefault(vlan.get('parent') or '', []).append(vlan)
 
-            try:
-                subprocess.run(['networkctl', 'reload'], check=True)
-            except (FileNotFoundError, subprocess.CalledProcessError):
-                logger.warning("networkctl not found or failed. Skipping systemd reload (Mocking?).")
+        def render_networkd():
+            return [(trunk, (dropin_dir, networkd.desired_files(by_trunk.get(trunk, []),
+                                                                Config.NETWORK_DIR, dropin_dir)))
+                    for trunk, dropin_dir in layout.items()]
 
-            try:
-                subprocess.run(['nft', '-f', nft_file], check=True)
-            except (FileNotFoundError, subprocess.CalledProcessError):
-                logger.warning("nft command not found or failed. Skipping nftables application.")
+        def render_nftables():
+            state = self._nftables_state()
+            return state, nftables.render_ruleset(state)
 
-            try:
-                subprocess.run(['systemctl', 'restart', Config.KEA_SERVICE_NAME], check=True)
-            except (FileNotFoundError, subprocess.CalledProcessError):
-                logger.warning(f"{Config.KEA_SERVICE_NAME} restart failed or not found. Skipping.")
+        graph = StepGraph(Config.APPLY_MAX_WORKERS)
+        graph.add('render_networkd', render_networkd)
+        graph.add('render_nftables', render_nftables)
+        graph.add('generate_kea', self.generate_kea_config)
+        graph.add('generate_kea6', self.generate_kea6_config)
+        graph.add('render_sysctl', self.sysctl_content)
+        results, graph_steps = self._run_graph(graph, [])
+        if steps is not None:
+            steps.extend(graph_steps)
+
+        nft_state, ruleset = results['render_nftables']
+        rendered = {
+            "key": key,
+            "revision": self.revision,
+            "networkd": dict(results['render_networkd']),
+            "nftables": nft_state,
+            "nftables_ruleset": ruleset,
+            "kea": results['generate_kea'],
+            "kea6": results['generate_kea6'],
+            "sysctl": results['render_sysctl'],
+        }
+        self._rendered = rendered
+        return rendered
+
+    def rendered_state(self):
+        """The current rendering (see ``_render``) plus the ``vlans`` it was rendered from.
+
+        Reloads the VLANs first if another process changed them.
+        """
+        with self._lock:
+            self.refresh()
+            return dict(self._render(), vlans=list(self.vlans))
+
+    def plan(self):
+        """Show what apply_config would write, without touching the host.
+
+        Returns the ``revision``, desired ``files``, paths to ``remove``,
+        per-path ``changes`` and a unified ``diff`` against disk.
+        """
+        rendered = self.rendered_state()
+
+        files = {}
+        remove = []
+        for trunk, (parent_dropin_dir, desired) in sorted(rendered['networkd'].items()):
+            files.update(desired)
+            remove.extend(p for p in networkd.managed_files(Config.NETWORK_DIR, parent_dropin_dir, trunk)
+                          if p not in desired)
+        files[os.path.join(Config.NFTABLES_DIR, Config.NFTABLES_INCLUDE_FILE)] = rendered['nftables_ruleset']
+        kea_files = {}
+        for server in (kea.DHCP4, kea.DHCP6):
+            config_file = self.kea_server(server)[0]
+            generated = rendered['kea6' if server == kea.DHCP6 else 'kea']
+            previous = _read_file(config_file)
+            if server == kea.DHCP6 and not generated[server]['subnet6'] and previous is None:
+                continue
+            if Config.KEA_CONFIG_MODE == 'merge':
+                generated = kea.merge_config(kea.parse_config(previous) if previous else None, generated, server)
+            files[config_file] = json.dumps(generated, indent=4)
+            kea_files[config_file] = generated
+        files[Config.SYSCTL_FILE] = rendered['sysctl']
+
+        changes = {}
+        diff = []
+        for path in sorted(files) + sorted(remove):
+            old = _read_file(path)
+            new = files.get(path)
+            if path in kea_files and old is not None and kea.parse_config(old) == kea_files[path]:
+                old = new
+            if old == new:
+                changes[path] = 'unchanged'
+                continue
+            changes[path] = 'remove' if new is None else 'create' if old is None else 'update'
+            diff.extend(difflib.unified_diff(
+                (old or '').splitlines(keepends=True), (new or '').splitlines(keepends=True),
+                fromfile='/dev/null' if old is None else path, tofile='/dev/null' if new is None else path))
+            if diff and not diff[-1].endswith('\n'):
+                diff[-1] += '\n'
+        return {
+            "revision": rendered['revision'],
+            "files": files,
+            "remove": sorted(remove),
+            "changes": changes,
+            "diff": ''.join(diff),
+        }
+
+    def apply_config(self):
+        """Write all configuration and activate it.
+
+        Rendering and activation run as step graphs (see StepGraph). Returns
+        a report with the ``steps`` and what each activation step did.
+        """
+        steps = []
+        start = time.monotonic()
+        try:
+            # Render from a consistent view; API writes wait for this part only.
+            # The rendering is shared with a preceding plan() of the same revision.
+            with self._lock:
+                self.refresh()
+                rendering = self._render(steps)
+                render = StepGraph(Config.APPLY_MAX_WORKERS)
+                render.add('generate_networkd', self.generate_systemd_config)
+                render.add('generate_nftables', self.generate_nftables_config)
+                rendered, steps = self._run_graph(render, steps)
+                changes = rendered['generate_networkd']
+                for change, paths in changes.to_dict().items():
+                    if change != 'unchanged' and paths:
+                        metrics.APPLY_FILES.inc(len(paths), change=change)
+                nft_state = rendering['nftables']
+                kea_config = rendering['kea']
+                kea6_config = rendering['kea6']
+                sysctl_content = rendering['sysctl']
+
+            sysctl_changed = self._read_sysctl() != sysctl_content
+            # Leave the DHCPv6 server alone on hosts that never used it.
+            kea6_unused = (not kea6_config[kea.DHCP6]['subnet6']
+                           and not os.path.exists(Config.KEA6_CONFIG_FILE))
+            activate = StepGraph(Config.APPLY_MAX_WORKERS)
+            activate.add('write_sysctl', self._write_sysctl, sysctl_content, skip=not sysctl_changed)
+            activate.add('sysctl', run_command, ['sysctl', '-p', Config.SYSCTL_FILE],
+                         depends=['write_sysctl'], skip=not sysctl_changed)
+            activate.add('networkd', self._activate_networkd, changes)
+            activate.add('nftables', self.apply_nftables, nft_state)
+            activate.add('kea', self.apply_kea, kea_config, depends=['networkd'])
+            activate.add('kea6', self.apply_kea, kea6_config, kea.DHCP6, depends=['networkd'], skip=kea6_unused)
+            results, steps = self._run_graph(activate, steps)
+
+            return {
+                "steps": steps,
+                "files": changes.to_dict(),
+                "networkd": results['networkd'],
+                "nftables": results['nftables'],
+                "kea": results.get('kea'),
+                "kea6": results.get('kea6'),
+            }
 
         except Exception as e:
             logger.error(f"Failed to apply config: {e}")
             raise
+        finally:
+            metrics.APPLY_SECONDS.observe(time.monotonic() - start)
+
+    @staticmethod
+    def _run_graph(graph, steps):
+        try:
+            results, graph_steps = graph.run()
+        except StepError as e:
+            _observe_steps(e.steps)
+            e.steps = steps + e.steps
+            raise
+        _observe_steps(graph_steps)
+        return results, steps + graph_steps
+
+    @staticmethod
+    def _read_sysctl():
+        return _read_file(Config.SYSCTL_FILE)
+
+    @staticmethod
+    def _write_sysctl(content):
+        with open(Config.SYSCTL_FILE, 'w') as f:
+            f.write(content)
+
+    def sysctl_content(self):
+        """IPv4 forwarding, plus IPv6 forwarding once an IPv6 VLAN forwards."""
+        content = SYSCTL_CONTENT
+        if any(v.get('forwarding') and ipv6_interface(v) for v in self._vlans.values()):
+            content += SYSCTL_IPV6_CONTENT.format(wan=Config.WAN_INTERFACE)
+        return content
+
+    def check_nftables(self):
+        """Dry-run the nftables batch apply would send, without committing it."""
+        with self._lock:
+            self.refresh()
+            state = self._nftables_state()
+        return self.apply_nftables(state, check_only=True)
+
+    def apply_nftables(self, state, check_only=False):
+        """Bring the live vlan_mgmt table to ``state`` in one nft transaction.
+
+        The live table is read with ``nft -j list table`` and only the
+        difference is sent, so the table is not deleted and recreated on
+        every apply. The batch is checked with ``nft -c`` first and not
+        committed if the check fails.
+        """
+        listing = run_command(['nft', '-j', 'list', 'table'] + nftables.TABLE.split())
+        previous = nftables.parse_table(listing['output']) if listing['ok'] else None
+        batch = nftables.render_batch(previous, state)
+        if not batch:
+            return {"action": "unchanged", "ok": True, "output": "", "batch": ""}
+
+        action = 'update' if previous is not None and previous['wan'] is not None else 'load'
+        check = run_command(['nft', '-c', '-f', '-'], input=batch)
+        if not check['ok'] or check_only:
+            return {"action": action if check['ok'] else 'check-failed', "ok": check['ok'],
+                    "output": check['output'], "batch": batch}
+
+        result = run_command(['nft', '-f', '-'], input=batch)
+        return {"action": action, "ok": result['ok'], "output": result['output'], "batch": batch}
+
+    def apply_kea(self, kea_config, server=kea.DHCP4):
+        """Activate a new Kea configuration with as little disruption as possible.
+
+        With KEA_CONFIG_MODE=merge the generated subnets are folded into the
+        existing file instead of replacing it. Kea is not touched when the
+        result matches what is on disk. Otherwise the file is rewritten and
+        the config pushed with ``config-set`` over the control socket;
+        ``systemctl restart`` is only used when that is not possible.
+        ``server`` picks the DHCPv4 or DHCPv6 server's file and service.
+        """
+        config_file, service, default_socket = self.kea_server(server)
+        try:
+            with open(config_file, 'r') as f:
+                previous = kea.parse_config(f.read())
+        except OSError:
+            previous = None
+
+        if Config.KEA_CONFIG_MODE == 'merge':
+            kea_config = kea.merge_config(previous, kea_config, server)
+        if previous == kea_config:
+            return {"action": "unchanged", "ok": True, "output": ""}
+
+        write_atomic(config_file, json.dumps(kea_config, indent=4))
+
+        socket_path = kea.control_socket_path(kea_config, default_socket, server)
+        if socket_path and not kea.needs_restart(previous, kea_config, server):
+            try:
+                KeaControl(socket_path).command('config-set', kea_config)
+                return {"action": "config-set", "ok": True, "output": ""}
+            except (OSError, KeaControlError) as e:
+                logger.warning(f"Kea hot reload failed, restarting {service}: {e}")
+
+        result = run_command(['systemctl', 'restart', service])
+        return {"action": "restart", "ok": result['ok'], "output": result['output']}
+
+    @staticmethod
+    def kea_server(server):
+        """(config file, service, control socket) of a Kea server."""
+        if server == kea.DHCP6:
+            return Config.KEA6_CONFIG_FILE, Config.KEA6_SERVICE_NAME, Config.KEA6_CONTROL_SOCKET
+        return Config.KEA_CONFIG_FILE, Config.KEA_SERVICE_NAME, Config.KEA_CONTROL_SOCKET
+
+    def _activate_networkd(self, changes):
+        """Reload/reconfigure only the links touched by ``changes``."""
+        actions = networkd.link_actions(changes, Config.PARENT_INTERFACE)
+        links = {}
+        result = {"action": "unchanged", "ok": True, "output": "", "reload": None, "links": links}
+
+        for name in actions['delete']:
+            links[name] = self._link_result('delete', run_command(['networkctl', 'delete', name]))
+
+        if actions['reload']:
+            result['reload'] = run_command(['networkctl', 'reload'])
+
+        for name in actions['reconfigure']:
+            links[name] = self._link_result('reconfigure', run_command(['networkctl', 'reconfigure', name]))
+
+        if result['reload'] or links:
+            failed = [name for name, link in links.items() if not link['ok']]
+            if result['reload'] and not result['reload']['ok']:
+                failed.insert(0, 'reload')
+            result.update(action="activate", ok=not failed,
+                          output=f"failed: {', '.join(failed)}" if failed else "")
+        return result
+
+    @staticmethod
+    def _link_result(action, command_result):
+        return {
+            "action": action,
+            "ok": command_result['ok'],
+            "duration": command_result['duration'],
+            "output": command_result['output'],
+        }
+
+
+def _read_file(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def _observe_steps(steps):
+    for step in steps:
+        if step['status'] not in (SKIPPED, BLOCKED):
+            metrics.APPLY_STEP_SECONDS.observe(step['duration'], step=step['name'])
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import logging
+from .config import Config
+from .files import write_atomic
+from .storage import FileLock
+
+logger = logging.getLogger(__name__)
+
+# Sent when a client resumes from an event that has been compacted away;
+# it should refetch the VLAN list instead of replaying.
+RESET = 'reset'
+
+
+class EventHub:
+    """Publish/subscribe between gunicorn workers through an append-only file.
+
+    Every event is one JSON line ``{"id", "type", "time", "data"}``.
+    Publishers append under an flock and number events by reading the
+    last id from the file, so ids increase across all processes and a
+    client can resume with the last id it saw. Subscribers tail the file,
+    which costs one stat() per poll while nothing happens. Once the file
+    grows past ``max_bytes`` the older half is dropped.
+    """
+
+    def __init__(self, path=None, max_bytes=None):
+        self._path = path
+        self._max_bytes = max_bytes
+
+    @property
+    def path(self):
+        # Defaults to living next to the VLAN data, like the store's own files
+        return self._path or Config.EVENTS_FILE or os.path.join(
+            os.path.dirname(Config.DATA_FILE) or '.', 'events.log')
+
+    @property
+    def max_bytes(self):
+        return self._max_bytes or Config.EVENTS_MAX_BYTES
+
+    def publish(self, event_type, data):
+        """Append an event and return it."""
+        path = self.path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with FileLock(path + '.lock'):
+            event = {"id": self.last_id() + 1, "type": event_type, "time": time.time(), "data": data}
+            line = json.dumps(event) + "\n"
+            with open(path, 'a') as f:
+                f.write(line)
+            if os.path.getsize(path) > self.max_bytes:
+                self._compact()
+        return event
+
+    def last_id(self):
+        """Id of the newest event, 0 if there is none."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                end = f.tell()
+                start = end
+                tail = b''
+                # Read backwards until the last complete line is in the buffer
+                while start > 0 and tail.count(b'\n') < 2:
+                    start = max(0, start - 8192)
+                    f.seek(start)
+                    tail = f.read(end - start)
+        except FileNotFoundError:
+            return 0
+        lines = tail.splitlines()
+        return json.loads(lines[-1])['id'] if lines else 0
+
+    def since(self, last_id):
+        """Events newer than ``last_id``, oldest first.
+
+        If events after ``last_id`` were already compacted away, the list
+        starts with a RESET event instead.
+        """
+        events, _ = self._read_from(0, last_id)
+        return events
+
+    def follow(self, last_id, timeout, poll_interval=None):
+        """Yield new events as they are published, for up to ``timeout`` seconds.
+
+        Yields None after every poll that found nothing, so callers can
+        send keepalives. The file is re-read from the start only when it
+        was compacted (replaced) in the meantime.
+        """
+        poll_interval = poll_interval or Config.EVENTS_POLL_INTERVAL
+        deadline = time.monotonic() + timeout
+        inode, offset = None, 0
+        while True:
+            try:
+                st = os.stat(self.path)
+            except FileNotFoundError:
+                st = None
+            events = []
+            if st is not None and (st.st_ino != inode or st.st_size < offset):
+                inode = st.st_ino
+                events, offset = self._read_from(0, last_id)
+            elif st is not None and st.st_size > offset:
+                events, offset = self._read_from(offset, last_id)
+            for event in events:
+                last_id = max(last_id, event['id'])
+                yield event
+            if not events:
+                yield None
+            if time.monotonic() >= deadline:
+                return
+            time.sleep(poll_interval)
+
+    def stream(self, last_id=None, timeout=None, heartbeat=None):
+        """``follow`` formatted as a text/event-stream.
+
+        Without ``last_id`` the stream starts at the newest event. It ends
+        after ``timeout`` seconds so long-lived connections don't pin a
+        worker forever; EventSource reconnects and resumes by itself.
+        """
+        timeout = Config.EVENTS_STREAM_TIMEOUT if timeout is None else timeout
+        heartbeat = Config.EVENTS_HEARTBEAT if heartbeat is None else heartbeat
+        if last_id is None:
+            last_id = self.last_id()
+        yield f"retry: {int(Config.EVENTS_RETRY * 1000)}\n\n"
+        quiet_since = time.monotonic()
+        for event in self.follow(last_id, timeout):
+            if event is not None:
+                quiet_since = time.monotonic()
+                yield format_event(event)
+            elif time.monotonic() - quiet_since >= heartbeat:
+                quiet_since = time.monotonic()
+                yield ": keepalive\n\n"
+
+    def _read_from(self, offset, last_id):
+        """Events after ``last_id`` starting at byte ``offset``; returns (events, new offset)."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return [], 0
+        # A line still being written has no newline yet; leave it for the next poll
+        complete = chunk[:chunk.rfind(b'\n') + 1]
+        events = []
+        first = None
+        for line in complete.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping unreadable line in {self.path}")
+                continue
+            if first is None:
+                first = event['id']
+            if event['id'] > last_id:
+                events.append(event)
+        if offset == 0 and first is not None and last_id and first > last_id + 1:
+            events.insert(0, {"id": first - 1, "type": RESET, "time": time.time(), "data": {}})
+        return events, offset + len(complete)
+
+    def _compact(self):
+        with open(self.path, 'rb') as f:
+            lines = f.read().splitlines(keepends=True)
+        kept = []
+        size = 0
+        for line in reversed(lines):
+            size += len(line)
+            # The newest event always stays: the next id is read from it
+            if size > self.max_bytes // 2 and kept:
+                break
+            kept.append(line)
+        write_atomic(self.path, b''.join(reversed(kept)).decode())
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event['data'])}\n\n"
@@ -0,0 +1,143 @@
+import os
+import hashlib
+import tempfile
+
+
+def content_hash(content):
+    if isinstance(content, str):
+        content = content.encode()
+    return hashlib.sha256(content).hexdigest()
+
+
+def file_hash(path):
+    """Return the content hash of ``path``, or None if it cannot be read."""
+    try:
+        with open(path, 'rb') as f:
+            return content_hash(f.read())
+    except OSError:
+        return None
+
+
+def write_atomic(path, content, mode=0o644, sync_dir=False):
+    """Write ``content`` to ``path`` via a temp file, fsync and rename.
+
+    With ``sync_dir`` the containing directory is fsynced as well, so the
+    rename itself survives a crash.
+    """
+    directory = os.path.dirname(path) or '.'
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=f".{os.path.basename(path)}.", dir=directory)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+        if sync_dir:
+            fsync_dir(directory)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class ChangeSet:
+    """Summary of the file operations performed by ``sync_files``."""
+
+    def __init__(self):
+        self.created = []
+        self.updated = []
+        self.renamed = []
+        self.removed = []
+        self.unchanged = []
+
+    @property
+    def changed(self):
+        return bool(self.created or self.updated or self.renamed or self.removed)
+
+    def touched(self):
+        """Every path whose content or existence changed."""
+        paths = self.created + self.updated + self.removed
+        for old, new in self.renamed:
+            paths.extend([old, new])
+        return paths
+
+    def merge(self, other):
+        self.created.extend(other.created)
+        self.updated.extend(other.updated)
+        self.renamed.extend(other.renamed)
+        self.removed.extend(other.removed)
+        self.unchanged.extend(other.unchanged)
+        return self
+
+    def to_dict(self):
+        return {
+            "created": list(self.created),
+            "updated": list(self.updated),
+            "renamed": [list(pair) for pair in self.renamed],
+            "removed": list(self.removed),
+            "unchanged": len(self.unchanged),
+        }
+
+    def __repr__(self):
+        return (f"ChangeSet(created={len(self.created)}, updated={len(self.updated)}, "
+                f"renamed={len(self.renamed)}, removed={len(self.removed)}, "
+                f"unchanged={len(self.unchanged)})")
+
+
+def sync_files(desired, existing):
+    """Make the files on disk match ``desired`` ({path: content}).
+
+    ``existing`` lists the managed files currently on disk; any of them not
+    in ``desired`` is removed, or renamed into place if a missing desired
+    file has the same content. Files whose content hash already matches are
+    left alone so their mtime does not change.
+    """
+    changes = ChangeSet()
+
+    stale = {}
+    for path in existing:
+        if path not in desired:
+            stale.setdefault(file_hash(path), []).append(path)
+
+    for path in sorted(desired):
+        content = desired[path]
+        digest = content_hash(content)
+        current = file_hash(path)
+        if current == digest:
+            changes.unchanged.append(path)
+            continue
+
+        if current is None and stale.get(digest):
+            old_path = stale[digest].pop()
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            os.replace(old_path, path)
+            changes.renamed.append((old_path, path))
+            continue
+
+        write_atomic(path, content)
+        if current is None:
+            changes.created.append(path)
+        else:
+            changes.updated.append(path)
+
+    for paths in stale.values():
+        for path in paths:
+            try:
+                os.remove(path)
+                changes.removed.append(path)
+            except FileNotFoundError:
+                pass
+
+    return changes
@@ -0,0 +1,108 @@
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+logger = logging.getLogger(__name__)
+
+OK = 'ok'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+BLOCKED = 'blocked'
+
+
+class StepError(Exception):
+    """Raised by ``StepGraph.run`` when a step raised; carries the report."""
+
+    def __init__(self, step, error, steps):
+        self.step = step
+        self.error = error
+        self.steps = steps
+        super().__init__(f"{step}: {error}")
+
+
+class StepGraph:
+    """Run named steps in dependency order, independent ones concurrently.
+
+    A step runs once everything it depends on has finished. Steps added
+    with ``skip=True`` are recorded as skipped without running, as are
+    steps whose result is a dict with ``"action": "unchanged"``. A step
+    that returns a dict with ``"ok": False`` is marked failed, and so are
+    steps that raise; the steps depending on either are marked blocked and
+    the rest of the graph still runs. If a step raised, ``run`` raises a
+    StepError at the end.
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self._steps = {}
+
+    def add(self, name, func, *args, depends=(), skip=False):
+        for dep in depends:
+            if dep not in self._steps:
+                raise ValueError(f"Step '{name}' depends on unknown step '{dep}'")
+        self._steps[name] = (func, args, tuple(depends), skip)
+
+    def run(self):
+        """Run all steps; returns ``(results, steps)``.
+
+        ``results`` maps step names to return values and ``steps`` is a
+        list of entries (name, status, ok, depends, start, duration,
+        output) in the order the steps were added.
+        """
+        entries = {name: {"name": name, "status": None, "ok": True, "depends": list(deps),
+                          "start": None, "duration": 0.0, "output": ""}
+                   for name, (_, _, deps, _) in self._steps.items()}
+        results = {}
+        errors = []
+        origin = time.monotonic()
+        pending = dict(self._steps)
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            while pending or running:
+                for name, (func, args, deps, skip) in list(pending.items()):
+                    statuses = [entries[d]['status'] for d in deps]
+                    if any(s in (FAILED, BLOCKED) for s in statuses):
+                        entries[name].update(status=BLOCKED, ok=False,
+                                             output="not run: a step it depends on failed")
+                    elif None in statuses:
+                        continue
+                    elif skip:
+                        entries[name]['status'] = SKIPPED
+                    else:
+                        entries[name]['start'] = time.monotonic() - origin
+                        running[pool.submit(func, *args)] = name
+                    del pending[name]
+
+                if not running:
+                    continue
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    entry = entries[name]
+                    entry['duration'] = time.monotonic() - origin - entry['start']
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Step '{name}' failed: {e}")
+                        entry.update(status=FAILED, ok=False, output=str(e))
+                        errors.append((name, e))
+                        continue
+                    results[name] = result
+                    entry['status'] = OK
+                    if isinstance(result, dict):
+                        if result.get('action') == 'unchanged':
+                            entry['status'] = SKIPPED
+                        if 'ok' in result:
+                            entry['ok'] = result['ok']
+                            entry['output'] = result.get('output', '')
+                            if not result['ok']:
+                                entry['status'] = FAILED
+                    elif hasattr(result, 'to_dict'):
+                        entry['output'] = repr(result)
+
+        steps = list(entries.values())
+        if errors:
+            name, error = errors[0]
+            raise StepError(name, error, steps) from error
+        return results, steps
@@ -0,0 +1,249 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from .config import Config
+from .files import write_atomic
+from .storage import FileLock
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+class ApplyQueue:
+    """Run apply jobs in the background, one at a time.
+
+    Job records are JSON files in ``jobs_dir`` so any gunicorn worker can
+    report a job's status. At most one job is pending at any time: submits
+    that arrive while a job is still queued join it instead of creating a
+    new one, so a burst of clicks results in a single apply. Jobs are
+    executed by a daemon thread per process; an flock on the jobs directory
+    makes sure only one apply runs on the host at a time. A job fails if
+    apply raises or if any of its steps reports ``ok: False``.
+    """
+
+    def __init__(self, apply_func, jobs_dir=None, poll_interval=5.0):
+        self.apply_func = apply_func
+        self._jobs_dir = jobs_dir
+        self.poll_interval = poll_interval
+        self.listeners = []
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._stopping = None
+        self._started = False
+        self._thread_lock = threading.Lock()
+
+    @property
+    def jobs_dir(self):
+        return self._jobs_dir or Config.APPLY_JOBS_DIR
+
+    def submit(self):
+        """Queue an apply, or join the one already waiting. Returns the job."""
+        with self._queue_lock():
+            job = self._pending_job()
+            if job is not None:
+                job['requests'] += 1
+                self._save(job)
+            else:
+                job = {
+                    "id": uuid.uuid4().hex,
+                    "status": QUEUED,
+                    "requests": 1,
+                    "created": time.time(),
+                    "started": None,
+                    "finished": None,
+                    "duration": None,
+                    "steps": [],
+                    "error": None,
+                    "pid": None,
+                }
+                self._save(job)
+                write_atomic(self._pending_path(), job['id'])
+                self._notify(job)
+        self._ensure_worker()
+        self._wakeup.set()
+        return job
+
+    def start(self):
+        """Recover after a restart: fail interrupted jobs and run a job left pending.
+
+        Only the first call does anything, so it is cheap to call per request.
+        """
+        with self._thread_lock:
+            if self._started:
+                return
+            self._started = True
+        self._recover()
+        if os.path.exists(self._pending_path()):
+            self._ensure_worker()
+
+    def stop(self, timeout=None):
+        """Stop the worker thread once the job it is running has finished."""
+        with self._thread_lock:
+            thread, self._thread = self._thread, None
+            if self._stopping is not None:
+                self._stopping.set()
+        self._wakeup.set()
+        if thread is not None:
+            thread.join(timeout)
+
+    def get(self, job_id):
+        if not job_id or not all(c in '0123456789abcdef' for c in job_id):
+            return None
+        try:
+            with open(self._job_path(job_id), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def wait(self, job_id, timeout=None):
+        """Block until the job has finished; returns its final record."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job['status'] in (SUCCEEDED, FAILED):
+                return job
+            if deadline is not None and time.monotonic() >= deadline:
+                return job
+            time.sleep(0.05)
+
+    def run_pending(self):
+        """Run the pending job, if any, in the calling thread.
+
+        Returns the finished job record, or None if nothing was queued.
+        """
+        with apply_lock(self.jobs_dir):
+            with self._queue_lock():
+                job = self._pending_job()
+                if job is None:
+                    return None
+                os.remove(self._pending_path())
+                job.update(status=RUNNING, started=time.time(), pid=os.getpid())
+                self._save(job)
+            self._notify(job)
+
+            try:
+                report = self.apply_func() or {}
+                job['steps'] = report.get('steps', [])
+                failed = [step.get('name', '?') for step in job['steps'] if step.get('ok') is False]
+                if failed:
+                    logger.error(f"Apply job {job['id']} failed steps: {', '.join(failed)}")
+                    job['status'] = FAILED
+                    job['error'] = f"Failed steps: {', '.join(failed)}"
+                else:
+                    job['status'] = SUCCEEDED
+            except Exception as e:
+                logger.error(f"Apply job {job['id']} failed: {e}")
+                job['status'] = FAILED
+                job['error'] = str(e)
+                job['steps'] = getattr(e, 'steps', [])
+            job['finished'] = time.time()
+            job['duration'] = job['finished'] - job['started']
+            self._save(job)
+        self._notify(job)
+        self._prune()
+        return job
+
+    def _ensure_worker(self):
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._recover()
+            self._stopping = threading.Event()
+            self._thread = threading.Thread(target=self._worker, args=(self._stopping,),
+                                            name='apply-queue', daemon=True)
+            self._thread.start()
+
+    def _worker(self, stopping):
+        while not stopping.is_set():
+            try:
+                while not stopping.is_set() and self.run_pending() is not None:
+                    pass
+            except Exception as e:
+                logger.error(f"Apply queue worker error: {e}")
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    def _recover(self):
+        """Fail jobs left 'running' by a process that no longer exists."""
+        if not os.path.isdir(self.jobs_dir):
+            return
+        for name in os.listdir(self.jobs_dir):
+            if not name.endswith('.json'):
+                continue
+            job = self.get(name[:-5])
+            if job and job['status'] == RUNNING and not _pid_alive(job.get('pid')):
+                job.update(status=FAILED, error="Interrupted: the worker running this job exited",
+                           finished=time.time())
+                self._save(job)
+
+    def _prune(self):
+        keep = Config.APPLY_JOBS_KEEP
+        try:
+            names = [n for n in os.listdir(self.jobs_dir) if n.endswith('.json')]
+        except OSError:
+            return
+        if len(names) <= keep:
+            return
+        paths = sorted((os.path.join(self.jobs_dir, n) for n in names), key=os.path.getmtime)
+        for path in paths[:len(paths) - keep]:
+            job = self.get(os.path.basename(path)[:-5])
+            if job and job['status'] in (SUCCEEDED, FAILED):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def _pending_job(self):
+        try:
+            with open(self._pending_path(), 'r') as f:
+                job_id = f.read().strip()
+        except FileNotFoundError:
+            return None
+        job = self.get(job_id)
+        if job is None or job['status'] != QUEUED:
+            os.remove(self._pending_path())
+            return None
+        return job
+
+    def _notify(self, job):
+        for listener in self.listeners:
+            try:
+                listener(job)
+            except Exception as e:
+                logger.warning(f"Apply job listener failed: {e}")
+
+    def _queue_lock(self):
+        return FileLock(os.path.join(self.jobs_dir, '.queue.lock'))
+
+    def _pending_path(self):
+        return os.path.join(self.jobs_dir, 'pending')
+
+    def _job_path(self, job_id):
+        return os.path.join(self.jobs_dir, f"{job_id}.json")
+
+    def _save(self, job):
+        write_atomic(self._job_path(job['id']), json.dumps(job))
+
+
+def apply_lock(jobs_dir=None):
+    """The host-wide lock held while anything changes the live configuration."""
+    return FileLock(os.path.join(jobs_dir or Config.APPLY_JOBS_DIR, '.apply.lock'))
+
+
+def _pid_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
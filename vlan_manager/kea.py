@@ -0,0 +1,193 @@
+import copy
+import zlib
+import json
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Kea result codes
+RESULT_SUCCESS = 0
+RESULT_EMPTY = 3
+
+# Top-level keys of the DHCPv4 and DHCPv6 server configs, and the key of
+# each one's subnet list.
+DHCP4 = 'Dhcp4'
+DHCP6 = 'Dhcp6'
+SUBNET_KEYS = {DHCP4: 'subnet4', DHCP6: 'subnet6'}
+
+# Key under "user-context" marking the subnets and interfaces we own.
+MANAGED_TAG = 'vlan-manager'
+
+# Top-level server settings that cannot be changed through the control
+# socket itself: replacing the socket mid-command would cut us off.
+RESTART_KEYS = ('control-socket',)
+
+
+# Subnet ids for VLANs on non-default trunks: each trunk gets a block of
+# 4096 ids picked by a hash of its name, staying below Kea's 2^32 - 1 limit.
+SUBNET_ID_BLOCK = 4096
+SUBNET_ID_BLOCKS = 2 ** 20 - 2
+
+
+class KeaControlError(Exception):
+    pass
+
+
+class KeaControl:
+    """Minimal client for Kea's JSON command channel over a unix socket."""
+
+    def __init__(self, socket_path, timeout=10.0):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def command(self, command, arguments=None):
+        """Send ``command`` and return the response's ``arguments``.
+
+        Raises KeaControlError when Kea reports a failure and OSError when
+        the socket cannot be reached.
+        """
+        request = {"command": command}
+        if arguments is not None:
+            request["arguments"] = arguments
+
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            sock.sendall(json.dumps(request).encode())
+            response = self._read_response(sock)
+
+        if isinstance(response, list):
+            response = response[0] if response else {}
+        result = response.get('result')
+        if result not in (RESULT_SUCCESS, RESULT_EMPTY):
+            raise KeaControlError(f"Kea '{command}' failed ({result}): {response.get('text')}")
+        return response.get('arguments')
+
+    @staticmethod
+    def _read_response(sock):
+        buffer = b''
+        while True:
+            chunk = sock.recv(65536)
+            if chunk:
+                buffer += chunk
+            try:
+                return json.loads(buffer.decode())
+            except ValueError:
+                if not chunk:
+                    raise KeaControlError(f"Incomplete response from Kea: {buffer[:200]!r}")
+
+
+def subnet_id(vlan):
+    """Stable Kea subnet id for a VLAN.
+
+    VLANs on the default trunk keep their VLAN ID, so existing leases stay
+    attached to their subnets.
+    """
+    parent = vlan.get('parent')
+    if not parent:
+        return int(vlan['id'])
+    block = zlib.crc32(parent.encode()) % SUBNET_ID_BLOCKS + 1
+    return block * SUBNET_ID_BLOCK + int(vlan['id'])
+
+
+def needs_restart(previous, desired, server=DHCP4):
+    """True if moving from ``previous`` to ``desired`` cannot be hot-reloaded."""
+    if previous is None:
+        return True
+    old = previous.get(server, {})
+    new = desired.get(server, {})
+    return any(old.get(key) != new.get(key) for key in RESTART_KEYS)
+
+
+def parse_config(text):
+    """Parse a Kea config file, which may contain //, # and /* */ comments.
+
+    Returns None for missing or unparsable input.
+    """
+    if not text:
+        return None
+    try:
+        return json.loads(strip_comments(text))
+    except ValueError:
+        return None
+
+
+def strip_comments(text):
+    out = []
+    i = 0
+    n = len(text)
+    in_string = False
+    while i < n:
+        c = text[i]
+        if in_string:
+            out.append(c)
+            if c == '\\' and i + 1 < n:
+                out.append(text[i + 1])
+                i += 2
+                continue
+            if c == '"':
+                in_string = False
+            i += 1
+        elif c == '"':
+            in_string = True
+            out.append(c)
+            i += 1
+        elif c == '#' or text.startswith('//', i):
+            end = text.find('\n', i)
+            i = n if end == -1 else end
+        elif text.startswith('/*', i):
+            end = text.find('*/', i + 2)
+            i = n if end == -1 else end + 2
+        else:
+            out.append(c)
+            i += 1
+    return ''.join(out)
+
+
+def is_managed(subnet):
+    return MANAGED_TAG in (subnet.get('user-context') or {})
+
+
+def merge_config(existing, generated, server=DHCP4):
+    """Fold the generated subnets and interfaces into an existing config.
+
+    Everything we do not own (lease database, lifetimes, hooks,
+    multi-threading, hand-written subnets, other interfaces) is kept as
+    is. Managed subnets are recognised by their user-context tag, managed
+    interfaces by the list recorded in the global user-context on the
+    previous merge. A control socket is only added if none is configured.
+    """
+    merged = copy.deepcopy(existing) if existing else {}
+    dhcp = merged.setdefault(server, {})
+    new = generated[server]
+    subnet_key = SUBNET_KEYS[server]
+
+    managed_subnets = new.get(subnet_key, [])
+    managed_ids = {s['id'] for s in managed_subnets}
+    kept = [s for s in dhcp.get(subnet_key, []) if not is_managed(s)]
+    for subnet in kept:
+        if subnet.get('id') in managed_ids:
+            raise ValueError(f"Kea subnet id {subnet['id']} ({subnet.get('subnet')}) is already used "
+                             f"by a subnet not managed by the VLAN manager")
+    dhcp[subnet_key] = kept + managed_subnets
+
+    context = dhcp.setdefault('user-context', {})
+    previously_managed = set((context.get(MANAGED_TAG) or {}).get('interfaces', []))
+    managed_interfaces = new.get('interfaces-config', {}).get('interfaces', [])
+    interfaces_config = dhcp.setdefault('interfaces-config', {})
+    interfaces = [i for i in interfaces_config.get('interfaces', [])
+                  if i not in previously_managed and i not in managed_interfaces]
+    interfaces_config['interfaces'] = interfaces + managed_interfaces
+    context[MANAGED_TAG] = {"interfaces": managed_interfaces}
+
+    for key, value in new.items():
+        if key not in (subnet_key, 'interfaces-config'):
+            dhcp.setdefault(key, value)
+    return merged
+
+
+def control_socket_path(config, default=None, server=DHCP4):
+    """The unix socket named in ``config``, falling back to ``default``."""
+    socket_config = (config or {}).get(server, {}).get('control-socket') or {}
+    return socket_config.get('socket-name') or default
@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import bisect
+import logging
+import threading
+from contextlib import contextmanager
+from .config import Config
+from .files import write_atomic
+from .jobs import _pid_alive
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._values)
+
+    @staticmethod
+    def merge(a, b):
+        return a + b
+
+    def samples(self, values):
+        for key, value in sorted(values.items()):
+            yield self.name, self.labelnames, key, value
+
+
+class Histogram(Counter):
+    """Cumulative-bucket histogram; values are stored as per-bucket counts."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # one slot per bucket, +Inf, then sum
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[i] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(time.monotonic() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return {k: list(v) for k, v in self._values.items()}
+
+    @staticmethod
+    def merge(a, b):
+        return [x + y for x, y in zip(a, b)]
+
+    def samples(self, values):
+        for key, state in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), state[:-1]):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else _format_value(bound)
+                yield f"{self.name}_bucket", self.labelnames + ('le',), key + (le,), cumulative
+            yield f"{self.name}_sum", self.labelnames, key, state[-1]
+            yield f"{self.name}_count", self.labelnames, key, cumulative
+
+
+class Gauge:
+    """A value computed by ``func`` when the registry is rendered.
+
+    ``func`` returns a number, or a dict of label-value tuples to numbers
+    when ``labelnames`` is given. Nothing is computed between scrapes.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, func, labelnames=()):
+        self.name = name
+        self.help = help
+        self.func = func
+        self.labelnames = tuple(labelnames)
+
+    def samples(self, values=None):
+        value = self.func()
+        if not self.labelnames:
+            value = {(): value}
+        for key, v in sorted(value.items()):
+            yield self.name, self.labelnames, key, v
+
+
+class Registry:
+    """Process-wide metrics rendered in the Prometheus text format.
+
+    Each gunicorn worker only sees its own counters. When METRICS_DIR is
+    set, every process writes a snapshot there as it records metrics (at
+    most every METRICS_FLUSH_INTERVAL seconds) and a scrape sums the
+    snapshots of all live processes with its own values, so other workers'
+    numbers can lag by up to that interval.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter(name, help, labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help, labelnames, buckets))
+
+    def gauge(self, name, help, func, labelnames=()):
+        return self._register(Gauge(name, help, func, labelnames))
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if isinstance(metric, Gauge) or existing is None:
+                self._metrics[metric.name] = metric
+                return metric
+            return existing
+
+    def snapshot(self):
+        """Values of all counters and histograms, keyed by metric name."""
+        return {name: m.snapshot() for name, m in self._metrics.items() if not isinstance(m, Gauge)}
+
+    def render(self):
+        values = self.snapshot()
+        for other in self._other_processes():
+            for name, entries in other.items():
+                metric = self._metrics.get(name)
+                if metric is None or isinstance(metric, Gauge):
+                    continue
+                mine = values.setdefault(name, {})
+                for labels, value in entries:
+                    key = tuple(labels)
+                    mine[key] = metric.merge(mine[key], value) if key in mine else value
+
+        lines = []
+        for name, metric in sorted(self._metrics.items()):
+            try:
+                samples = list(metric.samples(values.get(name, {})))
+            except Exception as e:
+                logger.warning(f"Could not collect metric {name}: {e}")
+                continue
+            lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            for sample, labelnames, key, value in samples:
+                lines.append(f"{sample}{_format_labels(labelnames, key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def maybe_flush(self):
+        """Write this process's snapshot to METRICS_DIR if it is due."""
+        directory = Config.METRICS_DIR
+        if not directory:
+            return
+        now = time.monotonic()
+        if now - self._last_flush < Config.METRICS_FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        self.flush(directory)
+
+    def flush(self, directory=None):
+        directory = directory or Config.METRICS_DIR
+        data = {name: [[list(k), v] for k, v in values.items()] for name, values in self.snapshot().items()}
+        try:
+            write_atomic(os.path.join(directory, f"{os.getpid()}.json"), json.dumps(data))
+        except OSError as e:
+            logger.warning(f"Could not write metrics snapshot: {e}")
+
+    def _other_processes(self):
+        directory = Config.METRICS_DIR
+        if not directory or not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            pid = name[:-5] if name.endswith('.json') else ''
+            if not pid.isdigit() or int(pid) == os.getpid():
+                continue
+            path = os.path.join(directory, name)
+            if not _pid_alive(int(pid)):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(path, 'r') as f:
+                    yield json.load(f)
+            except (OSError, ValueError):
+                continue
+
+
+def _label_key(labelnames, labels):
+    return tuple(str(labels.get(name, '')) for name in labelnames)
+
+
+def _format_labels(labelnames, key):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, key):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+
+def _format_value(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value)) if abs(value) < 1e15 else repr(value)
+    return str(value)
+
+
+REGISTRY = Registry()
+
+APPLY_STEP_SECONDS = REGISTRY.histogram(
+    'vlan_manager_apply_step_seconds', 'Duration of each apply step.', ['step'])
+APPLY_SECONDS = REGISTRY.histogram(
+    'vlan_manager_apply_seconds', 'Duration of a whole apply.')
+APPLY_FILES = REGISTRY.counter(
+    'vlan_manager_apply_files_total', 'networkd files changed by applies.', ['change'])
+COMMAND_SECONDS = REGISTRY.histogram(
+    'vlan_manager_command_seconds', 'Duration of external commands.', ['command', 'ok'])
+STORE_SECONDS = REGISTRY.histogram(
+    'vlan_manager_store_seconds', 'Duration of VLAN store loads and writes.', ['operation'])
+REQUEST_SECONDS = REGISTRY.histogram(
+    'vlan_manager_http_request_seconds', 'HTTP request latency.', ['route', 'method', 'status'])
+RECONCILE_SECONDS = REGISTRY.histogram(
+    'vlan_manager_reconcile_seconds', 'Duration of reconcile cycles.')
+RECONCILE_DRIFT = REGISTRY.counter(
+    'vlan_manager_reconcile_drift_total', 'Differences found between the host and the VLAN list.', ['component'])
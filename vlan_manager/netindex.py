@@ -0,0 +1,232 @@
+import bisect
+import ipaddress
+
+
+class NetworkIndex:
+    """Sorted address-space index used for VLAN overlap detection.
+
+    CIDR blocks are either disjoint or nested, so everything overlapping a
+    network is either one of its supernets (at most one per prefix length)
+    or starts inside it. Supernets are found with one dict lookup per
+    prefix length and the rest with a bisect over the sorted start
+    addresses, so a query costs O(log n) plus the number of matches.
+    """
+
+    def __init__(self):
+        # version -> sorted list of (start, end, key)
+        self._ranges = {4: [], 6: []}
+        # (version, start, prefixlen) -> list of keys
+        self._prefixes = {}
+        # key -> list of networks indexed for it
+        self._networks = {}
+        # version -> FreeSpaceTree, built on first use by free_space()
+        self._free = {}
+
+    def __len__(self):
+        return len(self._networks)
+
+    def __contains__(self, key):
+        return key in self._networks
+
+    def add(self, key, network):
+        """Index ``network`` (an ip_network or CIDR string) under ``key``."""
+        network = _as_network(network)
+        start = int(network.network_address)
+        end = int(network.broadcast_address)
+        bisect.insort(self._ranges[network.version], (start, end, key))
+        self._prefixes.setdefault((network.version, start, network.prefixlen), []).append(key)
+        self._networks.setdefault(key, []).append(network)
+        if network.version in self._free:
+            self._free[network.version].mark(network)
+
+    def remove(self, key):
+        """Drop every network indexed under ``key``. Unknown keys are ignored."""
+        for network in self._networks.pop(key, []):
+            start = int(network.network_address)
+            end = int(network.broadcast_address)
+            ranges = self._ranges[network.version]
+            pos = bisect.bisect_left(ranges, (start, end, key))
+            if pos < len(ranges) and ranges[pos] == (start, end, key):
+                del ranges[pos]
+
+            prefix_key = (network.version, start, network.prefixlen)
+            keys = self._prefixes.get(prefix_key, [])
+            if key in keys:
+                keys.remove(key)
+            if not keys:
+                self._prefixes.pop(prefix_key, None)
+            if network.version in self._free:
+                self._free[network.version].unmark(network)
+
+    def networks(self, key):
+        return list(self._networks.get(key, []))
+
+    def free_space(self, version):
+        """FreeSpaceTree of the indexed ``version`` networks.
+
+        Built on first use and kept up to date by ``add``/``remove`` from
+        then on, so indexes that never allocate don't pay for it.
+        """
+        tree = self._free.get(version)
+        if tree is None:
+            tree = self._free[version] = FreeSpaceTree(version)
+            for networks in self._networks.values():
+                for network in networks:
+                    if network.version == version:
+                        tree.mark(network)
+        return tree
+
+    def overlapping(self, network, exclude=None):
+        """Return ``(key, network)`` pairs overlapping ``network``.
+
+        Entries indexed under ``exclude`` are skipped, which lets callers
+        re-validate an entry against everything but itself.
+        """
+        network = _as_network(network)
+        version = network.version
+        start = int(network.network_address)
+        end = int(network.broadcast_address)
+        bits = network.max_prefixlen
+        found = []
+
+        # Strict supernets: one candidate per shorter prefix length.
+        for prefixlen in range(network.prefixlen):
+            host_bits = bits - prefixlen
+            sup_start = (start >> host_bits) << host_bits
+            for key in self._prefixes.get((version, sup_start, prefixlen), ()):
+                if key != exclude:
+                    found.append((key, self._network_for(key, version, sup_start, prefixlen)))
+
+        # Equal networks and subnets all start inside [start, end]; a
+        # supernet starting at ``start`` does too, but was found above.
+        ranges = self._ranges[version]
+        pos = bisect.bisect_left(ranges, (start,))
+        while pos < len(ranges) and ranges[pos][0] <= end:
+            r_start, r_end, key = ranges[pos]
+            if key != exclude and r_end <= end:
+                prefixlen = bits - (r_end - r_start + 1).bit_length() + 1
+                found.append((key, self._network_for(key, version, r_start, prefixlen)))
+            pos += 1
+
+        return found
+
+    def _network_for(self, key, version, start, prefixlen):
+        for network in self._networks[key]:
+            if (network.version == version and network.prefixlen == prefixlen
+                    and int(network.network_address) == start):
+                return network
+        raise KeyError(key)
+
+
+class FreeSpaceTree:
+    """Buddy-style binary tree over one address family's space.
+
+    Every prefix is a node whose children are its two halves. Only nodes
+    above a used network are stored, each with the size of the largest
+    aligned free block below it; nodes that are not stored are entirely
+    free (unless a used network covers them). Marking a network updates
+    the path to the root and finding the lowest free block walks down
+    once, so both cost O(address bits) whatever the number of networks.
+    Networks may be marked more than once (e.g. a VLAN inside a
+    reservation) and stay used until unmarked as often.
+    """
+
+    def __init__(self, version):
+        self.bits = 32 if version == 4 else 128
+        # (start, prefixlen) -> number of marks
+        self._used = {}
+        # (start, prefixlen) -> largest free block below, for partly used nodes
+        self._largest = {}
+
+    def mark(self, network):
+        node = (int(network.network_address), network.prefixlen)
+        self._used[node] = self._used.get(node, 0) + 1
+        self._update(node)
+
+    def unmark(self, network):
+        node = (int(network.network_address), network.prefixlen)
+        count = self._used.get(node, 0) - 1
+        if count > 0:
+            self._used[node] = count
+            return
+        self._used.pop(node, None)
+        self._update(node)
+
+    def first_free(self, supernet, prefixlen):
+        """Start of the lowest free ``prefixlen`` block in ``supernet``, or None."""
+        start, plen = int(supernet.network_address), supernet.prefixlen
+        for p in range(plen + 1):
+            if (start >> (self.bits - p) << (self.bits - p), p) in self._used:
+                return None
+
+        need = self._size(prefixlen)
+        node = (start, plen)
+        if self._free(node) < need:
+            return None
+        while node[1] < prefixlen:
+            left = (node[0], node[1] + 1)
+            node = left if self._free(left) >= need else (node[0] + self._size(node[1] + 1), node[1] + 1)
+        return node[0]
+
+    def _size(self, prefixlen):
+        return 1 << (self.bits - prefixlen)
+
+    def _free(self, node):
+        if node in self._used:
+            return 0
+        return self._largest.get(node, self._size(node[1]))
+
+    def _update(self, node):
+        start, prefixlen = node
+        while True:
+            self._recompute((start, prefixlen))
+            if prefixlen == 0:
+                break
+            prefixlen -= 1
+            start = start >> (self.bits - prefixlen) << (self.bits - prefixlen)
+
+    def _recompute(self, node):
+        start, prefixlen = node
+        if prefixlen == self.bits:
+            return
+        half = self._size(prefixlen + 1)
+        left = self._free((start, prefixlen + 1))
+        right = self._free((start + half, prefixlen + 1))
+        if left == half and right == half:
+            self._largest.pop(node, None)
+        else:
+            self._largest[node] = max(left, right)
+
+
+def _as_network(network):
+    if isinstance(network, (ipaddress.IPv4Network, ipaddress.IPv6Network)):
+        return network
+    return ipaddress.ip_network(network, strict=False)
+
+
+def vlan_networks(vlan):
+    """The networks a VLAN uses: ``cidr`` and, on dual-stack VLANs, ``cidr6``.
+
+    Raises ValueError (or KeyError without a ``cidr``) for invalid values.
+    """
+    networks = [ipaddress.ip_network(vlan['cidr'], strict=False)]
+    if vlan.get('cidr6'):
+        networks.append(ipaddress.ip_network(vlan['cidr6'], strict=False))
+    return networks
+
+
+def ipv6_interface(vlan):
+    """The VLAN's IPv6 address and prefix as an ip_interface, or None.
+
+    That is ``cidr6`` on dual-stack VLANs and ``cidr`` on IPv6-only ones.
+    """
+    for cidr in (vlan.get('cidr6'), vlan.get('cidr')):
+        if not cidr:
+            continue
+        try:
+            iface = ipaddress.ip_interface(cidr)
+        except ValueError:
+            continue
+        if iface.version == 6:
+            return iface
+    return None
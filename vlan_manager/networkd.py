@@ -0,0 +1,282 @@
+import os
+import re
+import fnmatch
+from .netindex import ipv6_interface
+
+# Linux interface names are at most 15 bytes (IFNAMSIZ - 1)
+IFNAME_MAX = 15
+IFNAME_RE = re.compile(r'^[A-Za-z0-9_:-][A-Za-z0-9_.:-]*$')
+
+DEFAULT_TRUNK_FILE = re.compile(r'^(10|20)-vlan\d+\.(netdev|network)$')
+DEFAULT_TRUNK_DROPIN = re.compile(r'^vlan-\d+\.conf$')
+TRUNK_NETDEV = re.compile(r'^20-(.+)\.(\d+)\.netdev$')
+
+
+def link_name(vlan):
+    """``vlanN`` on the default trunk, ``<parent>.N`` on the others."""
+    if vlan.get('parent'):
+        return f"{vlan['parent']}.{vlan['id']}"
+    return f"vlan{vlan['id']}"
+
+
+def dropin_name(vlan):
+    if vlan.get('parent'):
+        return f"vlan-{vlan['parent']}.{vlan['id']}.conf"
+    return f"vlan-{vlan['id']}.conf"
+
+
+def check_link_name(parent, vlan_id):
+    """Raise ValueError unless ``parent`` makes a valid link name for ``vlan_id``."""
+    if not IFNAME_RE.match(parent):
+        raise ValueError(f"Invalid parent interface name: {parent}")
+    name = link_name({"parent": parent, "id": vlan_id})
+    if len(name) > IFNAME_MAX:
+        raise ValueError(f"Link name {name} is longer than {IFNAME_MAX} characters; use a shorter parent name")
+
+
+def render_netdev(vlan):
+    return f"""[NetDev]
+Name={link_name(vlan)}
+Kind=vlan
+
+[VLAN]
+Id={vlan['id']}
+"""
+
+
+def render_network(vlan):
+    addresses = f"Address={vlan['cidr']}\n"
+    if vlan.get('cidr6'):
+        addresses += f"Address={vlan['cidr6']}\n"
+    content = f"""[Match]
+Name={link_name(vlan)}
+
+[Network]
+{addresses}DHCPServer=no
+IPMasquerade={'yes' if vlan.get('nat') else 'no'}
+IPForward={'yes' if vlan.get('forwarding', True) else 'no'}
+"""
+    iface6 = ipv6_interface(vlan)
+    if iface6 is not None:
+        content += render_router_advertisement(vlan, iface6.network)
+    return content
+
+
+def render_router_advertisement(vlan, network):
+    """Settings that make networkd send RAs for the VLAN's IPv6 prefix.
+
+    Hosts autoconfigure from /64 prefixes (SLAAC). With ``dhcp6`` the RAs
+    set the managed flag so hosts ask Kea's DHCPv6 server for addresses.
+    """
+    lines = ["IPv6SendRA=yes", ""]
+    if vlan.get('dhcp6'):
+        lines += ["[IPv6SendRA]", "Managed=yes", "OtherInformation=yes", ""]
+    if network.prefixlen == 64:
+        lines += ["[IPv6Prefix]", f"Prefix={network}", ""]
+    return "\n".join(lines)
+
+
+def render_dropin(vlan):
+    return f"""[Network]
+VLAN={link_name(vlan)}
+"""
+
+
+def desired_files(vlans, network_dir, parent_dropin_dir):
+    """Return {path: content} for every networkd file the VLANs need.
+
+    ``vlans`` all belong to the trunk whose drop-in directory is given.
+    """
+    files = {}
+    for vlan in vlans:
+        name = link_name(vlan)
+        files[os.path.join(network_dir, f"20-{name}.netdev")] = render_netdev(vlan)
+        files[os.path.join(network_dir, f"20-{name}.network")] = render_network(vlan)
+        files[os.path.join(parent_dropin_dir, dropin_name(vlan))] = render_dropin(vlan)
+    return files
+
+
+def managed_files(network_dir, parent_dropin_dir, parent=''):
+    """Return the paths of the files on disk the VLAN manager owns for one trunk.
+
+    ``parent`` is '' for the default trunk, whose links are named vlanN.
+    """
+    if parent:
+        prefix = re.escape(parent)
+        file_re = re.compile(rf'^20-{prefix}\.\d+\.(netdev|network)$')
+        dropin_re = re.compile(rf'^vlan-{prefix}\.\d+\.conf$')
+    else:
+        file_re = DEFAULT_TRUNK_FILE
+        dropin_re = DEFAULT_TRUNK_DROPIN
+
+    paths = []
+    if os.path.isdir(network_dir):
+        for f in os.listdir(network_dir):
+            if file_re.match(f):
+                paths.append(os.path.join(network_dir, f))
+
+    if os.path.isdir(parent_dropin_dir):
+        for f in os.listdir(parent_dropin_dir):
+            if dropin_re.match(f):
+                paths.append(os.path.join(parent_dropin_dir, f))
+    return paths
+
+
+def trunks_on_disk(network_dir):
+    """Parents (other than the default trunk) that have VLAN netdevs on disk.
+
+    Only netdevs exactly as we render them count, so a hand-written file
+    that happens to follow the same naming is never taken for ours.
+    """
+    trunks = set()
+    if not os.path.isdir(network_dir):
+        return trunks
+    for name in os.listdir(network_dir):
+        m = TRUNK_NETDEV.match(name)
+        if not m or m.group(1) in trunks:
+            continue
+        try:
+            with open(os.path.join(network_dir, name), 'r') as f:
+                content = f.read()
+        except (OSError, UnicodeDecodeError):
+            continue
+        if content == render_netdev({"parent": m.group(1), "id": int(m.group(2))}):
+            trunks.add(m.group(1))
+    return trunks
+
+
+def parse_match(text):
+    """Return the [Match] settings of a unit file as {key: [values]}.
+
+    Follows systemd's syntax: comments start with # or ;, a trailing
+    backslash continues a line, values are whitespace separated lists that
+    accumulate over repeated keys, and an empty assignment resets the list.
+    Several [Match] sections are merged.
+    """
+    match = {}
+    section = None
+    logical = ''
+    for raw in text.splitlines():
+        line = logical + raw.strip()
+        if line.endswith('\\'):
+            logical = line[:-1] + ' '
+            continue
+        logical = ''
+        if not line or line[0] in '#;':
+            continue
+        if line.startswith('[') and line.endswith(']'):
+            section = line[1:-1].strip()
+            continue
+        if section != 'Match' or '=' not in line:
+            continue
+        key, value = (part.strip() for part in line.split('=', 1))
+        if not value:
+            match[key] = []
+        else:
+            match.setdefault(key, []).extend(value.split())
+    return match
+
+
+def name_matches(patterns, interface):
+    """Whether a Name= list selects ``interface`` (globs and ! inversion)."""
+    if not patterns:
+        return False
+    invert = patterns[0].startswith('!')
+    if invert:
+        patterns = [patterns[0][1:]] + patterns[1:]
+    hit = any(p and fnmatch.fnmatchcase(interface, p) for p in patterns)
+    return hit != invert
+
+
+class NetworkFileIndex:
+    """Find the .network file networkd applies to an interface.
+
+    networkd uses the first file, in lexical order of file names, whose
+    [Match] section selects the link. Files whose [Match] has no Name=
+    condition are ignored, since whether they apply depends on properties
+    other than the name. The directory listing is cached by the directory's
+    (mtime, size) and each file's parsed [Match] by (path, mtime, size), so
+    repeated lookups cost one stat() per file and no reads.
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._matches = {}
+
+    def find(self, network_dir, interface):
+        """Return the file name matching ``interface``, or None."""
+        for name in self._listing(network_dir):
+            match = self._match(os.path.join(network_dir, name))
+            if match is not None and name_matches(match.get('Name'), interface):
+                return name
+        return None
+
+    def _listing(self, network_dir):
+        try:
+            st = os.stat(network_dir)
+        except OSError:
+            return []
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._listings.get(network_dir)
+        if cached is None or cached[0] != key:
+            names = sorted(f for f in os.listdir(network_dir) if f.endswith('.network'))
+            cached = self._listings[network_dir] = (key, names)
+        return cached[1]
+
+    def _match(self, path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._matches.pop(path, None)
+            return None
+        key = (st.st_mtime_ns, st.st_size)
+        cached = self._matches.get(path)
+        if cached is None or cached[0] != key:
+            try:
+                with open(path, 'r') as f:
+                    match = parse_match(f.read())
+            except (OSError, UnicodeDecodeError):
+                match = None
+            cached = self._matches[path] = (key, match)
+        return cached[1]
+
+
+def link_actions(changes, parent_interface):
+    """Work out which links a ChangeSet affects.
+
+    Returns a dict with ``reload`` (any managed file changed; networkd
+    only re-reads its files on reload, reconfigure alone would apply the
+    old ones), ``delete`` (links whose netdev was
+    removed or has to be recreated) and ``reconfigure`` (existing links
+    whose .network file changed, and the parents whose drop-ins changed).
+    ``parent_interface`` is the default trunk's parent; the other trunks'
+    parents are read from the drop-in names.
+    """
+    netdevs = {'created': set(), 'updated': set(), 'removed': set()}
+    networks = set()
+    parents = set()
+
+    for state in ('created', 'updated', 'removed'):
+        for path in getattr(changes, state):
+            name = os.path.basename(path)
+            if name.startswith("vlan-") and name.endswith(".conf"):
+                trunk = name[len("vlan-"):-len(".conf")].rpartition('.')[0]
+                parents.add(trunk or parent_interface)
+                continue
+            stem, ext = os.path.splitext(name)
+            link = stem.split('-', 1)[-1]
+            if ext == ".netdev":
+                netdevs[state].add(link)
+            else:
+                networks.add(link)
+
+    delete = netdevs['updated'] | netdevs['removed']
+    # Links that are created or deleted get their .network applied (or
+    # dropped) as part of that, so only the remaining ones need a kick.
+    reconfigure = (networks - netdevs['created'] - delete) | parents
+
+    return {
+        "reload": changes.changed,
+        "delete": sorted(delete),
+        "reconfigure": sorted(reconfigure),
+    }
@@ -0,0 +1,206 @@
+import json
+import ipaddress
+from .netindex import vlan_networks
+
+TABLE = "inet vlan_mgmt"
+
+# Named sets and their nft element types
+SETS = {
+    "nat_ifaces": "ifname",
+    "nat_sources": "ipv4_addr",
+    "nat_sources6": "ipv6_addr",
+}
+INTERVAL_SETS = ("nat_sources", "nat_sources6")
+
+
+def desired_state(vlans, wan_interface, link_name):
+    """Describe the vlan_mgmt table as data: the WAN link and set elements.
+
+    ``nat`` masquerades a VLAN's IPv4 network and ``nat6`` its IPv6
+    prefix. Networks nested inside another NAT network are dropped, since
+    the outer prefix already matches them and nft rejects overlapping
+    intervals.
+    """
+    ifaces = set()
+    networks = {4: [], 6: []}
+    for vlan in vlans:
+        families = {4} if vlan.get('nat') else set()
+        if vlan.get('nat6'):
+            families.add(6)
+        if not families:
+            continue
+        ifaces.add(link_name(vlan))
+        try:
+            found = vlan_networks(vlan)
+        except (KeyError, ValueError):
+            continue
+        for network in found:
+            if network.version in families:
+                networks[network.version].append(network)
+
+    return {
+        "wan": wan_interface,
+        "sets": {
+            "nat_ifaces": sorted(ifaces),
+            "nat_sources": [str(n) for n in _collapse(networks[4])],
+            "nat_sources6": [str(n) for n in _collapse(networks[6])],
+        },
+    }
+
+
+def chain_rules(wan):
+    """The hook declaration and rules of each chain, in order."""
+    return {
+        "forward": ("type filter hook forward priority 0; policy accept;", [
+            "ct state established,related accept",
+            f'iifname @nat_ifaces oifname "{wan}" accept',
+        ]),
+        "postrouting": ("type nat hook postrouting priority 100; policy accept;", [
+            f'ip saddr @nat_sources oifname "{wan}" masquerade',
+            f'ip6 saddr @nat_sources6 oifname "{wan}" masquerade',
+        ]),
+    }
+
+
+def render_ruleset(state):
+    """Render the full table, replacing whatever is loaded.
+
+    This is the form written to the include file loaded at boot, and used
+    when the live table is missing or not recognised. nft applies the
+    whole file as one transaction.
+    """
+    lines = []
+    lines.append(f"table {TABLE}")
+    lines.append(f"delete table {TABLE}")
+    lines.append(f"table {TABLE} {{")
+
+    for name, set_type in SETS.items():
+        lines.append(f"  set {name} {{")
+        lines.append(f"    type {set_type}")
+        if name in INTERVAL_SETS:
+            lines.append("    flags interval")
+        elements = state['sets'][name]
+        if elements:
+            lines.append(f"    elements = {{ {_elements(name, elements)} }}")
+        lines.append("  }")
+
+    for chain, (hook, rules) in chain_rules(state['wan']).items():
+        lines.append(f"  chain {chain} {{")
+        lines.append(f"    {hook}")
+        for rule in rules:
+            lines.append(f"    {rule}")
+        lines.append("  }")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def render_batch(previous, desired):
+    """Render the smallest nft batch that turns ``previous`` into ``desired``.
+
+    ``previous`` is the live state from ``parse_table`` (None if the table
+    is missing or not recognised, in which case the full ruleset is
+    returned). Otherwise only the changed set elements are sent, plus
+    flush-and-refill of the chains when the WAN interface changed; the
+    table is never deleted, so established flows keep matching. Returns
+    an empty string when nothing needs to change.
+    """
+    if previous is None or previous.get('wan') is None:
+        return render_ruleset(desired)
+
+    lines = []
+    if previous['wan'] != desired['wan']:
+        for chain, (_, rules) in chain_rules(desired['wan']).items():
+            lines.append(f"flush chain {TABLE} {chain}")
+            lines.extend(f"add rule {TABLE} {chain} {rule}" for rule in rules)
+
+    for name in SETS:
+        old = previous['sets'].get(name, [])
+        new = desired['sets'][name]
+        removed = [e for e in old if e not in set(new)]
+        added = [e for e in new if e not in set(old)]
+        if removed:
+            lines.append(f"delete element {TABLE} {name} {{ {_elements(name, removed)} }}")
+        if added:
+            lines.append(f"add element {TABLE} {name} {{ {_elements(name, added)} }}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def parse_table(text):
+    """Read the live state from ``nft -j list table inet vlan_mgmt`` output.
+
+    Returns None if the table is missing. If the sets or chains don't look
+    like ours, the returned state has ``wan`` set to None, which makes
+    ``render_batch`` replace the table.
+    """
+    try:
+        objects = json.loads(text)['nftables']
+    except (ValueError, KeyError, TypeError):
+        return None
+
+    family, table = TABLE.split()
+    sets = {}
+    rules = {}
+    wans = set()
+    found_table = False
+    for obj in objects:
+        kind, body = next(iter(obj.items()))
+        if not isinstance(body, dict) or body.get('table', body.get('name')) != table:
+            continue
+        if body.get('family') != family:
+            continue
+        if kind == 'table':
+            found_table = True
+        elif kind == 'set' and body.get('type') == SETS.get(body.get('name')):
+            sets[body['name']] = _parse_elements(body['name'], body.get('elem', []))
+        elif kind == 'rule':
+            rules[body.get('chain')] = rules.get(body.get('chain'), 0) + 1
+            wans.update(_oifnames(body.get('expr', [])))
+
+    if not found_table:
+        return None
+
+    expected = {chain: len(chain_rules('')[chain][1]) for chain in chain_rules('')}
+    recognised = set(sets) == set(SETS) and rules == expected and len(wans) == 1
+    return {
+        "wan": wans.pop() if recognised else None,
+        "sets": {name: sets.get(name, []) for name in SETS},
+    }
+
+
+def _parse_elements(name, elements):
+    values = []
+    for element in elements:
+        if isinstance(element, dict) and 'elem' in element:
+            element = element['elem'].get('val')
+        if SETS[name] == 'ifname':
+            values.append(element)
+        elif isinstance(element, str):
+            values.append(str(ipaddress.ip_network(element)))
+        elif 'prefix' in element:
+            values.append(f"{element['prefix']['addr']}/{element['prefix']['len']}")
+        elif 'range' in element:
+            first, last = (ipaddress.ip_address(a) for a in element['range'])
+            values.extend(str(n) for n in ipaddress.summarize_address_range(first, last))
+    return values
+
+
+def _oifnames(exprs):
+    for expr in exprs:
+        match = expr.get('match') if isinstance(expr, dict) else None
+        if match and match.get('left') == {"meta": {"key": "oifname"}}:
+            yield match.get('right')
+
+
+def _elements(name, elements):
+    if SETS[name] == "ifname":
+        return ", ".join(f'"{e}"' for e in elements)
+    return ", ".join(elements)
+
+
+def _collapse(networks):
+    collapsed = []
+    for network in sorted(networks):
+        if collapsed and network.subnet_of(collapsed[-1]):
+            continue
+        collapsed.append(network)
+    return collapsed
@@ -0,0 +1,106 @@
+import ipaddress
+from fractions import Fraction
+
+DEFAULT_POOL_RATIO = 0.8
+
+
+def host_range(network):
+    """Return the first and last usable host of ``network`` as integers.
+
+    Mirrors ``network.hosts()`` without iterating it: /31 and /32 (or /127
+    and /128) use every address, IPv4 otherwise skips the network and
+    broadcast addresses and IPv6 skips the Subnet-Router anycast address.
+    """
+    first = int(network.network_address)
+    last = int(network.broadcast_address)
+    if network.prefixlen >= network.max_prefixlen - 1:
+        return first, last
+    if network.version == 4:
+        return first + 1, last - 1
+    return first + 1, last
+
+
+def parse_ranges(text, version=None):
+    """Parse ``"a - b, c"`` into a list of ``(start, end)`` integer ranges."""
+    ranges = []
+    if not text:
+        return ranges
+    for part in str(text).split(','):
+        part = part.strip()
+        if not part:
+            continue
+        bounds = [b.strip() for b in part.split(' - ')] if ' - ' in part else [part]
+        if len(bounds) == 1 and part.count('-') == 1:
+            bounds = [b.strip() for b in part.split('-')]
+        try:
+            addrs = [ipaddress.ip_address(b) for b in bounds]
+        except ValueError:
+            raise ValueError(f"Invalid address range: {part}")
+        if len(addrs) > 2 or (version and any(a.version != version for a in addrs)):
+            raise ValueError(f"Invalid address range: {part}")
+        start, end = int(addrs[0]), int(addrs[-1])
+        if start > end:
+            raise ValueError(f"Invalid address range: {part}")
+        ranges.append((start, end))
+    return ranges
+
+
+def plan_pools(network, ratio=DEFAULT_POOL_RATIO, reserved=(), count=1):
+    """Plan DHCP pool ranges for ``network`` using integer arithmetic only.
+
+    The pool covers the last ``ratio`` of the usable hosts, minus any
+    ``reserved`` ``(start, end)`` ranges (e.g. static leases), optionally
+    split into ``count`` consecutive ranges. Returns a list of integer
+    ``(start, end)`` tuples; an empty list means there is no room for a pool.
+    """
+    ratio = Fraction(str(ratio))
+    if ratio <= 0 or ratio > 1:
+        raise ValueError("DHCP pool ratio must be greater than 0 and at most 1")
+    if count < 1:
+        raise ValueError("DHCP pool count must be at least 1")
+
+    first, last = host_range(network)
+    pool_size = int((last - first + 1) * ratio)
+    if pool_size <= 0:
+        return []
+
+    ranges = _split((last - pool_size + 1, last), count)
+    for r_start, r_end in sorted(reserved):
+        ranges = _subtract(ranges, r_start, r_end)
+    return ranges
+
+
+def format_pools(ranges, version=4):
+    """Render ranges as the ``"start - end"`` strings Kea expects."""
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    return ", ".join(f"{address(start)} - {address(end)}" for start, end in ranges)
+
+
+def default_pools(network, ratio=DEFAULT_POOL_RATIO, reserved=(), count=1):
+    """Shortcut for ``format_pools(plan_pools(...))``."""
+    return format_pools(plan_pools(network, ratio, reserved, count), network.version)
+
+
+def _split(pool, count):
+    start, end = pool
+    size = end - start + 1
+    count = min(count, size)
+    ranges = []
+    for i in range(count):
+        chunk_start = start + size * i // count
+        chunk_end = start + size * (i + 1) // count - 1
+        ranges.append((chunk_start, chunk_end))
+    return ranges
+
+
+def _subtract(ranges, r_start, r_end):
+    result = []
+    for start, end in ranges:
+        if r_end < start or r_start > end:
+            result.append((start, end))
+            continue
+        if start < r_start:
+            result.append((start, r_start - 1))
+        if r_end < end:
+            result.append((r_end + 1, end))
+    return result
@@ -0,0 +1,389 @@
+"""Find and repair drift between the live host and the VLAN list.
+
+Usage:
+    python -m vlan_manager.reconcile [--fix] [--watch] [--json]
+
+Without --watch one check runs and the exit status is 0 when the host is
+in sync (or every difference was repaired), 1 when drift remains and 2
+when live state could not be read.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from .config import Config
+from .commands import run_command
+from .kea import KeaControl, KeaControlError
+from .storage import FileLock
+from .core import VlanManager
+from .jobs import apply_lock
+from . import kea
+from . import networkd
+from . import nftables
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+LINKS = 'links'
+NFTABLES = 'nftables'
+KEA_COMPONENTS = {kea.DHCP4: 'kea', kea.DHCP6: 'kea6'}
+
+MISSING = 'missing'
+UNEXPECTED = 'unexpected'
+CHANGED = 'changed'
+DOWN = 'down'
+UNREACHABLE = 'unreachable'
+
+
+class Reconciler:
+    """Compare the links, nft table and Kea subnets with the rendered VLAN list.
+
+    Every check reads live state with a fixed number of calls (one
+    ``ip``, one ``nft`` and one ``config-get`` per Kea server, each with a
+    timeout), so its cost does not depend on how much drifted. Files on
+    disk are not compared; that is what plan() is for.
+
+    With ``fix`` set, drift is repaired while holding the apply lock:
+    links through networkctl (at most RECONCILE_MAX_FIXES per cycle), the
+    nft table with the same minimal batch apply sends, and Kea by pushing
+    the rendered config or reloading/restarting the server. The
+    background loop checks every RECONCILE_INTERVAL seconds while VLANs
+    change or drift shows up, and doubles the wait up to
+    RECONCILE_MAX_INTERVAL while nothing does.
+    """
+
+    def __init__(self, manager_func, fix=None):
+        self.manager_func = manager_func
+        self._fix = fix
+        self.listeners = []
+        self.interval = None
+        self.last_report = None
+        self._last_revision = None
+        self._last_drift = None
+        self._stop = threading.Event()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    @property
+    def fix(self):
+        return Config.RECONCILE_FIX if self._fix is None else self._fix
+
+    def run_once(self, fix=None, blocking=False):
+        """Check, repair if asked to, and return the report.
+
+        Only one process runs a cycle at a time; without ``blocking`` this
+        returns None when another one is busy.
+        """
+        fix = self.fix if fix is None else fix
+        try:
+            with FileLock(os.path.join(Config.APPLY_JOBS_DIR, '.reconcile.lock'), blocking=blocking):
+                start = time.monotonic()
+                manager = self.manager_func()
+                report, rendered = self._check(manager)
+                if fix and report['drift']:
+                    with apply_lock():
+                        self._repair(manager, rendered, report)
+                report['duration'] = time.monotonic() - start
+        except BlockingIOError:
+            return None
+
+        metrics.RECONCILE_SECONDS.observe(report['duration'])
+        for item in report['drift']:
+            metrics.RECONCILE_DRIFT.inc(component=item['component'])
+        report['next_interval'] = self._next_interval(report)
+        self.last_report = report
+        if report['drift'] or report['errors']:
+            logger.warning(f"Reconcile: {len(report['drift'])} differences, {len(report['fixes'])} fixes, "
+                           f"{len(report['errors'])} errors")
+            self._notify(report)
+        return report
+
+    def check(self):
+        """Report drift without changing anything."""
+        report, _ = self._check(self.manager_func())
+        return report
+
+    def start(self):
+        """Run cycles in a daemon thread until ``stop()``; safe to call repeatedly."""
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._worker, name='reconcile', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Reconcile worker error: {e}")
+            self._stop.wait(self.interval or Config.RECONCILE_INTERVAL)
+
+    def _next_interval(self, report):
+        drift = sorted((d['component'], d['kind'], d['name']) for d in report['drift'])
+        changed = (report['fixes'] or report['revision'] != self._last_revision
+                   or (drift and drift != self._last_drift))
+        self._last_revision = report['revision']
+        self._last_drift = drift
+        if changed or self.interval is None:
+            interval = Config.RECONCILE_INTERVAL
+        else:
+            interval = min(self.interval * 2, Config.RECONCILE_MAX_INTERVAL)
+        # Keep the loop's own cost bounded, e.g. on a slow or overloaded host
+        self.interval = max(interval, report['duration'] * Config.RECONCILE_COST_FACTOR)
+        return self.interval
+
+    def _notify(self, report):
+        for listener in self.listeners:
+            try:
+                listener(report)
+            except Exception as e:
+                logger.warning(f"Reconcile listener failed: {e}")
+
+    def _check(self, manager):
+        start = time.monotonic()
+        rendered = manager.rendered_state()
+        vlans = rendered['vlans']
+        report = {"time": time.time(), "revision": rendered['revision'], "drift": [], "errors": [],
+                  "fixes": [], "deferred": 0}
+        self._check_links(vlans, report)
+        self._check_nftables(rendered['nftables'], report)
+        for server in KEA_COMPONENTS:
+            self._check_kea(manager, server, rendered['kea6' if server == kea.DHCP6 else 'kea'], report)
+        report['duration'] = time.monotonic() - start
+        return report, rendered
+
+    def _check_links(self, vlans, report):
+        result = run_command(['ip', '-j', '-d', 'link', 'show', 'type', 'vlan'], timeout=Config.RECONCILE_TIMEOUT)
+        try:
+            if not result['ok']:
+                raise ValueError(result['output'].strip() or 'ip failed')
+            links = parse_links(result['output'])
+        except ValueError as e:
+            report['errors'].append({"component": LINKS, "message": str(e)})
+            return
+
+        desired = {networkd.link_name(v): (v['id'], v.get('parent') or Config.PARENT_INTERFACE) for v in vlans}
+        trunks = {parent for _, parent in desired.values()} | {Config.PARENT_INTERFACE}
+        for name, (vlan_id, parent) in sorted(desired.items()):
+            link = links.get(name)
+            if link is None:
+                _drift(report, LINKS, MISSING, name, f"VLAN {vlan_id} on {parent} does not exist")
+            elif (link['id'], link['parent']) != (vlan_id, parent):
+                _drift(report, LINKS, CHANGED, name,
+                       f"is VLAN {link['id']} on {link['parent']}, expected VLAN {vlan_id} on {parent}")
+            elif not link['up']:
+                _drift(report, LINKS, DOWN, name, "is administratively down")
+
+        for name, link in sorted(links.items()):
+            if name in desired or link['parent'] not in trunks:
+                continue
+            # Only links named the way we name them; other VLAN links are not ours
+            parent = None if link['parent'] == Config.PARENT_INTERFACE else link['parent']
+            if name == networkd.link_name({"id": link['id'], "parent": parent}):
+                _drift(report, LINKS, UNEXPECTED, name, f"VLAN {link['id']} on {link['parent']} is not configured")
+
+    def _check_nftables(self, desired, report):
+        result = run_command(['nft', '-j', 'list', 'table'] + nftables.TABLE.split(),
+                             timeout=Config.RECONCILE_TIMEOUT)
+        if result['returncode'] is None:
+            report['errors'].append({"component": NFTABLES, "message": result['output'].strip()})
+            return
+        # nft exits non-zero when the table does not exist
+        live = nftables.parse_table(result['output']) if result['ok'] else None
+        if live is None:
+            _drift(report, NFTABLES, MISSING, nftables.TABLE, "table is not loaded")
+            return
+        if live['wan'] is None:
+            _drift(report, NFTABLES, CHANGED, nftables.TABLE, "chains or sets were modified")
+            return
+        if live['wan'] != desired['wan']:
+            _drift(report, NFTABLES, CHANGED, nftables.TABLE, f"masquerades to {live['wan']}, expected {desired['wan']}")
+        for name, elements in desired['sets'].items():
+            missing = sorted(set(elements) - set(live['sets'][name]))
+            extra = sorted(set(live['sets'][name]) - set(elements))
+            if missing or extra:
+                parts = ([f"missing {', '.join(missing)}"] if missing else []) + \
+                        ([f"unexpected {', '.join(extra)}"] if extra else [])
+                _drift(report, NFTABLES, CHANGED, name, '; '.join(parts))
+
+    def _check_kea(self, manager, server, generated, report):
+        component = KEA_COMPONENTS[server]
+        config_file, service, default_socket = manager.kea_server(server)
+        try:
+            with open(config_file, 'r') as f:
+                on_disk = kea.parse_config(f.read())
+        except OSError:
+            on_disk = None
+        subnet_key = kea.SUBNET_KEYS[server]
+        desired = {s['id']: s for s in generated[server][subnet_key]}
+        socket_path = kea.control_socket_path(on_disk or generated, default_socket, server)
+        if (not desired and on_disk is None) or not socket_path:
+            # Unused, or there is no way to ask Kea what it runs
+            return
+
+        try:
+            live = KeaControl(socket_path, timeout=Config.RECONCILE_TIMEOUT).command('config-get')
+        except OSError as e:
+            _drift(report, component, UNREACHABLE, service, f"control socket {socket_path}: {e}")
+            return
+        except KeaControlError as e:
+            report['errors'].append({"component": component, "message": str(e)})
+            return
+
+        running = {s.get('id'): s for s in ((live or {}).get(server) or {}).get(subnet_key, [])
+                   if kea.is_managed(s)}
+        for subnet_id, subnet in sorted(desired.items()):
+            other = running.get(subnet_id)
+            if other is None:
+                _drift(report, component, MISSING, str(subnet_id), f"subnet {subnet['subnet']} is not loaded")
+            elif _subnet_signature(other) != _subnet_signature(subnet):
+                _drift(report, component, CHANGED, str(subnet_id), f"subnet {subnet['subnet']} differs")
+        for subnet_id in sorted(set(running) - set(desired), key=str):
+            _drift(report, component, UNEXPECTED, str(subnet_id),
+                   f"subnet {running[subnet_id].get('subnet')} is not configured")
+
+    def _repair(self, manager, rendered, report):
+        components = {}
+        for item in report['drift']:
+            components.setdefault(item['component'], []).append(item)
+
+        if LINKS in components:
+            self._repair_links(components[LINKS], report)
+        if NFTABLES in components:
+            result = manager.apply_nftables(rendered['nftables'])
+            report['fixes'].append(_fix(NFTABLES, result['action'], result))
+        for server, component in KEA_COMPONENTS.items():
+            if component in components:
+                generated = rendered['kea6' if server == kea.DHCP6 else 'kea']
+                self._repair_kea(manager, server, generated, components[component], report)
+
+    def _repair_links(self, items, report):
+        todo = items[:Config.RECONCILE_MAX_FIXES]
+        report['deferred'] += len(items) - len(todo)
+        for item in todo:
+            if item['kind'] in (CHANGED, UNEXPECTED):
+                result = run_command(['networkctl', 'delete', item['name']], timeout=Config.RECONCILE_TIMEOUT)
+                report['fixes'].append(_fix(LINKS, 'delete', result, item['name']))
+        # networkd recreates missing netdevs from their files on reload
+        if any(item['kind'] in (MISSING, CHANGED) for item in todo):
+            result = run_command(['networkctl', 'reload'], timeout=Config.RECONCILE_TIMEOUT)
+            report['fixes'].append(_fix(LINKS, 'reload', result))
+        for item in todo:
+            if item['kind'] == DOWN:
+                result = run_command(['networkctl', 'reconfigure', item['name']], timeout=Config.RECONCILE_TIMEOUT)
+                report['fixes'].append(_fix(LINKS, 'reconfigure', result, item['name']))
+
+    def _repair_kea(self, manager, server, generated, items, report):
+        component = KEA_COMPONENTS[server]
+        config_file, service, default_socket = manager.kea_server(server)
+        if any(item['kind'] == UNREACHABLE for item in items):
+            result = run_command(['systemctl', 'restart', service], timeout=Config.RECONCILE_TIMEOUT)
+            report['fixes'].append(_fix(component, 'restart', result))
+            return
+        # Rewrites the file and pushes it when the file is stale too
+        result = manager.apply_kea(generated, server)
+        if result['action'] == 'unchanged':
+            # The file is right but Kea runs something else, e.g. after a manual config-set
+            result = {"ok": True, "output": ""}
+            try:
+                with open(config_file, 'r') as f:
+                    config = kea.parse_config(f.read())
+                socket_path = kea.control_socket_path(config, default_socket, server)
+                KeaControl(socket_path, timeout=Config.RECONCILE_TIMEOUT).command('config-set', config)
+                action = 'config-set'
+            except (OSError, TypeError, KeaControlError) as e:
+                logger.warning(f"Kea config-set failed, restarting {service}: {e}")
+                result = run_command(['systemctl', 'restart', service], timeout=Config.RECONCILE_TIMEOUT)
+                action = 'restart'
+        else:
+            action = result['action']
+        report['fixes'].append(_fix(component, action, result))
+
+
+def parse_links(text):
+    """{name: {"id", "parent", "up"}} of the VLAN links in ``ip -j -d link`` output."""
+    try:
+        entries = json.loads(text or '[]')
+    except ValueError:
+        raise ValueError("Could not parse ip link output")
+    links = {}
+    for entry in entries:
+        info = entry.get('linkinfo') or {}
+        if info.get('info_kind') != 'vlan':
+            continue
+        links[entry['ifname']] = {
+            "id": (info.get('info_data') or {}).get('id'),
+            "parent": entry.get('link'),
+            "up": 'UP' in entry.get('flags', []),
+        }
+    return links
+
+
+def _subnet_signature(subnet):
+    """The parts of a subnet we configure, normalised the way config-get returns them."""
+    return (
+        subnet.get('subnet'),
+        subnet.get('interface'),
+        sorted(p.get('pool', '').replace(' ', '') for p in subnet.get('pools', [])),
+        sorted((o.get('name'), str(o.get('data', '')).replace(' ', '')) for o in subnet.get('option-data', [])),
+    )
+
+
+def _drift(report, component, kind, name, detail):
+    report['drift'].append({"component": component, "kind": kind, "name": name, "detail": detail})
+
+
+def _fix(component, action, result, name=None):
+    return {"component": component, "action": action, "name": name,
+            "ok": result['ok'], "output": result.get('output', '')}
+
+
+def format_report(report):
+    lines = [f"{d['component']}: {d['kind']} {d['name']}: {d['detail']}" for d in report['drift']]
+    lines += [f"{f['component']}: {f['action']}{' ' + f['name'] if f['name'] else ''} "
+              f"{'ok' if f['ok'] else 'failed: ' + f['output'].strip()}" for f in report['fixes']]
+    lines += [f"{e['component']}: error: {e['message']}" for e in report['errors']]
+    if report['deferred']:
+        lines.append(f"{report['deferred']} repairs deferred to the next cycle")
+    return "\n".join(lines) or "in sync"
+
+
+def exit_status(report):
+    if report['drift'] and not (report['fixes'] and all(f['ok'] for f in report['fixes'])
+                                and not report['deferred']):
+        return 1
+    return 2 if report['errors'] else 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fix', action='store_true', help='repair the drift that is found')
+    parser.add_argument('--watch', action='store_true', help='keep checking, with adaptive backoff')
+    parser.add_argument('--json', action='store_true', help='print reports as JSON')
+    args = parser.parse_args(argv)
+
+    manager = VlanManager()
+    reconciler = Reconciler(lambda: manager, fix=args.fix)
+    while True:
+        report = reconciler.run_once(blocking=True)
+        print(json.dumps(report) if args.json else format_report(report), flush=True)
+        if not args.watch:
+            return exit_status(report)
+        try:
+            time.sleep(reconciler.interval)
+        except KeyboardInterrupt:
+            return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
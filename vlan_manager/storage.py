@@ -0,0 +1,456 @@
+import os
+import json
+import time
+import logging
+import sqlite3
+import fcntl
+import threading
+from .config import Config
+from .files import write_atomic, fsync_dir
+
+logger = logging.getLogger(__name__)
+
+
+class StoreError(Exception):
+    pass
+
+
+def record_key(vlan):
+    """Identity of a stored VLAN: (parent, id), parent '' for the default trunk."""
+    return (vlan.get('parent') or '', int(vlan['id']))
+
+
+def put_op(vlan):
+    return {"op": "put", "vlan": vlan}
+
+
+def delete_op(key):
+    parent, vlan_id = key
+    op = {"op": "delete", "id": vlan_id}
+    if parent:
+        op["parent"] = parent
+    return op
+
+
+def apply_ops(vlans, ops):
+    """Apply journal operations to a record_key-keyed dict of VLANs in place."""
+    for op in ops:
+        if op['op'] == 'put':
+            vlans[record_key(op['vlan'])] = op['vlan']
+        elif op['op'] == 'delete':
+            vlans.pop(record_key(op), None)
+        else:
+            raise StoreError(f"Unknown store operation: {op['op']}")
+    return vlans
+
+
+class FileLock:
+    """Advisory flock() on ``path``, exclusive unless ``shared`` is set.
+
+    Every instance opens its own descriptor, so the lock excludes other
+    threads of the same process as well as other processes. With
+    ``blocking=False`` entering raises BlockingIOError if it is held.
+    """
+
+    def __init__(self, path, shared=False, blocking=True):
+        self.path = path
+        self.shared = shared
+        self.blocking = blocking
+        self._fd = None
+
+    def __enter__(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(self._fd, (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+                        | (0 if self.blocking else fcntl.LOCK_NB))
+        except BaseException:
+            os.close(self._fd)
+            raise
+        return self
+
+    def __exit__(self, *exc):
+        try:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+
+
+class BaseStore:
+    """Locking and change detection shared by all backends.
+
+    ``generation()`` is a token built from ``stat()`` of the backing files;
+    it changes whenever another process writes, which lets readers skip
+    reparsing when nothing happened. Writers hold ``lock()`` across their
+    read-validate-write cycle so concurrent processes cannot interleave.
+
+    ``revision()`` counts the writes made through the store. Unlike the
+    generation it only ever increases, so clients can compare it (e.g. as
+    an ETag). File backends keep it in ``path + '.rev'``; edits made to the
+    data files by hand do not advance it.
+    """
+
+    indexed = False
+
+    def __init__(self, path):
+        self.path = path
+
+    def lock(self, shared=False):
+        return FileLock(self.path + '.lock', shared=shared)
+
+    def watched_files(self):
+        return [self.path]
+
+    def revision(self):
+        try:
+            with open(self.path + '.rev', 'r') as f:
+                return int(f.read().strip() or 0)
+        except (OSError, ValueError):
+            return 0
+
+    def _bump_revision(self):
+        write_atomic(self.path + '.rev', f"{self.revision() + 1}\n")
+
+    def generation(self):
+        token = []
+        for path in self.watched_files():
+            try:
+                st = os.stat(path)
+                token.append((st.st_ino, st.st_mtime_ns, st.st_size))
+            except FileNotFoundError:
+                token.append(None)
+        return tuple(token)
+
+
+class JsonFileStore(BaseStore):
+    """The original format: the whole VLAN list in one JSON file.
+
+    Every commit rewrites the file, but always through a temp file and
+    rename so a crash can no longer leave it half written.
+    """
+
+    def load(self):
+        return _read_snapshot(self.path)
+
+    def commit(self, ops, snapshot):
+        self.save(snapshot())
+
+    def save(self, vlans):
+        write_atomic(self.path, json.dumps(vlans, indent=4), sync_dir=True)
+        self._bump_revision()
+
+
+class JournalStore(BaseStore):
+    """Snapshot plus append-only operation log.
+
+    ``path`` holds a compacted snapshot in the same JSON list format as
+    JsonFileStore; mutations are appended as one JSON line per operation to
+    ``path + '.journal'`` and fsynced. Once the journal holds
+    ``compact_interval`` operations a fresh snapshot is written and the
+    journal truncated. Operations are idempotent, so a crash between those
+    two steps only replays a few operations that are already applied.
+    """
+
+    def __init__(self, path, compact_interval=None):
+        super().__init__(path)
+        self.journal_path = path + '.journal'
+        self.compact_interval = compact_interval or Config.STORE_COMPACT_INTERVAL
+        self._journal_ops = 0
+
+    def watched_files(self):
+        return [self.path, self.journal_path]
+
+    def load(self):
+        vlans = {}
+        try:
+            snapshot = _read_snapshot(self.path)
+        except StoreError:
+            # The journal is only meaningful on top of its snapshot.
+            if os.path.exists(self.journal_path):
+                _quarantine(self.journal_path)
+            raise
+        for v in snapshot:
+            vlans[record_key(v)] = v
+        ops = self._read_journal()
+        apply_ops(vlans, ops)
+        self._journal_ops = len(ops)
+        return list(vlans.values())
+
+    def commit(self, ops, snapshot):
+        if not ops:
+            return
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        self._drop_torn_tail()
+        payload = "".join(json.dumps(op) + "\n" for op in ops)
+        with open(self.journal_path, 'a') as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_ops += len(ops)
+        if self._journal_ops >= self.compact_interval:
+            self.save(snapshot())
+        else:
+            self._bump_revision()
+
+    def save(self, vlans):
+        """Write a compacted snapshot and truncate the journal."""
+        write_atomic(self.path, json.dumps(vlans, indent=4), sync_dir=True)
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, 'w') as f:
+                os.fsync(f.fileno())
+        self._journal_ops = 0
+        self._bump_revision()
+
+    def _read_journal(self):
+        if not os.path.exists(self.journal_path):
+            return []
+        with open(self.journal_path, 'r') as f:
+            lines = f.read().splitlines(keepends=True)
+
+        ops = []
+        for i, line in enumerate(lines):
+            try:
+                if not line.endswith('\n'):
+                    raise ValueError("incomplete entry")
+                if line.strip():
+                    ops.append(json.loads(line))
+            except ValueError:
+                if i < len(lines) - 1:
+                    _quarantine(self.journal_path)
+                    raise StoreError(f"Corrupt entry on line {i + 1} of {self.journal_path}")
+                # A torn final write from a crash. Readers only skip it; the
+                # next commit cuts it off under the exclusive lock.
+                logger.warning(f"Ignoring incomplete last entry in {self.journal_path}")
+                break
+        return ops
+
+    def _drop_torn_tail(self):
+        """Cut an incomplete last entry so the next append starts on a clean line."""
+        try:
+            f = open(self.journal_path, 'rb+')
+        except FileNotFoundError:
+            return
+        with f:
+            end = f.seek(0, os.SEEK_END)
+            if end == 0:
+                return
+            f.seek(end - 1)
+            if f.read(1) == b'\n':
+                return
+            cut = 0
+            pos = end
+            while pos > 0:
+                start = max(0, pos - 8192)
+                f.seek(start)
+                newline = f.read(pos - start).rfind(b'\n')
+                if newline != -1:
+                    cut = start + newline + 1
+                    break
+                pos = start
+            logger.warning(f"Discarding incomplete last entry in {self.journal_path}")
+            f.truncate(cut)
+            os.fsync(f.fileno())
+
+
+def _read_snapshot(path):
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            vlans = json.load(f)
+        if not isinstance(vlans, list):
+            raise ValueError("expected a list of VLANs")
+        return vlans
+    except ValueError as e:
+        # Move the damaged file aside so the next save cannot overwrite it.
+        moved = _quarantine(path)
+        raise StoreError(f"Corrupt VLAN data in {path} ({e}); preserved as {moved}")
+
+
+def _quarantine(path):
+    moved = f"{path}.corrupt-{int(time.time())}"
+    os.replace(path, moved)
+    fsync_dir(os.path.dirname(path) or '.')
+    return moved
+
+
+class SqliteStore(BaseStore):
+    """VLANs in an SQLite database, one row per VLAN.
+
+    Besides the JSON document each row carries indexed columns for the
+    nat/dhcp/forwarding flags, so filtered listings are index scans.
+    Overlap checks use the manager's in-memory NetworkIndex, which also
+    covers cidr6. The database runs in WAL mode so several gunicorn
+    workers can read while one writes.
+
+    When the database is created and ``legacy_path`` points at an existing
+    JSON data file, its VLANs are imported once.
+    """
+
+    indexed = True
+    SCHEMA_VERSION = 3
+    FILTER_COLUMNS = ('nat', 'dhcp', 'forwarding')
+
+    def __init__(self, path, legacy_path=None):
+        super().__init__(path)
+        self.legacy_path = legacy_path
+        self._local = threading.local()
+        self._migrate_schema()
+        if legacy_path and not self._get_meta('migrated_from'):
+            self.import_json(legacy_path)
+
+    def watched_files(self):
+        return [self.path, self.path + '-wal']
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _migrate_schema(self):
+        conn = self._connect()
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.SCHEMA_VERSION:
+            return
+        with _transaction(conn):
+            if version in (1, 2):
+                # v2 keys VLANs by (parent, id) and v3 drops the unused
+                # network range columns; SQLite cannot change a primary key
+                # or drop indexed columns in place, so the table is rebuilt.
+                conn.execute("ALTER TABLE vlans RENAME TO vlans_old")
+                for index in ('vlans_network', 'vlans_nat', 'vlans_dhcp', 'vlans_forwarding', 'vlans_position'):
+                    conn.execute(f"DROP INDEX IF EXISTS {index}")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS vlans (
+                    parent TEXT NOT NULL DEFAULT '',
+                    id INTEGER NOT NULL,
+                    position INTEGER NOT NULL,
+                    nat INTEGER NOT NULL DEFAULT 0,
+                    dhcp INTEGER NOT NULL DEFAULT 0,
+                    forwarding INTEGER NOT NULL DEFAULT 0,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (parent, id)
+                )""")
+            if version in (1, 2):
+                parent = "''" if version == 1 else "parent"
+                conn.execute(f"""
+                    INSERT INTO vlans (parent, id, position, nat, dhcp, forwarding, data)
+                    SELECT {parent}, id, position, nat, dhcp, forwarding, data
+                    FROM vlans_old""")
+                conn.execute("DROP TABLE vlans_old")
+            conn.execute("CREATE INDEX IF NOT EXISTS vlans_nat ON vlans (nat)")
+            conn.execute("CREATE INDEX IF NOT EXISTS vlans_dhcp ON vlans (dhcp)")
+            conn.execute("CREATE INDEX IF NOT EXISTS vlans_forwarding ON vlans (forwarding)")
+            conn.execute("CREATE INDEX IF NOT EXISTS vlans_position ON vlans (position)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def revision(self):
+        return int(self._get_meta('revision') or 0)
+
+    def _bump_revision(self, conn):
+        conn.execute("INSERT INTO meta (key, value) VALUES ('revision', '1') "
+                     "ON CONFLICT (key) DO UPDATE SET value = CAST(value AS INTEGER) + 1")
+
+    def _get_meta(self, key):
+        row = self._connect().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, conn, key, value):
+        conn.execute("INSERT INTO meta (key, value) VALUES (?, ?) "
+                     "ON CONFLICT (key) DO UPDATE SET value = excluded.value", (key, str(value)))
+
+    def import_json(self, json_path):
+        """One-shot migration of a JSON data file (snapshot plus journal)."""
+        vlans = JournalStore(json_path).load() if os.path.exists(json_path) else []
+        conn = self._connect()
+        with _transaction(conn):
+            if conn.execute("SELECT COUNT(*) FROM vlans").fetchone()[0] == 0:
+                for v in vlans:
+                    self._put(conn, v)
+                if vlans:
+                    logger.info(f"Imported {len(vlans)} VLANs from {json_path} into {self.path}")
+                    self._bump_revision(conn)
+            self._set_meta(conn, 'migrated_from', json_path)
+
+    def load(self):
+        rows = self._connect().execute("SELECT data FROM vlans ORDER BY position")
+        return [json.loads(row[0]) for row in rows]
+
+    def commit(self, ops, snapshot):
+        conn = self._connect()
+        with _transaction(conn):
+            for op in ops:
+                if op['op'] == 'put':
+                    self._put(conn, op['vlan'])
+                elif op['op'] == 'delete':
+                    conn.execute("DELETE FROM vlans WHERE parent = ? AND id = ?", record_key(op))
+                else:
+                    raise StoreError(f"Unknown store operation: {op['op']}")
+            self._bump_revision(conn)
+
+    def save(self, vlans):
+        conn = self._connect()
+        with _transaction(conn):
+            conn.execute("DELETE FROM vlans")
+            for v in vlans:
+                self._put(conn, v)
+            self._bump_revision(conn)
+
+    def query(self, **filters):
+        """Return VLANs whose flags match ``filters`` using the column indexes."""
+        clauses = []
+        params = []
+        for key, value in filters.items():
+            if key not in self.FILTER_COLUMNS:
+                raise ValueError(f"Unsupported filter: {key}")
+            clauses.append(f"{key} = ?")
+            params.append(1 if value else 0)
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+        rows = self._connect().execute(f"SELECT data FROM vlans{where} ORDER BY position", params)
+        return [json.loads(row[0]) for row in rows]
+
+    def _put(self, conn, vlan):
+        conn.execute("""
+            INSERT INTO vlans (parent, id, position, nat, dhcp, forwarding, data)
+            VALUES (?, ?, (SELECT COALESCE(MAX(position), 0) + 1 FROM vlans), ?, ?, ?, ?)
+            ON CONFLICT (parent, id) DO UPDATE SET
+                nat = excluded.nat, dhcp = excluded.dhcp, forwarding = excluded.forwarding,
+                data = excluded.data""",
+            record_key(vlan) + (int(bool(vlan.get('nat'))), int(bool(vlan.get('dhcp'))),
+                                int(bool(vlan.get('forwarding'))), json.dumps(vlan)))
+
+
+class _transaction:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        self.conn.execute("BEGIN IMMEDIATE")
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        self.conn.execute("ROLLBACK" if exc_type else "COMMIT")
+
+
+STORE_BACKENDS = {
+    'json': JsonFileStore,
+    'journal': JournalStore,
+}
+
+
+def create_store(path, backend=None):
+    backend = backend or Config.STORE_BACKEND
+    if backend == 'sqlite':
+        return SqliteStore(Config.SQLITE_FILE, legacy_path=path)
+    try:
+        store_class = STORE_BACKENDS[backend]
+    except KeyError:
+        raise ValueError(f"Unknown store backend: {backend}")
+    return store_class(path)